@@ -1,57 +1,145 @@
 # bot/access.py
 
 import json
+import logging
+import os
+import threading
+import time
 from pathlib import Path
 
+logger = logging.getLogger("bot.access")
+
 USERS_FILE = Path("users.json")
 
+RELOAD_INTERVAL = 1.0   # не чаще раза в секунду проверяем mtime users.json
+
+
+def _env_ids(*names) -> set:
+    ids = set()
+    for name in names:
+        for part in os.getenv(name, "").split(","):
+            part = part.strip()
+            if part.lstrip("-").isdigit():
+                ids.add(int(part))
+    return ids
+
+
+class AccessControl:
+    """
+    Единый список доступа для бота и FastAPI.
+
+    Пользователи из users.json держатся в памяти (set), файл
+    перечитывается только при смене mtime. К ним добавляются ADMIN_ID
+    и ALLOWED_IDS из окружения (читаются один раз).
+    """
+
+    def __init__(self, users_file: Path):
+        self.users_file = users_file
+        self.admins = _env_ids("ADMIN_ID")
+        self.env_users = _env_ids("ALLOWED_IDS") | self.admins
+        self._users = frozenset()
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    # ==============================
+    # Чтение
+    # ==============================
+    def _reload(self):
+        try:
+            mtime = self.users_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.ensure_file()
+            mtime = self.users_file.stat().st_mtime_ns
+        if mtime == self._mtime:
+            return
+        try:
+            data = json.loads(self.users_file.read_text(encoding="utf-8"))
+            self._users = frozenset(int(u) for u in data.get("users", []))
+            logger.info(f"Loaded {len(self._users)} users from {self.users_file}")
+        except Exception as e:
+            # битый файл — оставляем прежний список
+            logger.warning(f"Cannot read {self.users_file}: {e}")
+        self._mtime = mtime
+
+    def _users_now(self) -> frozenset:
+        now = time.monotonic()
+        if now - self._checked >= RELOAD_INTERVAL:
+            with self._lock:
+                if now - self._checked >= RELOAD_INTERVAL:
+                    self._reload()
+                    self._checked = now
+        return self._users
+
+    def check(self, user_id: int) -> bool:
+        return user_id in self.env_users or user_id in self._users_now()
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins
+
+    def users(self) -> set:
+        return set(self._users_now()) | self.env_users
+
+    # ==============================
+    # Запись
+    # ==============================
+    def ensure_file(self):
+        if not self.users_file.exists():
+            self._write([])
+
+    def _write(self, users: list):
+        tmp = self.users_file.with_name(self.users_file.name + ".tmp")
+        tmp.write_text(json.dumps({"users": users}, indent=4, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.users_file)
+
+    def _modify(self, user_id: int, add: bool) -> bool:
+        with self._lock:
+            self._reload()
+            users = set(self._users)
+            if (user_id in users) == add:
+                return False
+            if add:
+                users.add(user_id)
+            else:
+                users.discard(user_id)
+            self._write(sorted(users))
+            self._users = frozenset(users)
+            self._mtime = self.users_file.stat().st_mtime_ns
+            return True
+
+    def add(self, user_id: int) -> bool:
+        return self._modify(user_id, add=True)
+
+    def remove(self, user_id: int) -> bool:
+        return self._modify(user_id, add=False)
+
+
+access = AccessControl(USERS_FILE)
+
 
 def ensure_users_file():
     """
     Создаёт users.json, если он отсутствует.
     """
-    if not USERS_FILE.exists():
-        USERS_FILE.write_text(
-            json.dumps({"users": []}, indent=4, ensure_ascii=False),
-            encoding="utf-8"
-        )
+    access.ensure_file()
 
 
 def check_access(user_id: int) -> bool:
     """
     Проверяет, есть ли доступ у пользователя.
     """
-    ensure_users_file()
-
-    data = json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    return user_id in data.get("users", [])
+    return access.check(user_id)
 
 
 def add_user(user_id: int):
     """
     Добавление пользователя в users.json
     """
-    ensure_users_file()
-
-    data = json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    if user_id not in data.get("users", []):
-        data["users"].append(user_id)
-        USERS_FILE.write_text(
-            json.dumps(data, indent=4, ensure_ascii=False),
-            encoding="utf-8"
-        )
+    access.add(user_id)
 
 
 def remove_user(user_id: int):
     """
     Удаление пользователя из users.json
     """
-    ensure_users_file()
-
-    data = json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    if user_id in data.get("users", []):
-        data["users"].remove(user_id)
-        USERS_FILE.write_text(
-            json.dumps(data, indent=4, ensure_ascii=False),
-            encoding="utf-8"
-        )
\ No newline at end of file
+    access.remove(user_id)
@@ -0,0 +1,145 @@
+# bot/blobs.py
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from bot.metacache import file_sha256
+
+logger = logging.getLogger("bot.blobs")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+BLOBS = BASE / "blobs"              # blobs/<ab>/<sha256>.ipa, та же ФС, что и packages
+
+
+class BlobStore:
+    """
+    Хранилище IPA по содержимому (SHA-256).
+
+    Файлы в repo/packages и repo/packages/versions — жёсткие ссылки на
+    блоб, поэтому дубликат под другим именем не занимает места, а его
+    метаданные находятся по inode в metacache. Счётчик ссылок — st_nlink
+    самого блоба: блоб с st_nlink == 1 больше никем не используется.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / f"{sha256}.ipa"
+
+    def refcount(self, sha256: str) -> int:
+        try:
+            return self.path_for(sha256).stat().st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def _blobs(self):
+        if not self.root.exists():
+            return
+        for shard in os.scandir(self.root):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".ipa"):
+                        yield entry
+
+    # ==============================
+    # Добавление
+    # ==============================
+    def ingest(self, target: Path, sha256: str = None) -> bool:
+        """
+        Привязывает target к блобу. Если такое содержимое уже есть,
+        target заменяется ссылкой на существующий блоб (True — дубликат).
+        """
+        sha256 = sha256 or file_sha256(target)
+        blob = self.path_for(sha256)
+
+        with self._lock:
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                st = None
+
+            try:
+                if st is None:
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = blob.with_name(blob.name + ".tmp")
+                    tmp.unlink(missing_ok=True)
+                    os.link(target, tmp)
+                    os.replace(tmp, blob)
+                    return False
+
+                if os.path.samestat(st, target.stat()):
+                    return True
+
+                tmp = target.with_name(f".{target.name}.link")
+                tmp.unlink(missing_ok=True)
+                os.link(blob, tmp)
+                os.replace(tmp, target)     # новая копия освобождается здесь
+            except OSError as e:
+                # другая ФС / нет жёстких ссылок — файл остаётся отдельной копией
+                logger.warning(f"Blob store unavailable for {target.name}: {e}")
+                return False
+
+        logger.info(f"{target.name} is a duplicate of blob {sha256[:12]}")
+        return True
+
+    def adopt(self, paths: list = None) -> int:
+        """
+        Переносит в хранилище файлы, которые ещё не ссылаются на блоб
+        (репозиторий до появления blob store). Возвращает число дубликатов.
+        """
+        paths = repo_ipas() if paths is None else paths
+        known = {(st.st_dev, st.st_ino) for st in (e.stat() for e in self._blobs())}
+        started = time.perf_counter()
+        adopted = duplicates = 0
+        for path in paths:
+            st = path.stat()
+            if (st.st_dev, st.st_ino) in known:
+                continue
+            if self.ingest(path):
+                duplicates += 1
+            st = path.stat()
+            known.add((st.st_dev, st.st_ino))
+            adopted += 1
+        if adopted:
+            logger.info(f"Adopted {adopted} IPAs into blob store ({duplicates} duplicates) "
+                        f"in {time.perf_counter() - started:.2f}s")
+        return duplicates
+
+    # ==============================
+    # Сборка мусора
+    # ==============================
+    def gc(self) -> int:
+        """
+        Удаляет блобы без ссылок. Возвращает освобождённые байты.
+        """
+        freed = 0
+        with self._lock:
+            for entry in list(self._blobs()):
+                st = entry.stat()
+                if st.st_nlink <= 1:
+                    os.unlink(entry.path)
+                    freed += st.st_size
+        if freed:
+            logger.info(f"Blob GC freed {freed} bytes")
+        return freed
+
+    def stats(self) -> dict:
+        blobs = [e.stat() for e in self._blobs()]
+        return {
+            "blobs": len(blobs),
+            "bytes": sum(st.st_size for st in blobs),
+            "references": sum(st.st_nlink - 1 for st in blobs),
+        }
+
+
+blob_store = BlobStore(BLOBS)
+
+
+def repo_ipas() -> list:
+    return sorted(PACKAGES.glob("*.ipa")) + sorted(PACKAGES.glob("versions/*/*.ipa"))
@@ -3,7 +3,10 @@
 import logging
 import os
 from dotenv import load_dotenv
+from pathlib import Path
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, BareFilesPathWrapper, SimpleFilesPathWrapper
 
 load_dotenv()
 
@@ -14,16 +17,45 @@ if not BOT_TOKEN:
 logging.getLogger("aiogram").setLevel(logging.INFO)
 logger = logging.getLogger("bot")
 
-bot = Bot(token=BOT_TOKEN)
+# Свой telegram-bot-api (--local): нет лимита 20 МБ, get_file отдаёт путь на диске
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+BOT_API_LOCAL = os.getenv("BOT_API_LOCAL", "1") == "1"
+# "путь_на_сервере:путь_здесь", если каталог сервера смонтирован иначе (Docker)
+BOT_API_FILES_MAP = os.getenv("BOT_API_FILES_MAP", "")
+
+
+def _make_session():
+    if not BOT_API_URL:
+        return None
+    wrapper = BareFilesPathWrapper()
+    if BOT_API_FILES_MAP:
+        server_path, local_path = BOT_API_FILES_MAP.split(":", 1)
+        wrapper = SimpleFilesPathWrapper(Path(server_path), Path(local_path))
+    api = TelegramAPIServer.from_base(BOT_API_URL, is_local=BOT_API_LOCAL, wrap_local_file=wrapper)
+    logger.info(f"Using Bot API server {BOT_API_URL} (local={BOT_API_LOCAL})")
+    return AiohttpSession(api=api)
+
+
+bot = Bot(token=BOT_TOKEN, session=_make_session())
 dp = Dispatcher()
 
 # register handlers (local import)
-from bot.handlers import register_handlers
+from bot.handlers import register_handlers, notify_job
+from bot.download import http_client
+from bot.jobs import job_queue
 register_handlers(dp)
 
+
+async def _notify_job(job):
+    await notify_job(bot, job)
+
+job_queue.on_finish(_notify_job)
+job_queue.bot = bot     # сообщения о прогрессе /fixmeta и /repo
+
 async def start_bot():
     logger.info("Starting Telegram bot (polling)...")
     try:
         await dp.start_polling(bot)
     finally:
+        await http_client.close()
         await bot.session.close()
\ No newline at end of file
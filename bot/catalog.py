@@ -0,0 +1,312 @@
+# bot/catalog.py
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from bot.generation import generation as shared_generation
+from bot.icons import absolute_icons
+from bot.metacache import metacache
+from bot.metrics import INDEX_BUILD, Gauge
+from bot.metadb import atomic_write, backend as default_backend
+from bot.utils import resolve_icon_url
+
+logger = logging.getLogger("bot.catalog")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+INDEX_FILE = BASE / "index.json"
+
+REPO_INFO = {
+    "name": "ProjectBW Repository",
+    "identifier": "projectbw.ksign-repo",
+    "subtitle": "A source for Ksign app",
+    "description": "repo projectbw.ru",
+    "iconURL": "https://raw.githubusercontent.com/bwproject/projectbw-wiki/refs/heads/master/docs/.vuepress/public/images/logo.png",
+    "website": "https://projectbw.ru/ios",
+    "tintColor": "3c94fc",
+}
+
+
+def _stat_key(path: Path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class Catalog:
+    """
+    Каталог приложений в памяти процесса.
+
+    Загружается один раз при старте, дальше обновляется точечно
+    (upload, редактирование, /fixmeta) и отдаёт index.json без
+    повторного чтения всех .json и .ipa.
+    """
+
+    def __init__(self, packages: Path, index_file: Path, backend=None):
+        self.packages = packages
+        self.index_file = index_file
+        # откуда берутся метаданные приложений (bot.metadb: json | sqlite)
+        self.backend = backend or default_backend
+        self._entries = {}      # stem -> {"stamp": ..., "app": {...}}
+        self._sorted = None
+        self._loaded = False
+        # MODE=web: каталог не строится, а читается из index.json,
+        # который пишет процесс бота
+        self.follower = False
+        self.generation = 0
+        # поколение каталога, с которого записан текущий index.json
+        self.published_generation = None
+        # каталог обновляется из пула потоков (bot.workers)
+        self._lock = threading.RLock()
+        self._publish_hooks = []
+        self._write_lock = threading.Lock()
+        # один sync за раз: записи разбираются вне self._lock
+        self._sync_lock = threading.Lock()
+
+    # ==============================
+    # Построение одной записи
+    # ==============================
+    def _build_app(self, ipa: Path, server_url: str) -> dict:
+        raw = self.backend.get(ipa.stem)
+        meta = None
+
+        if raw is not None:
+            try:
+                app_meta = json.loads(raw)
+            except Exception:
+                logger.warning(f"Broken metadata: {ipa.stem}")
+                app_meta = {}
+        else:
+            # извлечение также сохраняет иконку в repo/images
+            meta = metacache.extract(ipa)
+            app_meta = {}
+
+        # гарантируем поля
+        app_meta.setdefault("name", ipa.stem)
+        app_meta.setdefault("bundleIdentifier", f"com.projectbw.{ipa.stem.lower()}")
+        app_meta.setdefault("developerName", "Unknown")
+        app_meta.setdefault("subtitle", "")
+        app_meta.setdefault("tintColor", "3c94fc")
+        app_meta.setdefault("category", "utilities")
+        app_meta.setdefault("localizedDescription", "Описание недоступно.")
+
+        # иконка
+        app_meta["iconURL"] = resolve_icon_url(app_meta, ipa.name, server_url)
+        if "icons" not in app_meta:
+            # старые .json без вариантов — берём из кэша, если IPA уже разобран
+            cached = meta or metacache.get(ipa) or {}
+            if cached.get("icons"):
+                app_meta["icons"] = cached["icons"]
+        if app_meta.get("icons"):
+            app_meta["icons"] = absolute_icons(app_meta["icons"], server_url)
+
+        # версии
+        size = ipa.stat().st_size
+        if "versions" not in app_meta or not app_meta["versions"]:
+            if meta is None:
+                meta = metacache.extract(ipa)
+            app_meta["versions"] = [
+                {
+                    "downloadURL": f"{server_url}/repo/packages/{ipa.name}",
+                    "size": size,
+                    "version": meta.get("version") or "1.0",
+                    "buildVersion": meta.get("build") or "1",
+                    "date": meta.get("date") or "",
+                    "localizedDescription": app_meta.get("localizedDescription", ""),
+                    "minOSVersion": meta.get("min_ios") or "16.0"
+                }
+            ]
+        elif "/repo/packages/versions/" not in app_meta["versions"][0].get("downloadURL", ""):
+            # записи без истории версий указывают на сам <name>.ipa
+            app_meta["versions"][0]["downloadURL"] = f"{server_url}/repo/packages/{ipa.name}"
+            app_meta["versions"][0]["size"] = size
+
+        return app_meta
+
+    def _stamp(self, ipa: Path):
+        return _stat_key(ipa), self.backend.stamp(ipa.stem)
+
+    def _install(self, name: str, stamp, app: dict):
+        # вызывается под self._lock с уже построенной записью
+        self._entries[name] = {"stamp": stamp, "app": app}
+        self._sorted = None
+        self.generation += 1
+
+    def _drop(self, name: str) -> bool:
+        if self._entries.pop(name, None) is None:
+            return False
+        self._sorted = None
+        self.generation += 1
+        return True
+
+    # ==============================
+    # Публичный интерфейс
+    # ==============================
+    def load(self):
+        """
+        Первичная загрузка каталога (один раз на процесс).
+        """
+        if self._loaded:
+            return      # горячий путь без лока: флаг только ставится
+        if not self.follower:
+            self.sync()     # сам ставит _loaded; разбор IPA — вне self._lock
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if self.index_file.exists():
+                self.adopt(json.loads(self.index_file.read_text(encoding="utf-8")))
+
+    def follow_index(self):
+        """
+        Режим только для чтения: записи берутся из index.json (adopt),
+        sync/update/remove ничего не делают.
+        """
+        self.follower = True
+
+    def adopt(self, repo_data: dict):
+        """
+        Подменяет каталог приложениями из готового index.json.
+        Имён .ipa в index.json нет, поэтому names() здесь не осмысленны.
+        """
+        apps = repo_data.get("apps", [])
+        with self._lock:
+            self._entries = {str(i): {"stamp": None, "app": app} for i, app in enumerate(apps)}
+            self._sorted = None
+            self._loaded = True
+            self.generation += 1
+        logger.info(f"Catalog adopted from index.json: {len(apps)} apps")
+
+    def sync(self) -> int:
+        """
+        Сверяет каталог с диском и перестраивает только изменившиеся записи.
+
+        Разбор IPA (metacache.extract) идёт без self._lock: names()/apps()
+        зовутся прямо из event loop и не должны ждать его. Под локом —
+        только сравнение отметок и подстановка готовых записей.
+        """
+        if self.follower:
+            return 0
+        server_url = os.getenv("SERVER_URL", "").rstrip("/")
+        changed = 0
+
+        with self._sync_lock:
+            stamps = {ipa.stem: (ipa, self._stamp(ipa)) for ipa in self.packages.glob("*.ipa")}
+
+            with self._lock:
+                for name in list(self._entries):
+                    if name not in stamps and self._drop(name):
+                        changed += 1
+                stale = []
+                for name, (ipa, stamp) in stamps.items():
+                    entry = self._entries.get(name)
+                    old = entry["stamp"] if entry else None
+                    if stamp[0] is None:
+                        if self._drop(name):
+                            changed += 1
+                    elif old != stamp:
+                        stale.append((ipa, old, stamp))
+
+            for ipa, old, stamp in stale:
+                app = self._build_app(ipa, server_url)
+                with self._lock:
+                    entry = self._entries.get(ipa.stem)
+                    # пока шёл разбор, запись могла обновить update()
+                    if (entry["stamp"] if entry else None) != old:
+                        continue
+                    self._install(ipa.stem, stamp, app)
+                    changed += 1
+
+            with self._lock:
+                if not self._loaded:
+                    logger.info(f"Catalog loaded: {len(self._entries)} apps")
+                self._loaded = True
+
+        metacache.flush()
+        return changed
+
+    def update(self, name: str):
+        """
+        Точечное обновление записи после изменения .ipa или .json.
+        """
+        if self.follower:
+            return
+        server_url = os.getenv("SERVER_URL", "").rstrip("/")
+        ipa = self.packages / f"{Path(name).stem}.ipa"
+        # принудительно перечитываем: mtime мог не смениться в пределах тика
+        stamp = self._stamp(ipa)
+        app = self._build_app(ipa, server_url) if stamp[0] is not None else None
+        with self._lock:
+            if app is None:
+                self._entries.pop(ipa.stem, None)
+                self._sorted = None
+                self.generation += 1
+            else:
+                self._install(ipa.stem, stamp, app)
+
+    def remove(self, name: str):
+        if self.follower:
+            return
+        with self._lock:
+            self._drop(Path(name).stem)
+
+    def names(self) -> list:
+        with self._lock:
+            return sorted(self._entries)
+
+    def apps(self) -> list:
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(
+                    (e["app"] for e in self._entries.values()),
+                    key=lambda x: x["name"].lower()
+                )
+            return self._sorted
+
+    def build_index(self) -> dict:
+        self.load()
+        return {**REPO_INFO, "apps": self.apps()}
+
+    def on_publish(self, hook):
+        """
+        hook(repo_data, index_file) вызывается после каждой записи index.json.
+        """
+        self._publish_hooks.append(hook)
+
+    def dirty(self) -> bool:
+        """
+        Каталог изменился после последней записи index.json.
+        """
+        return self.generation != self.published_generation
+
+    def write_index(self) -> dict:
+        # записи из разных задач не перемешиваются, клиенты видят
+        # либо старый, либо новый index.json (temp + fsync + rename)
+        with self._write_lock, INDEX_BUILD.time():
+            self.load()
+            generation = self.generation
+            repo_data = self.build_index()
+            raw = json.dumps(repo_data, indent=4, ensure_ascii=False).encode("utf-8")
+            atomic_write(self.index_file, raw)
+            self.published_generation = generation
+            # другие процессы (MODE=web) перечитают index.json
+            shared_generation.bump()
+
+        for hook in self._publish_hooks:
+            try:
+                hook(repo_data, self.index_file)
+            except Exception:
+                logger.exception("index publish hook failed")
+        return repo_data
+
+
+catalog = Catalog(PACKAGES, INDEX_FILE)
+
+Gauge("bw_catalog_apps", "Apps in the in-memory catalog.", fn=lambda: len(catalog._entries))
+Gauge("bw_catalog_generation", "Catalog change counter.", fn=lambda: catalog.generation)
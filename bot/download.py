@@ -0,0 +1,226 @@
+# bot/download.py
+
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+from bot.ingest import INCOMING, PACKAGES, MAX_UPLOAD_SIZE, UploadTooLarge, safe_ipa_name
+from bot.metacache import metacache
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.download")
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+DOWNLOAD_PARTS = int(os.getenv("DOWNLOAD_PARTS", "4"))
+MIN_PART_SIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+_CONTENT_RANGE = re.compile(r"bytes\s+\d+-\d+/(\d+)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+# ==============================
+# Общий HTTP-клиент
+# ==============================
+class HttpClient:
+    """
+    Одна aiohttp.ClientSession на процесс: keep-alive соединения и DNS
+    переиспользуются между загрузками вместо новой сессии на документ.
+    """
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self._session = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HttpClient()
+
+
+# ==============================
+# Загрузка
+# ==============================
+async def _probe(session: aiohttp.ClientSession, url: str):
+    """
+    Размер файла, если сервер отдаёт диапазоны (206 + Content-Range), иначе None.
+    """
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as resp:
+        resp.raise_for_status()
+        if resp.status != 206:
+            return None
+        m = _CONTENT_RANGE.match(resp.headers.get("Content-Range", ""))
+        return int(m.group(1)) if m else None
+
+
+async def _fetch_range(session, url: str, fd: int, start: int, end: int):
+    async with session.get(url, headers={"Range": f"bytes={start}-{end}"}) as resp:
+        if resp.status != 206:
+            raise DownloadError(f"Range {start}-{end}: HTTP {resp.status}")
+        offset = start
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            if offset + len(chunk) > end + 1:
+                raise DownloadError(f"Range {start}-{end}: too much data")
+            await run_io(os.pwrite, fd, chunk, offset)
+            offset += len(chunk)
+    if offset != end + 1:
+        raise DownloadError(f"Range {start}-{end}: got {offset - start} bytes")
+
+
+async def _fetch_stream(session, url: str, fd: int, max_size: int) -> int:
+    size = 0
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(f"more than {max_size} bytes")
+            await run_io(os.write, fd, chunk)
+    return size
+
+
+def _plan(size: int, parts: int) -> list:
+    parts = max(1, min(parts, size // MIN_PART_SIZE))
+    step = -(-size // parts)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+async def download_to_temp(url: str, prefix: str, expected_size: int = None,
+                           parts: int = DOWNLOAD_PARTS, session: aiohttp.ClientSession = None) -> Path:
+    """
+    Скачивает url во временный .part в repo/packages/.incoming.
+    Если сервер поддерживает Range — несколькими параллельными запросами
+    в заранее выделенный файл (pwrite), иначе одним потоком. Запись на
+    диск идёт через пул потоков. Размер сверяется с expected_size.
+    """
+    session = session or http_client.session()
+    INCOMING.mkdir(parents=True, exist_ok=True)
+    fd, tmp = await run_io(tempfile.mkstemp, dir=INCOMING, prefix=prefix + ".", suffix=".part")
+    tmp = Path(tmp)
+
+    try:
+        size = await _probe(session, url) if parts > 1 else None
+        if size is not None and size > MAX_UPLOAD_SIZE:
+            raise UploadTooLarge(f"{size} bytes")
+
+        if size is not None and size >= 2 * MIN_PART_SIZE:
+            await run_io(os.ftruncate, fd, size)
+            ranges = _plan(size, parts)
+            await asyncio.gather(*(_fetch_range(session, url, fd, a, b) for a, b in ranges))
+        else:
+            ranges = [None]
+            size = await _fetch_stream(session, url, fd, MAX_UPLOAD_SIZE)
+
+        if expected_size is not None and size != expected_size:
+            raise DownloadError(f"Size mismatch: got {size}, expected {expected_size}")
+        await run_io(os.fsync, fd)
+    except BaseException:
+        await run_io(os.close, fd)
+        await run_io(tmp.unlink, missing_ok=True)
+        raise
+
+    await run_io(os.close, fd)
+    logger.info(f"Downloaded {size} bytes in {len(ranges)} part(s) to {tmp.name}")
+    return tmp
+
+
+async def download_ipa(url: str, filename: str, expected_size: int = None) -> Path:
+    """
+    Скачивает IPA и атомарно публикует его в repo/packages/<filename>:
+    при обрыве или несовпадении размера в packages ничего не появляется.
+    """
+    name = safe_ipa_name(filename)
+    started = time.perf_counter()
+    tmp = await download_to_temp(url, name, expected_size)
+
+    target = PACKAGES / name
+    await run_io(os.replace, tmp, target)
+    metacache.invalidate(target)
+
+    elapsed = time.perf_counter() - started
+    size = expected_size or target.stat().st_size
+    logger.info(f"Stored {name}: {size / elapsed / 1024 ** 2:.1f} MiB/s")
+    return target
+
+
+# ==============================
+# Бенчмарк: python -m bot.download [--size-mb 64] [--rate-mb 20]
+# ==============================
+async def _bench(size_mb: int, rate_mb: float, parts: int):
+    from aiohttp import web
+
+    payload = os.urandom(size_mb * 1024 * 1024)
+    rate = rate_mb * 1024 * 1024
+
+    async def handler(request):
+        # локальная замена файлового сервера Telegram: Range + лимит
+        # скорости на одно соединение
+        start, end = 0, len(payload) - 1
+        status = 200
+        headers = {"Accept-Ranges": "bytes"}
+        rng = request.headers.get("Range")
+        if rng:
+            a, b = rng.split("=", 1)[1].split("-")
+            start, end = int(a), int(b or end)
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(payload)}"
+
+        resp = web.StreamResponse(status=status, headers=headers)
+        resp.content_length = end - start + 1
+        await resp.prepare(request)
+        for pos in range(start, end + 1, 256 * 1024):
+            piece = payload[pos:min(pos + 256 * 1024, end + 1)]
+            await resp.write(piece)
+            await asyncio.sleep(len(piece) / rate)
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/file"
+
+    try:
+        for n in sorted({1, parts}):
+            started = time.perf_counter()
+            tmp = await download_to_temp(url, "bench.ipa", len(payload), parts=n)
+            elapsed = time.perf_counter() - started
+            same = tmp.read_bytes() == payload
+            tmp.unlink()
+            print(f"parts={n}: {elapsed:.2f}s, {size_mb / elapsed:.1f} MiB/s, content {'ok' if same else 'MISMATCH'}")
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ranged download benchmark against a local server")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rate-mb", type=float, default=20.0, help="per-connection limit, MiB/s")
+    parser.add_argument("--parts", type=int, default=DOWNLOAD_PARTS)
+    args = parser.parse_args()
+    asyncio.run(_bench(args.size_mb, args.rate_mb, args.parts))
@@ -0,0 +1,82 @@
+# bot/generation.py
+
+import asyncio
+import fcntl
+import logging
+import os
+from pathlib import Path
+
+from bot.metadb import atomic_write
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.generation")
+
+GENERATION_FILE = Path("repo/.cache/generation")
+GENERATION_POLL = float(os.getenv("GENERATION_POLL", "0.5"))
+
+
+def file_stamp(path: Path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class GenerationFile:
+    """
+    Счётчик изменений каталога, общий для процессов (MODE=web + MODE=bot).
+
+    Содержимое — "<номер> <pid>": номер растёт при каждой записи
+    index.json и метаданных в любом процессе, pid — кто увеличил
+    последним (свои изменения процессу перечитывать не нужно).
+    Остальные процессы раз в GENERATION_POLL секунд смотрят stat файла.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def read(self):
+        """
+        (номер, pid) или (0, None), если файла ещё нет.
+        """
+        try:
+            number, pid = self.path.read_text(encoding="utf-8").split()
+            return int(number), int(pid)
+        except (FileNotFoundError, ValueError):
+            return 0, None
+
+    def bump(self) -> int:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # приращение под flock: два процесса не получат один номер
+        with open(self.path.with_name(f".{self.path.name}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            number = self.read()[0] + 1
+            atomic_write(self.path, f"{number} {os.getpid()}\n".encode())
+        return number
+
+    def foreign(self) -> bool:
+        """
+        Последнее изменение сделал другой процесс.
+        """
+        return self.read()[1] not in (None, os.getpid())
+
+    async def follow(self, on_change, interval: float = GENERATION_POLL):
+        """
+        Вызывает async on_change() после каждого изменения файла
+        (свои изменения отсеивает сам on_change, если ему это важно).
+        """
+        seen = await run_io(file_stamp, self.path)
+        while True:
+            await asyncio.sleep(interval)
+            stamp = await run_io(file_stamp, self.path)
+            if stamp == seen:
+                continue
+            seen = stamp
+            try:
+                await on_change()
+            except Exception:
+                logger.exception("generation change handler failed")
+
+
+generation = GenerationFile(GENERATION_FILE)
@@ -1,19 +1,26 @@
 # bot/handlers.py
 
-import json
+import html
 import logging
 import os
+import time
 from pathlib import Path
 
-from aiogram import types, Dispatcher
+from aiogram import BaseMiddleware, types, Dispatcher
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 
 from bot.handlers_packages import register_packages_handlers
 from bot.subscriptions import register_subscription_handlers
-from bot.utils import extract_ipa_metadata, get_file_size
-from bot.access import check_access, add_user, ensure_users_file
+from bot.workers import run_io
+from bot.metrics import BOT_HANDLER, TG_DOWNLOAD_BYTES, TG_DOWNLOAD_SECONDS
+from bot.download import download_ipa
+from bot.ingest import ingest_local_file
+from bot.jobs import job_queue
+from bot.tasks import submit_publish
+from bot.watchdog import PROFILE_DIR, loop_watchdog, profile_for
+from bot.access import access, check_access, add_user, ensure_users_file
 
 logger = logging.getLogger("bot.handlers")
 
@@ -28,40 +35,36 @@ IMAGES.mkdir(parents=True, exist_ok=True)
 
 ensure_users_file()
 
+# локальный Bot API: перенести файл из его каталога вместо жёсткой ссылки
+BOT_API_MOVE = os.getenv("BOT_API_MOVE", "0") == "1"
+
 # ==============================
 # Telegram File Downloader
 # ==============================
-async def _download_via_telegram_url(bot, file_id: str, dest: Path):
+async def _fetch_telegram_file(bot, file_id: str, filename: str, file_size: int = None):
     file_info = await bot.get_file(file_id)
-    file_url = f"https://api.telegram.org/file/bot{bot.token}/{file_info.file_path}"
+    api = bot.session.api
 
-    logger.info(f"Downloading via Telegram URL: {file_url}")
+    if api.is_local:
+        # локальный Bot API сервер уже сохранил файл — забираем без копирования
+        local_path = Path(api.wrap_local_file.to_local(file_info.file_path))
+        if local_path.is_absolute() and await run_io(local_path.is_file):
+            return "local", await run_io(ingest_local_file, local_path, filename, file_size, BOT_API_MOVE)
 
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(file_url) as resp:
-            resp.raise_for_status()
-            with open(dest, "wb") as fd:
-                async for chunk in resp.content.iter_chunked(64 * 1024):
-                    fd.write(chunk)
+    file_url = api.file_url(bot.token, file_info.file_path)
 
-# ==============================
-# ICON URL FIX
-# ==============================
-async def fix_icon_url(meta: dict, ipa_name: str, server_url: str):
-    icon_url = meta.get("iconURL", "").strip()
+    logger.info(f"Downloading via Telegram URL: {file_info.file_path}")
 
-    if icon_url.startswith("http://") or icon_url.startswith("https://"):
-        return icon_url
+    # общий пул соединений, параллельные Range-запросы, атомарная публикация
+    return "http", await download_ipa(file_url, filename, file_size)
 
-    guessed_png = IMAGES / (Path(ipa_name).stem + ".png")
-    if icon_url == "" and guessed_png.exists():
-        return f"{server_url}/repo/images/{guessed_png.name}"
 
-    if icon_url.startswith("/"):
-        return f"{server_url}{icon_url}"
-
-    return ""
+async def _download_via_telegram_url(bot, file_id: str, filename: str, file_size: int = None) -> Path:
+    started = time.perf_counter()
+    source, target = await _fetch_telegram_file(bot, file_id, filename, file_size)
+    TG_DOWNLOAD_SECONDS.observe(time.perf_counter() - started, (source,))
+    TG_DOWNLOAD_BYTES.inc(file_size or (await run_io(target.stat)).st_size, (source,))
+    return target
 
 # ==============================
 # Обработка .ipa файлов
@@ -76,44 +79,16 @@ async def handle_document(message: types.Message, bot):
         await message.answer("Пожалуйста, отправьте файл .ipa")
         return
 
-    target = PACKAGES / doc.file_name
     await message.answer("📥 Скачиваю файл через Telegram…")
 
     server_url = os.getenv("SERVER_URL", "").rstrip("/")
 
     try:
-        await _download_via_telegram_url(bot, doc.file_id, target)
-
-        meta_file = target.with_suffix(".json")
-        if not meta_file.exists():
-            meta = extract_ipa_metadata(target)
-            fixed_icon = await fix_icon_url(meta, target.name, server_url)
-
-            meta_to_save = {
-                "name": meta.get("name") or target.stem,
-                "bundleIdentifier": meta.get("bundleIdentifier") or f"com.projectbw.{target.stem.lower()}",
-                "developerName": meta.get("developerName", "Unknown"),
-                "iconURL": fixed_icon,
-                "localizedDescription": meta.get("localizedDescription") or "Описание недоступно.",
-                "subtitle": meta.get("subtitle") or "",
-                "tintColor": meta.get("tintColor") or "3c94fc",
-                "category": meta.get("category") or "utilities",
-                "versions": [
-                    {
-                        "downloadURL": f"{server_url}/repo/packages/{target.name}",
-                        "size": get_file_size(target),
-                        "version": meta.get("version") or "1.0",
-                        "buildVersion": meta.get("build") or "1",
-                        "date": meta.get("date") or "",
-                        "localizedDescription": meta.get("localizedDescription") or "",
-                        "minOSVersion": meta.get("min_ios") or "16.0"
-                    }
-                ]
-            }
-
-            meta_file.write_text(json.dumps(meta_to_save, indent=4, ensure_ascii=False), encoding="utf-8")
-
-        await message.answer(f"✔ Файл {doc.file_name} сохранён")
+        target = await _download_via_telegram_url(bot, doc.file_id, doc.file_name, doc.file_size)
+
+        # разбор и публикация — в очереди задач, итог придёт отдельным сообщением
+        job = await submit_publish(target, server_url, chat_id=message.chat.id)
+        await message.answer(f"📦 Файл получен, обработка: задача #{job.id}")
 
     except TelegramBadRequest as e:
         if "file is too big" in str(e).lower():
@@ -142,46 +117,12 @@ async def cmd_fixmeta(message: types.Message):
         return await message.answer("❌ У вас нет доступа.")
 
     server_url = os.getenv("SERVER_URL", "").rstrip("/")
-    created = 0
-    report = ""
-
-    for ipa in PACKAGES.glob("*.ipa"):
-        meta_file = ipa.with_suffix(".json")
-        if meta_file.exists():
-            continue
-
-        meta = extract_ipa_metadata(ipa)
-
-        meta_info = {
-            "name": meta.get("name") or ipa.stem,
-            "bundleIdentifier": meta.get("bundleIdentifier") or f"com.projectbw.{ipa.stem.lower()}",
-            "developerName": meta.get("developerName") or "Unknown",
-            "iconURL": "",
-            "localizedDescription": meta.get("localizedDescription") or "Описание недоступно.",
-            "subtitle": "",
-            "tintColor": "3c94fc",
-            "category": "utilities",
-            "versions": [
-                {
-                    "downloadURL": f"{server_url}/repo/packages/{ipa.name}",
-                    "size": get_file_size(ipa),
-                    "version": meta.get("version") or "1.0",
-                    "buildVersion": meta.get("build") or "1",
-                    "date": meta.get("date") or "",
-                    "localizedDescription": meta.get("localizedDescription") or "",
-                    "minOSVersion": meta.get("min_ios") or "16.0"
-                }
-            ]
-        }
-
-        meta_file.write_text(json.dumps(meta_info, indent=4, ensure_ascii=False), encoding="utf-8")
-        created += 1
-        report += f"✔ Создан meta: {ipa.stem}.json\n"
-
-    if created == 0:
-        await message.answer("✔ Все .json уже существуют.")
-    else:
-        await message.answer(report + f"\nВсего создано: {created}")
+
+    # разбор IPA идёт в очереди задач, бот продолжает отвечать
+    job = await job_queue.submit(
+        "fixmeta", {"server_url": server_url, "chat_id": message.chat.id}, key="fixmeta"
+    )
+    await message.answer(f"🔍 Задача #{job.id} поставлена в очередь. Статус — /jobs")
 
 # ==============================
 # /repo — генерация index.json
@@ -192,83 +133,69 @@ async def cmd_repo(message: types.Message):
         return
 
     server_url = os.getenv("SERVER_URL", "").rstrip("/")
-    index_file = BASE / "index.json"
-
-    repo_data = {
-        "name": "ProjectBW Repository",
-        "identifier": "projectbw.ksign-repo",
-        "subtitle": "A source for Ksign app",
-        "description": "repo projectbw.ru",
-        "iconURL": "https://raw.githubusercontent.com/bwproject/projectbw-wiki/refs/heads/master/docs/.vuepress/public/images/logo.png",
-        "website": "https://projectbw.ru/ios",
-        "tintColor": "3c94fc",
-        "apps": []
-    }
-
-    updated_count = 0
-    updated_names = []
-
-    for ipa in PACKAGES.glob("*.ipa"):
-        updated_count += 1
-        updated_names.append(ipa.stem)
-
-        meta_file = ipa.with_suffix(".json")
-        if meta_file.exists():
-            try:
-                app_meta = json.loads(meta_file.read_text(encoding="utf-8"))
-            except:
-                app_meta = {}
-        else:
-            meta = extract_ipa_metadata(ipa)
-            app_meta = {}
-
-        # гарантируем поля
-        app_meta.setdefault("name", ipa.stem)
-        app_meta.setdefault("bundleIdentifier", f"com.projectbw.{ipa.stem.lower()}")
-        app_meta.setdefault("developerName", "Unknown")
-        app_meta.setdefault("subtitle", "")
-        app_meta.setdefault("tintColor", "3c94fc")
-        app_meta.setdefault("category", "utilities")
-        app_meta.setdefault("localizedDescription", "Описание недоступно.")
-
-        # иконка
-        app_meta["iconURL"] = await fix_icon_url(app_meta, ipa.name, server_url)
-
-        # версии
-        if "versions" not in app_meta or not app_meta["versions"]:
-            meta = extract_ipa_metadata(ipa)
-            app_meta["versions"] = [
-                {
-                    "downloadURL": f"{server_url}/repo/packages/{ipa.name}",
-                    "size": get_file_size(ipa),
-                    "version": meta.get("version") or "1.0",
-                    "buildVersion": meta.get("build") or "1",
-                    "date": meta.get("date") or "",
-                    "localizedDescription": app_meta.get("localizedDescription", ""),
-                    "minOSVersion": meta.get("min_ios") or "16.0"
-                }
-            ]
-        else:
-            app_meta["versions"][0]["downloadURL"] = f"{server_url}/repo/packages/{ipa.name}"
-            app_meta["versions"][0]["size"] = get_file_size(ipa)
+    job = await job_queue.submit(
+        "repo", {"server_url": server_url, "chat_id": message.chat.id}, key="repo"
+    )
+    await message.answer(f"🔄 Задача #{job.id} поставлена в очередь. Статус — /jobs")
+
+# ==============================
+# /jobs — состояние очереди
+# ==============================
+async def cmd_jobs(message: types.Message):
+    if not check_access(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к боту.")
+        return
 
-        repo_data["apps"].append(app_meta)
+    jobs = job_queue.jobs()
+    active = [j for j in jobs if j.state["status"] in ("queued", "running")]
+    finished = [j for j in jobs if j.state["status"] not in ("queued", "running")][-10:]
 
-    # сортировка по имени
-    repo_data["apps"].sort(key=lambda x: x["name"].lower())
+    if not jobs:
+        return await message.answer("Очередь пуста.")
 
-    index_file.write_text(json.dumps(repo_data, indent=4, ensure_ascii=False), encoding="utf-8")
+    text = "⚙️ Активные задачи:\n" + ("\n".join(j.summary() for j in active) or "—")
+    if finished:
+        text += "\n\n🕓 Последние завершённые:\n" + "\n".join(j.summary() for j in reversed(finished))
+    await message.answer(text)
 
-    apps_list = "\n".join([f"— {n}" for n in sorted(updated_names)])
-    repo_url = f"{server_url}/repo/index.json"
 
-    await message.answer(
-        f"✔ index.json обновлён\n"
-        f" {repo_url} \n\n"
-        f"📦 Всего приложений: <b>{updated_count}</b>\n\n"
-        f"{apps_list}",
-        parse_mode="html"
-    )
+async def notify_job(bot, job):
+    """
+    Итог задачи — во все чаты, откуда её ставили (с учётом склейки).
+    """
+    chat_ids = job.chat_ids()
+    if not chat_ids:
+        return
+
+    kind = job.state["kind"]
+    result = job.state.get("result") or {}
+    # имена файлов, ошибки и отчёт — не HTML
+    if job.state["status"] == "failed":
+        text = f"❌ Задача #{job.id} ({kind}) завершилась ошибкой: {html.escape(str(job.state.get('error')))}"
+    elif kind == "publish":
+        text = f"✔ Файл {html.escape(result['saved'])} сохранён"
+    elif kind == "fixmeta":
+        created = result["created"]
+        text = "✔ Все .json уже существуют." if created == 0 \
+            else html.escape(result["report"]) + f"\nВсего создано: {created}"
+    elif kind == "repo":
+        server_url = html.escape(job.args["server_url"])
+        names = result["apps"]
+        apps_list = "\n".join([f"— {html.escape(n)}" for n in names])
+        text = (
+            f"✔ index.json обновлён\n"
+            f" {server_url}/repo/index.json \n\n"
+            f"📦 Всего приложений: <b>{len(names)}</b>\n\n"
+            f"{apps_list}"
+        )
+    else:
+        return
+
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id, text, parse_mode="html")
+        except TelegramAPIError as e:
+            logger.warning(f"Job #{job.id} notification to {chat_id} failed: {e}")
 
 # ==============================
 # /start
@@ -279,6 +206,7 @@ async def cmd_start(message: types.Message):
         "• Отправь .ipa — я сохраню его в репозиторий.\n"
         "• /repo — обновить index.json\n"
         "• /fixmeta — пересоздать .json для IPA\n"
+        "• /jobs — фоновые задачи\n"
         "• /upload — открыть WebApp\n"
         "• /subscribe — подписка на приложения\n"
         "• /add_user USER_ID — дать доступ"
@@ -306,9 +234,7 @@ async def cmd_upload(message: types.Message):
 # /add_user — добавить пользователя
 # ==============================
 async def cmd_add_user(message: types.Message):
-    admin_id = int(os.getenv("ADMIN_ID", "0"))
-
-    if message.from_user.id != admin_id:
+    if not access.is_admin(message.from_user.id):
         return await message.answer("❌ Только админ может добавлять пользователей.")
 
     parts = message.text.split()
@@ -323,15 +249,75 @@ async def cmd_add_user(message: types.Message):
     add_user(user_id)
     await message.answer(f"✔ Пользователь {user_id} добавлен.")
 
+# ==============================
+# /profile — профиль event loop (админ)
+# ==============================
+MAX_PROFILE_SECONDS = 300
+
+
+async def cmd_profile(message: types.Message):
+    if not access.is_admin(message.from_user.id):
+        return await message.answer("❌ Только для админа.")
+
+    parts = message.text.split()
+    try:
+        seconds = min(float(parts[1]), MAX_PROFILE_SECONDS) if len(parts) > 1 else 30
+    except ValueError:
+        return await message.answer("Использование:\n/profile [СЕКУНДЫ]")
+
+    await message.answer(f"⏱ Профилирую event loop {seconds:g} с…")
+    profiler = await profile_for(seconds)
+
+    name = f"profile-{int(profiler.started)}.collapsed"
+    await run_io(profiler.dump, PROFILE_DIR / name)
+    busy = sum(profiler.samples.values())
+    caption = (
+        f"Сэмплов: {profiler.total}, loop занят: {busy} "
+        f"({busy / max(profiler.total, 1):.0%})\n"
+        f"Блокировок loop с запуска: {len(loop_watchdog.stalls)}\n"
+        f"flamegraph.pl {name} > flame.svg"
+    )
+    if not busy:
+        return await message.answer(caption)
+    data = profiler.collapsed().encode("utf-8")
+    await message.answer_document(BufferedInputFile(data, filename=name), caption=caption)
+
+# ==============================
+# Время обработчиков
+# ==============================
+class HandlerTimer(BaseMiddleware):
+    """
+    Внутренний middleware: вызывается уже для выбранного обработчика,
+    метка — имя его функции (cmd_repo, handle_document, ...).
+    """
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            BOT_HANDLER.observe(time.perf_counter() - started, (name, status))
+
+
 # ==============================
 # Регистрация хэндлеров
 # ==============================
 def register_handlers(dp: Dispatcher):
+    dp.message.middleware(HandlerTimer())
+    dp.callback_query.middleware(HandlerTimer())
+
     dp.message.register(cmd_start, Command(commands=["start"]))
     dp.message.register(cmd_repo, Command(commands=["repo"]))
     dp.message.register(cmd_fixmeta, Command(commands=["fixmeta"]))
     dp.message.register(cmd_upload, Command(commands=["upload"]))
     dp.message.register(cmd_add_user, Command(commands=["add_user"]))
+    dp.message.register(cmd_jobs, Command(commands=["jobs"]))
+    dp.message.register(cmd_profile, Command(commands=["profile"]))
 
     dp.message.register(
         handle_document,
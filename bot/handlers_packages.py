@@ -1,9 +1,9 @@
 # bot/handlers_packages.py
 
-import json
 import logging
 import os
 from pathlib import Path
+from urllib.parse import quote
 
 from aiogram import types, Dispatcher
 from aiogram.filters import Command
@@ -13,6 +13,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 
 from bot.access import check_access
+from bot.metastore import metastore, MetadataCorrupt
+from bot.workers import run_io
 
 logger = logging.getLogger("bot.packages")
 
@@ -34,7 +36,7 @@ async def cmd_packages_update(message: types.Message):
         await message.answer("❌ У вас нет доступа к боту.")
         return
 
-    count = len(list(PACKAGES.glob("*.json")))
+    count = len(await run_io(metastore.names))
     await message.answer(f"♻ Найдено JSON файлов: <b>{count}</b>", parse_mode="html")
 
 
@@ -46,21 +48,20 @@ async def cmd_packages_list(message: types.Message):
         await message.answer("❌ У вас нет доступа к боту.")
         return
 
-    files = list(PACKAGES.glob("*.json"))
-    if not files:
+    names = await run_io(metastore.names)
+    if not names:
         return await message.answer("❌ Нет .json файлов")
 
     server_url = os.getenv("SERVER_URL", "").rstrip("/")
-    tgid = message.from_user.id
 
     text = "📦 Приложения в репозитории:\n\n"
     keyboards = []
 
-    for f in files:
-        app = f.stem
+    for app in names:
         text += f"• <b>{app}</b>\n"
 
-        edit_url = f"{server_url}/webapp/update.html?app={app}&tgid={tgid}"
+        # пользователя сервер узнаёт из подписанного initData WebApp
+        edit_url = f"{server_url}/webapp/update.html?app={quote(app)}"
 
         keyboards.append([
             InlineKeyboardButton(
@@ -87,14 +88,15 @@ async def cmd_packages_edit_name(message: types.Message, state: FSMContext):
         return await message.answer("Пример:\n<code>/packages_edit esign</code>", parse_mode="html")
 
     name = parts[1].strip()
-    target = PACKAGES / f"{name}.json"
 
-    if not target.exists():
+    try:
+        await run_io(metastore.read, name)
+    except KeyError:
         return await message.answer("❌ JSON не найден")
+    except MetadataCorrupt:
+        return await message.answer("❌ JSON повреждён")
 
-    data = json.loads(target.read_text(encoding="utf-8"))
-
-    await state.update_data(file_path=str(target), json_data=data)
+    await state.update_data(app=name)
     await state.set_state(EditStates.editing_name)
 
     await message.answer(
@@ -112,37 +114,44 @@ async def process_edit_line(message: types.Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    json_data = data["json_data"]
-    file_path = Path(data["file_path"])
+    name = data["app"]
     current_state = await state.get_state()
 
     value = message.text.strip()
     if not value:
         return await message.answer("❌ Пустое значение.")
 
+    # каждое поле — отдельное изменение под локом приложения:
+    # правки, сделанные параллельно (WebApp, загрузка), не теряются
     if current_state == EditStates.editing_name.state:
-        json_data["name"] = value
+        def mutate(json_data):
+            json_data["name"] = value
         await state.set_state(EditStates.editing_bundle)
         prompt = "Введите новое значение <b>bundleIdentifier</b>:"
 
     elif current_state == EditStates.editing_bundle.state:
-        json_data["bundleIdentifier"] = value
+        def mutate(json_data):
+            json_data["bundleIdentifier"] = value
         await state.set_state(EditStates.editing_version)
         prompt = "Введите новую версию <b>versions[0].version</b>:"
 
     elif current_state == EditStates.editing_version.state:
-        if "versions" not in json_data or len(json_data["versions"]) == 0:
-            json_data["versions"] = [{}]
+        def mutate(json_data):
+            if "versions" not in json_data or len(json_data["versions"]) == 0:
+                json_data["versions"] = [{}]
 
-        json_data["versions"][0]["version"] = value
+            json_data["versions"][0]["version"] = value
         await state.clear()
         prompt = "✔ Изменения сохранены!"
 
     else:
         return
 
-    file_path.write_text(json.dumps(json_data, indent=4, ensure_ascii=False), encoding="utf-8")
-    await state.update_data(json_data=json_data)
+    try:
+        await metastore.update(name, mutate)
+    except (KeyError, MetadataCorrupt):
+        await state.clear()
+        return await message.answer("❌ JSON не найден или повреждён")
 
     await message.answer(prompt, parse_mode="html")
 
@@ -0,0 +1,240 @@
+# bot/icons.py
+
+import hashlib
+import io
+import logging
+import os
+import re
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from PIL import Image
+
+logger = logging.getLogger("bot.icons")
+
+IMAGES = Path("repo/images")
+IMAGES.mkdir(parents=True, exist_ok=True)
+
+ICON_SIZES = (60, 120, 180)
+# <app>-<хэш>-<размер>.png|webp
+VARIANT_RE = re.compile(r"^(?P<stem>.+)-(?P<digest>[0-9a-f]{12})-\d+\.(?:png|webp)$")
+# свежие варианты могут ещё не попасть в .json (публикация идёт),
+# старые — ещё нужны клиентам с прежним index.json
+VARIANT_GC_MIN_AGE = 3600
+
+_unreferenced = {}      # имя варианта -> когда каталог перестал на него ссылаться
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+# ==============================
+# CgBI (Apple "crushed" PNG)
+# ==============================
+def _chunks(data: bytes):
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, ctype = struct.unpack(">I4s", data[pos:pos + 8])
+        yield ctype, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def _chunk(ctype: bytes, body: bytes) -> bytes:
+    crc = zlib.crc32(ctype + body) & 0xFFFFFFFF
+    return struct.pack(">I", len(body)) + ctype + body + struct.pack(">I", crc)
+
+
+def is_cgbi(data: bytes) -> bool:
+    return data.startswith(PNG_SIGNATURE) and data[12:16] == b"CgBI"
+
+
+def normalize_cgbi(data: bytes):
+    """
+    CgBI → обычный PNG. Возвращает (png_bytes, premultiplied).
+
+    В CgBI IDAT сжат raw deflate, каналы идут как BGRA, альфа
+    предумножена. Фильтры PNG работают побайтно внутри канала, поэтому
+    B и R можно переставить прямо в отфильтрованных строках.
+    """
+    ihdr = None
+    idat = b""
+    others = []
+    for ctype, body in _chunks(data):
+        if ctype == b"CgBI":
+            continue
+        if ctype == b"IHDR":
+            ihdr = body
+        elif ctype == b"IDAT":
+            idat += body
+        elif ctype == b"IEND":
+            break
+        else:
+            others.append((ctype, body))
+
+    width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+    raw = bytearray(zlib.decompressobj(-zlib.MAX_WBITS).decompress(idat))
+
+    if depth == 8 and color_type == 6 and interlace == 0:
+        stride = 1 + width * 4
+        for off in range(0, height * stride, stride):
+            row = raw[off + 1:off + stride]
+            row[0::4], row[2::4] = row[2::4], row[0::4]
+            raw[off + 1:off + stride] = row
+
+    out = PNG_SIGNATURE + _chunk(b"IHDR", ihdr)
+    for ctype, body in others:
+        out += _chunk(ctype, body)
+    out += _chunk(b"IDAT", zlib.compress(bytes(raw), 9)) + _chunk(b"IEND", b"")
+    return out, color_type == 6
+
+
+def load_icon(data: bytes) -> Image.Image:
+    premultiplied = False
+    if is_cgbi(data):
+        data, premultiplied = normalize_cgbi(data)
+
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    if premultiplied:
+        # RGBa — предумноженная альфа в терминах Pillow
+        img = Image.frombytes("RGBa", img.size, img.convert("RGBA").tobytes()).convert("RGBA")
+    return img.convert("RGBA")
+
+
+# ==============================
+# Варианты иконки
+# ==============================
+def process_icon(data: bytes, stem: str) -> dict:
+    """
+    Нормализует иконку и сохраняет PNG/WebP 60/120/180px с хэшем
+    содержимого в имени (такие файлы можно кэшировать навсегда).
+    """
+    img = load_icon(data)
+
+    full = io.BytesIO()
+    img.save(full, "PNG", optimize=True)
+    full_bytes = full.getvalue()
+    digest = hashlib.sha256(full_bytes).hexdigest()[:12]
+
+    # исходный размер под старым именем — для iconURL
+    (IMAGES / f"{stem}.png").write_bytes(full_bytes)
+
+    icons = []
+    for size in ICON_SIZES:
+        png_name = f"{stem}-{digest}-{size}.png"
+        webp_name = f"{stem}-{digest}-{size}.webp"
+        if not (IMAGES / png_name).exists() or not (IMAGES / webp_name).exists():
+            resized = img.resize((size, size), Image.LANCZOS)
+            resized.save(IMAGES / png_name, "PNG", optimize=True)
+            resized.save(IMAGES / webp_name, "WEBP", quality=85, method=6)
+        icons.append({
+            "size": size,
+            "png": f"/repo/images/{png_name}",
+            "webp": f"/repo/images/{webp_name}",
+        })
+
+    # варианты прежней иконки убирает gc_variants, когда на них
+    # перестанет ссылаться index.json
+    return {"iconURL": f"/repo/images/{stem}.png", "icons": icons}
+
+
+def copy_icon(meta: dict, stem: str):
+    """
+    Иконка из метаданных другого приложения (тот же IPA под другим
+    именем, см. metacache._alias) под именами stem: файлы связываются
+    жёсткими ссылками, поля iconURL/icons указывают на них. None —
+    исходных файлов уже нет (иконка сменилась), нужен полный разбор.
+    """
+    icons = meta.get("icons") or []
+    if not meta.get("iconURL"):
+        return {"iconURL": "", "icons": []}
+    if not icons:
+        return None     # иконка без вариантов (ошибка обработки) — разбираем заново
+
+    digest = None
+    links = []
+    result = []
+    for icon in icons:
+        entry = {"size": icon["size"]}
+        for key in ("png", "webp"):
+            m = VARIANT_RE.match(Path(icon.get(key, "")).name)
+            if m is None:
+                return None
+            digest = m["digest"]
+            name = f"{stem}-{digest}-{icon['size']}.{key}"
+            links.append((IMAGES / Path(icon[key]).name, IMAGES / name))
+            entry[key] = f"/repo/images/{name}"
+        result.append(entry)
+
+    # <app>.png перезаписывается при смене иконки — берём, только если
+    # в нём всё ещё та же картинка, что в вариантах
+    try:
+        full_bytes = (IMAGES / Path(meta["iconURL"]).name).read_bytes()
+    except FileNotFoundError:
+        return None
+    if hashlib.sha256(full_bytes).hexdigest()[:12] != digest:
+        return None
+
+    try:
+        for src, dst in links:
+            if not dst.exists():
+                os.link(src, dst)
+    except FileNotFoundError:
+        return None
+    (IMAGES / f"{stem}.png").write_bytes(full_bytes)
+    return {"iconURL": f"/repo/images/{stem}.png", "icons": result}
+
+
+def _variants():
+    try:
+        entries = list(os.scandir(IMAGES))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        m = VARIANT_RE.match(entry.name)
+        if m:
+            yield entry, m
+
+
+def gc_variants(referenced: set, min_age: float = VARIANT_GC_MIN_AGE) -> int:
+    """
+    Удаляет варианты, на которые не ссылается ни одно приложение
+    (referenced — имена файлов): остатки сменившихся иконок, удалённых
+    приложений и прерванных публикаций. Вызывается после записи
+    index.json; файл удаляется, только если он старше min_age и не
+    нужен каталогу уже min_age секунд (клиенты со старым index.json
+    и кэшем страниц ещё какое-то время его запрашивают).
+    """
+    removed = 0
+    now = time.time()
+    seen = set()
+    for entry, _ in _variants():
+        if entry.name in referenced:
+            continue
+        seen.add(entry.name)
+        since = _unreferenced.setdefault(entry.name, now)
+        try:
+            if now - max(since, entry.stat().st_mtime) < min_age:
+                continue
+            os.unlink(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        seen.discard(entry.name)
+    # снова нужные или исчезнувшие файлы — отсчёт заново
+    for name in set(_unreferenced) - seen:
+        del _unreferenced[name]
+    if removed:
+        logger.info(f"Icon GC removed {removed} unreferenced variant(s)")
+    return removed
+
+
+def absolute_icons(icons: list, server_url: str) -> list:
+    result = []
+    for icon in icons or []:
+        icon = dict(icon)
+        for key in ("png", "webp"):
+            if icon.get(key, "").startswith("/"):
+                icon[key] = f"{server_url}{icon[key]}"
+        result.append(icon)
+    return result
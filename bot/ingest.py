@@ -0,0 +1,214 @@
+# bot/ingest.py
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from bot.blobs import blob_store
+from bot.catalog import catalog
+from bot.icons import absolute_icons
+from bot.metacache import metacache
+from bot.metastore import metastore, MetadataCorrupt
+from bot.utils import resolve_icon_url
+from bot.versions import store_version, add_version, path_from_url
+
+logger = logging.getLogger("bot.ingest")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+INCOMING = PACKAGES / ".incoming"   # та же ФС, что и packages — rename атомарен
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(4 * 1024 ** 3)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def safe_ipa_name(filename: str) -> str:
+    """
+    Имя файла от клиента → безопасное имя внутри repo/packages.
+    """
+    name = Path((filename or "").replace("\\", "/")).name
+    if not name or name.startswith(".") or not name.lower().endswith(".ipa"):
+        raise ValueError(f"Bad IPA filename: {filename!r}")
+    return name
+
+
+class IngestWriter:
+    """
+    Потоковая запись IPA во временный файл с подсчётом SHA-256 и размера.
+    Видимым в repo/packages файл становится только после commit().
+    """
+
+    def __init__(self, filename: str, max_size: int = MAX_UPLOAD_SIZE):
+        self.name = safe_ipa_name(filename)
+        self.target = PACKAGES / self.name
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._fd = None
+        self.tmp_path = None
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def open(self):
+        INCOMING.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=INCOMING, prefix=self.name + ".", suffix=".part")
+        self._fd = os.fdopen(fd, "wb")
+        self.tmp_path = Path(tmp)
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise UploadTooLarge(f"{self.name}: more than {self.max_size} bytes")
+        self._hash.update(chunk)
+        self._fd.write(chunk)
+
+    def commit(self) -> Path:
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        self._fd.close()
+        os.replace(self.tmp_path, self.target)
+        metacache.invalidate(self.target)
+        logger.info(f"Stored {self.name}: {self.size} bytes, sha256={self.sha256}")
+        return self.target
+
+    def abort(self):
+        if self._fd is not None and not self._fd.closed:
+            self._fd.close()
+        if self.tmp_path is not None:
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def ingest_local_file(src: Path, filename: str, expected_size: int = None, move: bool = False) -> Path:
+    """
+    Файл уже лежит на этой машине (локальный Bot API сервер): вместо
+    скачивания он жёстко связывается (move — переносится) в repo/packages.
+    Копия делается только если src на другой файловой системе.
+    """
+    name = safe_ipa_name(filename)
+    size = src.stat().st_size
+    if expected_size is not None and size != expected_size:
+        raise ValueError(f"{src}: size {size}, expected {expected_size}")
+    if size > MAX_UPLOAD_SIZE:
+        raise UploadTooLarge(f"{name}: more than {MAX_UPLOAD_SIZE} bytes")
+
+    INCOMING.mkdir(parents=True, exist_ok=True)
+    tmp = INCOMING / f"{name}.{os.getpid()}.{time.monotonic_ns()}.part"
+    try:
+        if move:
+            os.rename(src, tmp)
+            how = "moved"
+        else:
+            os.link(src, tmp)
+            how = "linked"
+    except OSError as e:
+        if e.errno != errno.EXDEV and not isinstance(e, PermissionError):
+            raise
+        shutil.copyfile(src, tmp)
+        how = "copied"
+
+    target = PACKAGES / name
+    os.replace(tmp, target)
+    metacache.invalidate(target)
+    logger.info(f"Stored {name}: {size} bytes, {how} from {src}")
+    return target
+
+
+def cleanup_incoming(max_age: float = 24 * 3600):
+    """
+    Удаляет брошенные .part файлы и сессии (обрыв загрузки, рестарт процесса).
+    """
+    if not INCOMING.exists():
+        return
+    now = time.time()
+    for pattern in ("*.part", "*.session.json", "*.chunks", ".*.lock"):
+        for part in INCOMING.glob(pattern):
+            try:
+                if now - part.stat().st_mtime <= max_age:
+                    continue
+                if part.is_dir():
+                    shutil.rmtree(part, ignore_errors=True)     # отметки чанков сессии
+                else:
+                    part.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# ==============================
+# Публикация пакета
+# ==============================
+def _version_in_use(path: Path, owner: str) -> bool:
+    """
+    Ссылается ли на сборку другое приложение. Нужно только для записей
+    старого формата versions/<bundle>/: новые лежат в versions/<имя>/.
+    """
+    if path.parent.name == owner:
+        return False
+    for name in metastore.names():
+        if name == owner:
+            continue
+        try:
+            data, _ = metastore.read(name)
+        except (KeyError, MetadataCorrupt):
+            continue
+        for v in data.get("versions") or []:
+            if path_from_url(v.get("downloadURL", "")) == path:
+                return True
+    return False
+
+
+def publish_package(target: Path, server_url: str, sha256: str = None, write_index: bool = True):
+    """
+    Регистрирует новую сборку: сохраняет её в истории версий, создаёт или
+    дополняет .json, точечно обновляет каталог и index.json.
+    Выполняется в пуле потоков, под metastore.lock(target.stem).
+    """
+    # дубликат становится ссылкой на существующий блоб и берёт его метаданные
+    blob_store.ingest(target, sha256)
+    meta = metacache.extract(target, sha256=sha256)
+
+    try:
+        meta_to_save, _ = metastore.read(target.stem)
+    except KeyError:
+        meta_to_save = None
+    except MetadataCorrupt as e:
+        logger.warning(f"Broken metadata file: {e}, recreating")
+        meta_to_save = None
+
+    if meta_to_save is None:
+        fixed_icon = resolve_icon_url(meta, target.name, server_url)
+
+        meta_to_save = {
+            "name": meta.get("name") or target.stem,
+            "bundleIdentifier": meta.get("bundleIdentifier") or f"com.projectbw.{target.stem.lower()}",
+            "developerName": meta.get("developerName", "Unknown"),
+            "iconURL": fixed_icon,
+            "icons": absolute_icons(meta.get("icons"), server_url),
+            "localizedDescription": meta.get("localizedDescription") or "Описание недоступно.",
+            "subtitle": meta.get("subtitle") or "",
+            "tintColor": meta.get("tintColor") or "3c94fc",
+            "category": meta.get("category") or "utilities",
+            "versions": []
+        }
+    elif meta.get("icons"):
+        # иконка новой сборки могла измениться, остальные поля — ручные правки
+        meta_to_save["iconURL"] = resolve_icon_url(meta, target.name, server_url)
+        meta_to_save["icons"] = absolute_icons(meta.get("icons"), server_url)
+
+    entry = store_version(target, meta, server_url)
+    add_version(meta_to_save, entry, in_use=lambda path: _version_in_use(path, target.stem))
+    blob_store.gc()
+
+    # атомарная запись; патчится только эта запись каталога
+    metastore.write(target.stem, meta_to_save)
+    if write_index:
+        catalog.write_index()
@@ -0,0 +1,341 @@
+# bot/jobs.py
+
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import secrets
+import time
+from pathlib import Path
+
+from bot.metrics import Gauge
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.jobs")
+
+JOBS_FILE = Path("repo/.cache/jobs.json")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+KEEP_FINISHED = 50
+WORKER_FILE_PREFIX = "jobs-web-"
+
+# меньше — раньше
+PRIORITY_INTERACTIVE = 0    # загрузки, правки
+PRIORITY_INDEX = 5          # запись index.json
+PRIORITY_BULK = 10          # /fixmeta, /repo
+
+
+class Job:
+    def __init__(self, state: dict):
+        self.state = state
+
+    @property
+    def id(self) -> str:
+        return self.state["id"]
+
+    @property
+    def args(self) -> dict:
+        return self.state["args"]
+
+    def chat_ids(self) -> list:
+        """
+        Чаты, которым отправляется итог (chat_id + склеенные постановки).
+        """
+        first = self.args.get("chat_id")
+        return ([first] if first is not None else []) + self.args.get("notify", [])
+
+    def progress(self, done: int, total: int):
+        self.state["progress"] = [done, total]
+
+    def summary(self) -> str:
+        s = self.state
+        text = f"#{s['id']} {s['kind']} — {s['status']}"
+        if s.get("progress") and s["status"] == "running":
+            text += " ({}/{})".format(*s["progress"])
+        if s.get("error"):
+            text += f": {s['error']}"
+        return text
+
+
+class JobProgress:
+    """
+    Тот же интерфейс, что у bot.rebuild.ProgressMessage, но прогресс
+    пишется в состояние задачи (видно в /jobs и /api/jobs/<id>).
+    message — ProgressMessage в чат, откуда поставлена задача
+    (одно редактируемое сообщение), если он есть.
+    """
+
+    def __init__(self, job: Job, message=None):
+        self.job = job
+        self.message = message
+
+    async def start(self, total: int):
+        self.job.progress(0, total)
+        if self.message is not None:
+            await self.message.start(total)
+
+    async def update(self, done: int, total: int, force: bool = False):
+        self.job.progress(done, total)
+        if self.message is not None:
+            await self.message.update(done, total, force)
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач внутри процесса.
+
+    - ограниченный параллелизм (JOB_WORKERS исполнителей);
+    - приоритеты: интерактивные задачи раньше массовых;
+    - задачи с одинаковым key, ещё стоящие в очереди, склеиваются;
+    - состояние пишется в repo/.cache/jobs.json, незавершённые задачи
+      после рестарта ставятся в очередь заново.
+    """
+
+    def __init__(self, state_file: Path, workers: int = JOB_WORKERS):
+        self.state_file = state_file
+        self.workers = workers
+        self._kinds = {}            # kind -> (async fn(job), priority)
+        self._jobs = {}             # id -> Job, в порядке создания
+        self._queue = None
+        self._seq = itertools.count()
+        self._tasks = []
+        self._finish_hooks = []
+        self._save_lock = asyncio.Lock()
+        self.bot = None             # aiogram Bot, если в процессе работает бот
+        self._alive = None          # flock файла воркера (per_process)
+
+    def register(self, kind: str, fn, priority: int = PRIORITY_BULK):
+        self._kinds[kind] = (fn, priority)
+
+    def on_finish(self, hook):
+        """
+        async hook(job) — после завершения задачи (успех или ошибка).
+        """
+        self._finish_hooks.append(hook)
+
+    # ==============================
+    # Состояние
+    # ==============================
+    def _write(self, states: list):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(states, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.state_file)
+
+    async def _save(self):
+        finished = [j for j in self._jobs.values() if j.state["status"] in ("done", "failed")]
+        for job in finished[:-KEEP_FINISHED]:
+            del self._jobs[job.id]
+        async with self._save_lock:
+            await run_io(self._write, [dict(j.state) for j in self._jobs.values()])
+
+    @staticmethod
+    def _read(path: Path) -> list:
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return []
+        except Exception:
+            logger.warning(f"Jobs file {path.name} is broken, skipping it")
+            return []
+
+    def _load(self) -> list:
+        return self._read(self.state_file)
+
+    # ==============================
+    # Несколько процессов (MODE=web)
+    # ==============================
+    def _worker_files(self) -> list:
+        return sorted(self.state_file.parent.glob(f"{WORKER_FILE_PREFIX}*.json"))
+
+    @staticmethod
+    def _flock(path: Path, blocking: bool = True):
+        """
+        Открытый файл с flock или None (занят, blocking=False). Лок
+        держится, пока файл открыт, и снимается ядром при смерти процесса —
+        в отличие от проверки pid, которую ломает переиспользование pid.
+        """
+        while True:
+            f = open(path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                f.close()
+                return None
+            # файл мог быть удалён, пока ждали лок, — тогда берём заново
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+            if not blocking:
+                return None
+
+    def _adopt_orphans(self) -> list:
+        """
+        Задачи из файлов завершившихся процессов-воркеров. Живой воркер
+        держит flock на своём <файл>.lock; если лок удалось взять,
+        владельца больше нет, и файл забирает один процесс.
+        """
+        states = []
+        for path in self._worker_files():
+            if path == self.state_file:
+                continue
+            lock_path = path.with_name(path.name + ".lock")
+            lock = self._flock(lock_path, blocking=False)
+            if lock is None:
+                continue                    # процесс жив (или файл забирает другой)
+            try:
+                if not path.exists():
+                    continue                # уже забрал другой воркер
+                states.extend(self._read(path))
+                path.unlink()
+                lock_path.unlink(missing_ok=True)
+                logger.info(f"Adopted jobs of finished worker: {path.name}")
+            finally:
+                lock.close()
+        return states
+
+    def find(self, job_id: str):
+        """
+        Состояние задачи этого или другого процесса (запрос о статусе
+        может прийти не в тот воркер uvicorn, что принял загрузку).
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job.state)
+        for path in [self.state_file.with_name(JOBS_FILE.name), *self._worker_files()]:
+            if path == self.state_file:
+                continue
+            for state in self._read(path):
+                if state.get("id") == job_id:
+                    return state
+        return None
+
+    # ==============================
+    # Постановка
+    # ==============================
+    def _enqueue(self, job: Job):
+        self._queue.put_nowait((job.state["priority"], next(self._seq), job.id))
+
+    async def submit(self, kind: str, args: dict = None, key: str = None, priority: int = None) -> Job:
+        if kind not in self._kinds:
+            raise KeyError(f"Unknown job kind: {kind}")
+
+        if key is not None:
+            for job in self._jobs.values():
+                if job.state.get("key") == key and job.state["status"] == "queued":
+                    # такая же задача уже ждёт — склеиваем; итог получат
+                    # все, кто её ставил
+                    chat_id = (args or {}).get("chat_id")
+                    if chat_id is not None and chat_id not in job.chat_ids():
+                        job.args.setdefault("notify", []).append(chat_id)
+                        await self._save()
+                    return job
+
+        job = Job({
+            "id": secrets.token_hex(4),
+            "kind": kind,
+            "args": args or {},
+            "key": key,
+            "priority": self._kinds[kind][1] if priority is None else priority,
+            "status": "queued",
+            "created": time.time(),
+        })
+        self._jobs[job.id] = job
+        await self._save()
+        if self._queue is not None:
+            self._enqueue(job)
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        return list(self._jobs.values())
+
+    # ==============================
+    # Исполнение
+    # ==============================
+    async def _run(self, job: Job):
+        fn, _ = self._kinds[job.state["kind"]]
+        job.state.update(status="running", started=time.time())
+        await self._save()
+        try:
+            job.state["result"] = await fn(job)
+            job.state["status"] = "done"
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.state['kind']}) failed")
+            job.state.update(status="failed", error=str(e) or type(e).__name__)
+        job.state["finished"] = time.time()
+        await self._save()
+        logger.info(f"Job {job.summary()} in {job.state['finished'] - job.state['started']:.2f}s")
+
+        for hook in self._finish_hooks:
+            try:
+                await hook(job)
+            except Exception:
+                logger.exception("job finish hook failed")
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is not None and job.state["status"] == "queued":
+                await self._run(job)
+            self._queue.task_done()
+
+    async def start(self, per_process: bool = False):
+        """
+        per_process — свой файл состояния на процесс (несколько воркеров
+        uvicorn), плюс задачи, оставшиеся от завершившихся воркеров.
+        """
+        self._queue = asyncio.PriorityQueue()
+        states = []
+        if per_process:
+            self.state_file = self.state_file.with_name(f"{WORKER_FILE_PREFIX}{os.getpid()}.json")
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            # признак жизни воркера — до конца процесса
+            self._alive = await run_io(self._flock, self.state_file.with_name(self.state_file.name + ".lock"))
+            states = await run_io(self._adopt_orphans)
+        for state in await run_io(self._load) + states:
+            job = Job(state)
+            if state["status"] == "running":
+                state["status"] = "queued"      # прервана рестартом
+            if state["kind"] not in self._kinds and state["status"] == "queued":
+                state.update(status="failed", error="unknown job kind")
+            self._jobs[job.id] = job
+            if state["status"] == "queued":
+                self._enqueue(job)
+
+        if states:
+            await self._save()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        pending = sum(1 for j in self._jobs.values() if j.state["status"] == "queued")
+        if pending:
+            logger.info(f"Job queue started with {pending} pending jobs")
+
+    async def join(self):
+        await self._queue.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+job_queue = JobQueue(JOBS_FILE)
+
+
+def _jobs_by_status() -> dict:
+    counts = {(s,): 0 for s in ("queued", "running", "done", "failed")}
+    for job in job_queue.jobs():
+        key = (job.state["status"],)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+Gauge("bw_jobs", "Background jobs by status (finished ones are kept up to a limit).", ("status",), fn=_jobs_by_status)
@@ -0,0 +1,209 @@
+# bot/metacache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from bot.icons import copy_icon
+from bot.metrics import IPA_EXTRACT, Gauge
+from bot.utils import extract_ipa_metadata
+
+logger = logging.getLogger("bot.metacache")
+
+CACHE_DIR = Path("repo/.cache")
+CACHE_FILE = CACHE_DIR / "metadata.json"
+IMAGES = Path("repo/images")
+
+SAVE_INTERVAL = 2.0
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MetadataCache:
+    """
+    Кэш распарсенных Info.plist / иконок, ключ — (путь, размер, mtime).
+    Жёсткие ссылки на один блоб (bot.blobs) делят запись через inode.
+
+    При USE_HASH дополнительно хранится SHA-256: если у файла сменился
+    только mtime (перезапись тем же содержимым), запись остаётся валидной.
+    """
+
+    def __init__(self, cache_file: Path, use_hash: bool = False):
+        self.cache_file = cache_file
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._inodes = {}           # "dev:ino" -> ключ записи
+        self._dirty = False
+        self._last_save = 0.0
+        self._lock = threading.RLock()
+
+    # ==============================
+    # Хранилище
+    # ==============================
+    def _data(self) -> dict:
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.cache_file.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                self._entries = {}
+            except Exception:
+                logger.warning("Metadata cache is broken, starting from scratch")
+                self._entries = {}
+            self._inodes = {
+                entry["inode"]: key for key, entry in self._entries.items() if entry.get("inode")
+            }
+        return self._entries
+
+    def flush(self):
+        """
+        Сохраняет кэш на диск (атомарно, через временный файл).
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # в MODE=web кэш пишут несколько процессов — свой временный файл
+            tmp = self.cache_file.with_name(f".{self.cache_file.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(self._data(), ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.cache_file)
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.flush()
+
+    # ==============================
+    # Доступ к записям
+    # ==============================
+    @staticmethod
+    def _key(path: Path) -> str:
+        return str(path)
+
+    @staticmethod
+    def _inode(st) -> str:
+        return f"{st.st_dev}:{st.st_ino}"
+
+    def _alias(self, path: Path, st):
+        # тот же inode под другим именем — дубликат, разбирать заново не нужно
+        key = self._inodes.get(self._inode(st))
+        entry = self._data().get(key) if key else None
+        if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            return None
+        meta = entry["meta"]
+        if Path(key).stem != path.stem:
+            # данные из plist общие, а иконка привязана к имени приложения:
+            # свои файлы <app>.png и <app>-<хэш>-<размер>
+            icon = copy_icon(meta, path.stem)
+            if icon is None:
+                return None
+            meta = {**meta, **icon}
+        entry = {**entry, "meta": meta}
+        self._data()[self._key(path)] = entry
+        self._dirty = True
+        return entry
+
+    @staticmethod
+    def _icon_missing(meta: dict) -> bool:
+        icon = meta.get("iconURL", "")
+        return icon.startswith("/repo/images/") and not (IMAGES / Path(icon).name).exists()
+
+    def get(self, path: Path):
+        st = path.stat()
+        with self._lock:
+            entry = self._data().get(self._key(path)) or self._alias(path, st)
+        if entry is None:
+            return None
+
+        if entry["size"] != st.st_size:
+            return None
+
+        if entry["mtime_ns"] != st.st_mtime_ns:
+            if not (self.use_hash and entry.get("sha256")):
+                return None
+            if file_sha256(path) != entry["sha256"]:
+                return None
+            with self._lock:
+                entry["mtime_ns"] = st.st_mtime_ns
+                self._dirty = True
+
+        if self._icon_missing(entry["meta"]):
+            return None
+
+        return dict(entry["meta"])
+
+    def lookup(self, path: Path):
+        """
+        get() с учётом в счётчиках попаданий/промахов.
+        """
+        meta = self.get(path)
+        with self._lock:
+            if meta is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return meta
+
+    def put(self, path: Path, meta: dict, sha256: str = None):
+        st = path.stat()
+        if sha256 is None and self.use_hash:
+            sha256 = file_sha256(path)
+
+        with self._lock:
+            self._data()[self._key(path)] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "inode": self._inode(st),
+                "sha256": sha256,
+                "meta": meta,
+            }
+            self._inodes[self._inode(st)] = self._key(path)
+            self._dirty = True
+            self._maybe_flush()
+
+    def invalidate(self, path: Path):
+        """
+        Сбрасывает запись — вызывается при замене файла с тем же именем.
+        """
+        with self._lock:
+            if self._data().pop(self._key(path), None) is not None:
+                self._dirty = True
+
+    def extract(self, path: Path, sha256: str = None) -> dict:
+        """
+        extract_ipa_metadata с кэшированием.
+        sha256 — уже посчитанный при записи хэш (не читать файл повторно).
+        """
+        meta = self.lookup(path)
+        if meta is not None:
+            return meta
+
+        meta = extract_ipa_metadata(path)
+        IPA_EXTRACT.observe(meta["parse_ms"] / 1000)
+        self.put(path, meta, sha256=sha256)
+        return dict(meta)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data()), "hits": self.hits, "misses": self.misses}
+
+
+metacache = MetadataCache(CACHE_FILE, use_hash=os.getenv("METADATA_CACHE_HASH", "0") == "1")
+
+Gauge("bw_metacache_entries", "IPA metadata cache entries.", fn=lambda: metacache.stats()["entries"])
+Gauge(
+    "bw_metacache_lookups", "IPA metadata cache lookups since start.", ("result",),
+    fn=lambda: {("hit",): metacache.hits, ("miss",): metacache.misses},
+)
@@ -0,0 +1,278 @@
+# bot/metadb.py
+
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger("bot.metadb")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+
+CATALOG_BACKEND = os.getenv("CATALOG_BACKEND", "json")     # json | sqlite
+CATALOG_DB = Path(os.getenv("CATALOG_DB", str(BASE / "catalog.db")))
+
+
+def atomic_write(path: Path, raw: bytes, exclusive: bool = False) -> bool:
+    """
+    temp + fsync + rename: читатели видят либо старый, либо новый файл.
+    exclusive — только если файла ещё нет (False, если он уже есть).
+    """
+    # уникальное имя: пишут и потоки одного процесса, и разные процессы
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    tmp = Path(tmp)
+    try:
+        os.fchmod(fd, 0o644)
+        view = memoryview(raw)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        os.close(fd)
+
+    try:
+        if exclusive:
+            try:
+                os.link(tmp, path)      # атомарно и не перезаписывает
+            except FileExistsError:
+                return False
+        else:
+            os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return True
+
+
+def _category(raw: bytes) -> str:
+    try:
+        return json.loads(raw).get("category") or ""
+    except (ValueError, AttributeError):
+        return ""
+
+
+# ==============================
+# Backend: .json рядом с .ipa
+# ==============================
+class JsonBackend:
+    """
+    Метаданные в repo/packages/<app>.json (исходный формат).
+    """
+
+    name = "json"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, app: str) -> Path:
+        return self.root / f"{app}.json"
+
+    def get(self, app: str):
+        try:
+            return self._path(app).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def stamp(self, app: str):
+        try:
+            st = self._path(app).stat()
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def exists(self, app: str) -> bool:
+        return self._path(app).exists()
+
+    def put(self, app: str, raw: bytes):
+        atomic_write(self._path(app), raw)
+
+    def put_new(self, app: str, raw: bytes) -> bool:
+        return atomic_write(self._path(app), raw, exclusive=True)
+
+    def transaction(self):
+        # между процессами запись защищает flock в metastore.lock
+        return contextlib.nullcontext()
+
+    def names(self, category: str = None) -> list:
+        paths = sorted(self.root.glob("*.json"))
+        if category is not None:
+            paths = [p for p in paths if _category(p.read_bytes()) == category]
+        return [p.stem for p in paths]
+
+
+# ==============================
+# Backend: SQLite (WAL)
+# ==============================
+class SqliteBackend:
+    """
+    Метаданные в одной таблице SQLite. JSON хранится как есть (ETag
+    не меняется при переносе), category и bundleIdentifier вынесены в
+    индексированные колонки. rev растёт при каждой записи и служит
+    отметкой изменения для каталога вместо mtime файла.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS apps (
+            name     TEXT PRIMARY KEY,
+            data     BLOB NOT NULL,
+            rev      INTEGER NOT NULL DEFAULT 1,
+            bundle   TEXT NOT NULL DEFAULT '',
+            category TEXT NOT NULL DEFAULT '',
+            updated  REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS apps_category ON apps (category, name);
+        CREATE INDEX IF NOT EXISTS apps_bundle ON apps (bundle);
+    """
+
+    UPSERT = (
+        "INSERT INTO apps (name, data, bundle, category, updated) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET data = excluded.data, rev = rev + 1, "
+        "bundle = excluded.bundle, category = excluded.category, updated = excluded.updated"
+    )
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()     # соединение на поток пула
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(raw: bytes):
+        try:
+            data = json.loads(raw)
+            return data.get("bundleIdentifier") or "", data.get("category") or ""
+        except (ValueError, AttributeError):
+            return "", ""
+
+    def get(self, app: str):
+        row = self._conn().execute("SELECT data FROM apps WHERE name = ?", (app,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def stamp(self, app: str):
+        row = self._conn().execute("SELECT rev FROM apps WHERE name = ?", (app,)).fetchone()
+        return row[0] if row else None
+
+    def exists(self, app: str) -> bool:
+        return self.stamp(app) is not None
+
+    def put(self, app: str, raw: bytes):
+        bundle, category = self._columns(raw)
+        self._conn().execute(self.UPSERT, (app, raw, bundle, category, time.time()))
+
+    def put_new(self, app: str, raw: bytes) -> bool:
+        bundle, category = self._columns(raw)
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO apps (name, data, bundle, category, updated) VALUES (?, ?, ?, ?, ?)",
+            (app, raw, bundle, category, time.time()),
+        )
+        return cur.rowcount == 1
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Чтение-проверка-запись атомарно: BEGIN IMMEDIATE сразу берёт
+        блокировку записи, другой процесс ждёт до COMMIT.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def names(self, category: str = None) -> list:
+        if category is None:
+            rows = self._conn().execute("SELECT name FROM apps ORDER BY name")
+        else:
+            rows = self._conn().execute(
+                "SELECT name FROM apps WHERE category = ? ORDER BY name", (category,)
+            )
+        return [row[0] for row in rows]
+
+    def import_from(self, source: JsonBackend) -> int:
+        """
+        Переносит все .json (как есть) в базу одной транзакцией.
+        """
+        conn = self._conn()
+        count = 0
+        conn.execute("BEGIN")
+        try:
+            for app in source.names():
+                raw = source.get(app)
+                try:
+                    json.loads(raw)
+                except ValueError:
+                    logger.warning(f"Skipping broken {app}.json")
+                    continue
+                bundle, category = self._columns(raw)
+                conn.execute(self.UPSERT, (app, raw, bundle, category, time.time()))
+                count += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+
+def make_backend(kind: str = CATALOG_BACKEND):
+    if kind == "sqlite":
+        return SqliteBackend(CATALOG_DB)
+    if kind != "json":
+        raise RuntimeError(f"Unknown CATALOG_BACKEND: {kind}")
+    return JsonBackend(PACKAGES)
+
+
+backend = make_backend()
+
+
+# ==============================
+# Импорт / экспорт: python -m bot.metadb import|export
+# ==============================
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="SQLite catalog import/export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("import", help="repo/packages/*.json -> CATALOG_DB")
+    export = sub.add_parser("export", help="CATALOG_DB -> index.json")
+    export.add_argument("output", nargs="?", default=str(BASE / "index.json"))
+    args = parser.parse_args()
+
+    db = SqliteBackend(CATALOG_DB)
+    if args.command == "import":
+        print(f"Imported {db.import_from(JsonBackend(PACKAGES))} apps into {CATALOG_DB}")
+    else:
+        from bot.catalog import Catalog
+
+        exporter = Catalog(PACKAGES, Path(args.output), backend=db)
+        repo_data = exporter.write_index()
+        print(f"Exported {len(repo_data['apps'])} apps to {args.output}")
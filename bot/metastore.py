@@ -0,0 +1,154 @@
+# bot/metastore.py
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from bot.catalog import catalog
+from bot.metadb import backend as default_backend
+from bot.generation import generation
+from bot.watcher import index_watcher
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.metastore")
+
+LOCKS_DIR = Path("repo/.cache/locks")
+
+
+class MetadataCorrupt(ValueError):
+    pass
+
+
+class PreconditionFailed(Exception):
+    pass
+
+
+def _dumps(data: dict) -> bytes:
+    return json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8")
+
+
+def make_etag(raw: bytes) -> str:
+    return '"' + hashlib.sha256(raw).hexdigest()[:16] + '"'
+
+
+class MetadataStore:
+    """
+    Единая точка записи метаданных приложений (repo/packages/<app>.json
+    или SQLite — см. bot.metadb).
+
+    Изменения одного приложения сериализуются локом на имя (разные
+    приложения не ждут друг друга): asyncio-лок внутри процесса и flock
+    на repo/.cache/locks/<app>.lock между процессами (MODE=web + MODE=bot).
+    Запись атомарна. ETag — хэш содержимого файла, для оптимистичных
+    правок из WebApp.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._locks = {}
+
+    @staticmethod
+    def _check(name: str) -> str:
+        if not name or "/" in name or "\\" in name or name.startswith("."):
+            raise KeyError(name)
+        return name
+
+    def _flock(self, name: str):
+        """
+        Открытый файл лока с захваченным flock; закрытие снимает лок.
+        """
+        LOCKS_DIR.mkdir(parents=True, exist_ok=True)
+        f = open(LOCKS_DIR / f"{self._check(name)}.lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    @contextlib.asynccontextmanager
+    async def lock(self, name: str):
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = self._locks[name] = asyncio.Lock()
+        # сначала свой процесс (ожидание без потоков пула), потом остальные
+        async with lock:
+            f = await run_io(self._flock, name)
+            try:
+                yield
+            finally:
+                f.close()
+
+    # ==============================
+    # Синхронная часть (пул потоков)
+    # ==============================
+    def read(self, name: str):
+        """
+        (data, etag). KeyError — файла нет, MetadataCorrupt — битый JSON.
+        """
+        raw = self.backend.get(self._check(name))
+        if raw is None:
+            raise KeyError(name)
+        try:
+            return json.loads(raw), make_etag(raw)
+        except ValueError as e:
+            raise MetadataCorrupt(f"{name}: {e}")
+
+    def exists(self, name: str) -> bool:
+        return self.backend.exists(name)
+
+    def names(self, category: str = None) -> list:
+        return self.backend.names(category)
+
+    def _changed(self, name: str):
+        catalog.update(name)
+        index_watcher.touch()
+        generation.bump()
+
+    def write(self, name: str, data: dict) -> str:
+        raw = _dumps(data)
+        self.backend.put(self._check(name), raw)
+        self._changed(name)
+        return make_etag(raw)
+
+    def create(self, name: str, data: dict) -> bool:
+        """
+        Создаёт .json, только если его ещё нет (ручные правки не затираются).
+        Вызывается из пула потоков; берёт тот же лок приложения (flock),
+        что и lock()/update(), поэтому не вклинивается в их запись.
+        """
+        with contextlib.closing(self._flock(name)):
+            created = self.backend.put_new(self._check(name), _dumps(data))
+        if created:
+            self._changed(name)
+        return created
+
+    def _update(self, name: str, mutate, if_match: str = None):
+        # проверка ETag и запись — одна транзакция (SQLite: BEGIN IMMEDIATE)
+        with self.backend.transaction():
+            data, etag = self.read(name)
+            if if_match and if_match != etag:
+                raise PreconditionFailed(name)
+            mutate(data)
+            raw = _dumps(data)
+            self.backend.put(name, raw)
+        self._changed(name)
+        return data, make_etag(raw)
+
+    # ==============================
+    # Асинхронный API
+    # ==============================
+    async def update(self, name: str, mutate, if_match: str = None):
+        """
+        Чтение-изменение-запись под локом приложения.
+        mutate(data) правит dict на месте. Возвращает (data, etag).
+        """
+        async with self.lock(name):
+            return await run_io(self._update, name, mutate, if_match)
+
+
+metastore = MetadataStore(default_backend)
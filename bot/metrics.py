@@ -0,0 +1,226 @@
+# bot/metrics.py
+
+import asyncio
+import bisect
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger("bot.metrics")
+
+# секунды: от быстрых ответов из памяти до загрузки больших IPA
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _labelstr(self, key: tuple, extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(_Metric):
+    """
+    Монотонный счётчик. key — кортеж значений меток в порядке labels.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        super().__init__(name, doc, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, key: tuple = ()):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in values]
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение: set() или функция fn(), которая вызывается только
+    при чтении /metrics и возвращает число или {key: число}.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), fn=None):
+        super().__init__(name, doc, labels)
+        self._values = {}
+        self.fn = fn
+
+    def set(self, value: float, key: tuple = ()):
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> list:
+        if self.fn is not None:
+            try:
+                values = self.fn()
+            except Exception:
+                logger.exception(f"metric {self.name} failed")
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами: observe — bisect и три
+    сложения под локом, без аллокаций на горячем пути.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # key -> [counts по корзинам (+Inf последней), sum]
+
+    def observe(self, value: float, key: tuple = ()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, key: tuple = ()):
+        return _Timer(self, key)
+
+    def samples(self) -> list:
+        with self._lock:
+            series = [(k, list(counts), total) for k, (counts, total) in self._series.items()]
+
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _fmt(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{self._labelstr(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labelstr(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._labelstr(key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "key", "started")
+
+    def __init__(self, histogram: Histogram, key: tuple):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, self.key)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        Текстовый формат Prometheus (text/plain; version=0.0.4).
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ==============================
+# Метрики приложения
+# ==============================
+HTTP_LATENCY = Histogram(
+    "bw_http_request_duration_seconds", "HTTP request latency until the last body byte.",
+    ("route", "method", "status"),
+)
+HTTP_BYTES = Counter("bw_http_response_bytes_total", "Response body bytes sent.", ("route",))
+
+UPLOAD_BYTES = Counter("bw_upload_bytes_total", "IPA bytes received through the webapp.", ("kind",))
+UPLOAD_SECONDS = Histogram("bw_upload_duration_seconds", "Webapp IPA upload duration.", ("kind",))
+TG_DOWNLOAD_BYTES = Counter("bw_telegram_download_bytes_total", "IPA bytes fetched from Telegram.", ("source",))
+TG_DOWNLOAD_SECONDS = Histogram("bw_telegram_download_duration_seconds", "Telegram file download duration.", ("source",))
+
+IPA_EXTRACT = Histogram("bw_ipa_extract_duration_seconds", "extract_ipa_metadata duration.")
+INDEX_BUILD = Histogram("bw_index_build_duration_seconds", "index.json build and write duration.")
+
+LOOP_LAG = Histogram("bw_event_loop_lag_seconds", "Event loop scheduling delay.", buckets=LAG_BUCKETS)
+LOOP_LAG_MAX = Gauge("bw_event_loop_lag_max_seconds", "Largest event loop delay since start.")
+
+BOT_HANDLER = Histogram(
+    "bw_bot_handler_duration_seconds", "Telegram handler latency.", ("handler", "status"),
+)
+
+
+# ==============================
+# Задержка event loop
+# ==============================
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """
+    Засыпает на interval и меряет, насколько позже loop разбудил задачу:
+    всё сверх interval — время, которое loop был занят чем-то другим.
+    """
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.observe(lag)
+        if lag > worst:
+            worst = lag
+            LOOP_LAG_MAX.set(worst)
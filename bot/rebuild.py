@@ -0,0 +1,151 @@
+# bot/rebuild.py
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from aiogram.exceptions import TelegramAPIError
+
+from bot.metacache import metacache
+from bot.metrics import IPA_EXTRACT
+from bot.utils import extract_ipa_metadata
+from bot.workers import run_cpu, run_io
+
+logger = logging.getLogger("bot.rebuild")
+
+PROGRESS_INTERVAL = 2.0
+
+
+def _noop(_):
+    return None
+
+
+def _extract(path: str) -> dict:
+    # выполняется в дочернем процессе
+    return extract_ipa_metadata(Path(path))
+
+
+class ProgressMessage:
+    """
+    Одно сообщение в Telegram, которое редактируется по ходу работы
+    (не чаще раза в PROGRESS_INTERVAL секунд).
+    """
+
+    def __init__(self, bot, chat_id: int, title: str):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.title = title
+        self._sent = None
+        self._last = 0.0
+
+    async def start(self, total: int):
+        try:
+            self._sent = await self.bot.send_message(self.chat_id, f"{self.title}: 0/{total}")
+        except TelegramAPIError as e:
+            logger.warning(f"Progress message to {self.chat_id} failed: {e}")
+            return
+        self._last = time.monotonic()
+
+    async def update(self, done: int, total: int, force: bool = False):
+        if self._sent is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        try:
+            await self._sent.edit_text(f"{self.title}: {done}/{total}")
+        except TelegramAPIError:
+            pass    # "message is not modified", сеть — прогресс не важнее задачи
+
+
+def _split_cached(paths: list):
+    results = {}
+    misses = []
+    for path in paths:
+        meta = metacache.lookup(path)
+        if meta is None:
+            misses.append(path)
+        else:
+            results[path] = meta
+    return results, misses
+
+
+async def bulk_extract(paths: list, progress: ProgressMessage = None) -> dict:
+    """
+    Метаданные для списка IPA: попадания берутся из metacache,
+    промахи параллельно разбираются в пуле процессов (bot.workers.cpu_pool).
+    Результат совпадает с последовательными вызовами metacache.extract.
+    """
+    results, misses = await run_io(_split_cached, paths)
+
+    total = len(paths)
+    done = len(results)
+    if progress is not None:
+        await progress.start(total)
+
+    async def one(path: Path):
+        return path, await run_cpu(_extract, str(path))
+
+    started = time.perf_counter()
+    for fut in asyncio.as_completed([one(p) for p in misses]):
+        path, meta = await fut
+        # разбор шёл в дочернем процессе — время берём из результата
+        IPA_EXTRACT.observe(meta["parse_ms"] / 1000)
+        await run_io(metacache.put, path, meta)
+        results[path] = dict(meta)
+        done += 1
+        if progress is not None:
+            await progress.update(done, total)
+
+    await run_io(metacache.flush)
+    if progress is not None:
+        await progress.update(done, total, force=True)
+
+    if misses:
+        logger.info(f"Parsed {len(misses)} IPAs in {time.perf_counter() - started:.2f}s")
+    return results
+
+
+# ==============================
+# Бенчмарк: python -m bot.rebuild repo/packages
+# ==============================
+def _comparable(metas: list) -> list:
+    # время разбора отличается от запуска к запуску
+    return [{k: v for k, v in m.items() if k != "parse_ms"} for m in metas]
+
+
+def _bench(directory: Path, max_workers: int):
+    paths = sorted(directory.glob("*.ipa"))
+    if not paths:
+        print(f"No .ipa files in {directory}")
+        return
+
+    started = time.perf_counter()
+    baseline = [extract_ipa_metadata(p) for p in paths]
+    sequential = time.perf_counter() - started
+    print(f"{len(paths)} IPAs, sequential: {sequential:.2f}s")
+
+    # 1, 2, 4, ... и само max_workers
+    counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+    for workers in counts:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_noop, range(workers)))   # прогрев процессов
+            started = time.perf_counter()
+            parallel = list(pool.map(_extract, [str(p) for p in paths]))
+            elapsed = time.perf_counter() - started
+        same = "identical" if _comparable(parallel) == _comparable(baseline) else "MISMATCH"
+        print(f"workers={workers}: {elapsed:.2f}s, speedup x{sequential / elapsed:.2f}, output {same}")
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Bulk metadata rebuild benchmark")
+    parser.add_argument("directory", nargs="?", default="repo/packages")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    _bench(Path(args.directory), args.workers)
@@ -0,0 +1,281 @@
+# bot/search.py
+
+import base64
+import json
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+
+from bot.catalog import catalog
+
+logger = logging.getLogger("bot.search")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def version_key(version: str) -> tuple:
+    parts = []
+    for part in str(version or "0").split("."):
+        try:
+            parts.append(int(part))
+        except ValueError:
+            parts.append(0)
+    while len(parts) < 3:
+        parts.append(0)
+    return tuple(parts[:3])
+
+
+def _sort_key(app: dict) -> tuple:
+    version = (app.get("versions") or [{}])[0]
+    return (
+        (app.get("name") or "").lower(),
+        app.get("bundleIdentifier") or "",
+        version.get("downloadURL") or "",
+    )
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return tuple(json.loads(base64.urlsafe_b64decode(padded)))
+
+
+def _mask(ids) -> int:
+    """
+    Множество id → битовая маска (int): пересечения и подсчёт идут на C.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    bitmap = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        bitmap[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bitmap, "little")
+
+
+class _Snapshot:
+    """
+    Неизменяемый срез индексов для одного поколения каталога. Строится
+    целиком в пуле потоков; запросы на loop читают его без локов.
+    """
+
+    __slots__ = ("generation", "apps", "keys", "trigram", "prefix", "category", "min_os", "os_versions")
+
+    def __init__(self, apps: list, generation=None):
+        docs = sorted(apps, key=_sort_key)
+        trigram, prefix, category, min_os = {}, [], {}, {}
+
+        for doc_id, app in enumerate(docs):
+            name = (app.get("name") or "").lower()
+            bundle = (app.get("bundleIdentifier") or "").lower()
+
+            for text in (name, bundle):
+                prefix.append((text, doc_id))
+                for tri in _trigrams(text):
+                    trigram.setdefault(tri, set()).add(doc_id)
+
+            category.setdefault(app.get("category") or "", []).append(doc_id)
+
+            os_version = (app.get("versions") or [{}])[0].get("minOSVersion") or ""
+            min_os.setdefault(os_version, []).append(doc_id)
+
+        prefix.sort()
+        min_os = {k: _mask(v) for k, v in min_os.items()}
+
+        self.generation = generation
+        self.apps = docs
+        self.keys = [_sort_key(app) for app in docs]
+        self.trigram = trigram                  # триграмма -> set(id), разреженные
+        self.prefix = prefix                    # (строка, id), отсортировано
+        self.category = {k: _mask(v) for k, v in category.items()}     # category -> маска
+        self.min_os = min_os                    # minOSVersion -> маска
+        self.os_versions = sorted((version_key(k), m) for k, m in min_os.items())
+
+
+class SearchIndex:
+    """
+    Индексы поверх каталога: триграммы и префиксы по name/bundleIdentifier,
+    хэш-индексы по category и minOSVersion. Документы упорядочены по
+    имени, id документа — позиция в этом порядке; плотные индексы
+    хранятся битовыми масками.
+
+    Индексы живут в _Snapshot; пересборка (refresh, ~200 мс на 10k
+    приложений) идёт в пуле потоков и подменяет одну ссылку, так что
+    search() на event loop всегда видит целый срез. search() и match()
+    сами не пересобирают — вызывающий сначала делает refresh(), если stale().
+    """
+
+    def __init__(self):
+        self._snap = _Snapshot([])
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._snap.generation
+
+    @property
+    def apps(self) -> list:
+        return self._snap.apps
+
+    @property
+    def keys(self) -> list:
+        return self._snap.keys
+
+    def build(self, apps: list, generation=None):
+        self._snap = _Snapshot(apps, generation)
+
+    def stale(self) -> bool:
+        catalog.load()
+        return self._snap.generation != catalog.generation
+
+    def refresh(self):
+        """
+        Перестраивает индекс, если каталог изменился (блокирующий вызов).
+        """
+        with self._lock:
+            if self.stale():
+                generation = catalog.generation
+                self.build(catalog.apps(), generation)
+
+    # ==============================
+    # Поиск
+    # ==============================
+    @staticmethod
+    def _match_text(snap: _Snapshot, q: str) -> int:
+        if len(q) < 3:
+            # коротким запросам триграммы не помогут — ищем по префиксу
+            lo = bisect_left(snap.prefix, (q, -1))
+            hi = bisect_left(snap.prefix, (q + "\U0010ffff", -1))
+            return _mask(doc_id for _, doc_id in snap.prefix[lo:hi])
+
+        ids = None
+        for tri in sorted(_trigrams(q), key=lambda t: len(snap.trigram.get(t, ()))):
+            posting = snap.trigram.get(tri)
+            if not posting:
+                return 0
+            ids = posting if ids is None else ids & posting
+            if not ids:
+                return 0
+
+        # триграммы дают кандидатов, подстроку проверяем явно
+        return _mask(
+            doc_id for doc_id in ids
+            if q in (snap.apps[doc_id].get("name") or "").lower()
+            or q in (snap.apps[doc_id].get("bundleIdentifier") or "").lower()
+        )
+
+    @staticmethod
+    def _compatible(snap: _Snapshot, ios: str) -> int:
+        key = version_key(ios)
+        mask = 0
+        for os_key, os_mask in snap.os_versions:
+            if os_key > key:
+                break
+            mask |= os_mask
+        return mask
+
+    def _filter(self, snap: _Snapshot, q: str, category: str, min_os: str, ios: str) -> int:
+        mask = (1 << len(snap.apps)) - 1
+        if q:
+            mask &= self._match_text(snap, q.strip().lower())
+        if category:
+            mask &= snap.category.get(category, 0)
+        if min_os:
+            mask &= snap.min_os.get(min_os, 0)
+        if ios:
+            mask &= self._compatible(snap, ios)
+        return mask
+
+    def match(self, q: str = "", category: str = None, min_os: str = None, ios: str = None) -> list:
+        """
+        Все подходящие приложения по порядку имени (без пагинации).
+        """
+        snap = self._snap
+        bits = bin(self._filter(snap, q, category, min_os, ios))[:1:-1]
+        return [snap.apps[i] for i, bit in enumerate(bits) if bit == "1"]
+
+    def search(self, q: str = "", category: str = None, min_os: str = None, ios: str = None,
+               limit: int = DEFAULT_LIMIT, cursor: str = None, fields: list = None) -> dict:
+        """
+        q — подстрока name/bundleIdentifier (префикс для 1–2 символов),
+        category / min_os — точное совпадение, ios — совместимые
+        (minOSVersion <= ios). Пагинация курсором, проекция полей.
+        """
+        snap = self._snap
+        limit = min(max(int(limit or DEFAULT_LIMIT), 1), MAX_LIMIT)
+
+        mask = self._filter(snap, q, category, min_os, ios)
+        total = mask.bit_count()
+        if cursor:
+            after = bisect_right(snap.keys, decode_cursor(cursor))
+            mask = mask >> after << after
+
+        # первые limit установленных битов — id по порядку имени
+        page = []
+        while mask and len(page) < limit:
+            low = mask & -mask
+            page.append(low.bit_length() - 1)
+            mask ^= low
+
+        apps = [snap.apps[i] for i in page]
+        if fields:
+            apps = [{f: app[f] for f in fields if f in app} for app in apps]
+
+        next_cursor = encode_cursor(snap.keys[page[-1]]) if mask else None
+        return {"total": total, "apps": apps, "next_cursor": next_cursor}
+
+
+search_index = SearchIndex()
+
+
+# ==============================
+# Бенчмарк: python -m bot.search
+# ==============================
+def _bench(count: int = 10000, rounds: int = 1000):
+    import random
+    import string
+    import time
+
+    rnd = random.Random(42)
+    categories = ["utilities", "games", "social", "music", "photo", "productivity"]
+    apps = []
+    for i in range(count):
+        word = "".join(rnd.choices(string.ascii_lowercase, k=8))
+        apps.append({
+            "name": f"{word.title()} {i}",
+            "bundleIdentifier": f"com.{word}.app{i}",
+            "category": rnd.choice(categories),
+            "versions": [{"downloadURL": f"/repo/packages/{word}{i}.ipa",
+                          "minOSVersion": rnd.choice(["12.0", "13.0", "14.0", "15.0", "16.0"])}],
+        })
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.build(apps)
+    print(f"build: {count} apps in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    queries = {
+        "substring": lambda: index.search(q=apps[rnd.randrange(count)]["name"][2:6].lower(), limit=20),
+        "prefix": lambda: index.search(q=rnd.choice(string.ascii_lowercase), limit=20),
+        "category+ios": lambda: index.search(category=rnd.choice(categories), ios="14.0", limit=20),
+        "bundle": lambda: index.search(q=apps[rnd.randrange(count)]["bundleIdentifier"], limit=20),
+        "page": lambda: index.search(limit=20, cursor=encode_cursor(index.keys[rnd.randrange(count)])),
+    }
+    for name, run in queries.items():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            run()
+        per_query = (time.perf_counter() - started) / rounds * 1e6
+        print(f"{name:>13}: {per_query:8.1f} µs/query")
+
+
+if __name__ == "__main__":
+    _bench()
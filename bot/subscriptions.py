@@ -6,6 +6,8 @@ from aiogram import types, Dispatcher
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from bot.access import check_access
+from bot.catalog import catalog
+from bot.workers import run_io
 
 BASE = Path("repo")
 PACKAGES = BASE / "packages"
@@ -33,7 +35,8 @@ async def cmd_subscribe(message: types.Message):
         await message.answer("❌ У вас нет доступа к подпискам.")
         return
 
-    apps = [f.stem for f in PACKAGES.glob("*.ipa")]
+    await run_io(catalog.load)
+    apps = catalog.names()
     if not apps:
         await message.answer("❌ Нет доступных приложений.")
         return
@@ -54,7 +57,8 @@ async def callback_app_select(query: CallbackQuery):
 
     app_name = query.data.split(":", 1)[1]
 
-    if not (PACKAGES / f"{app_name}.ipa").exists():
+    await run_io(catalog.load)
+    if app_name not in catalog.names():
         await query.message.edit_text("❌ Приложение больше не доступно.")
         return
 
@@ -0,0 +1,179 @@
+# bot/tasks.py
+
+import logging
+from pathlib import Path
+
+from bot.catalog import catalog
+from bot.icons import absolute_icons, gc_variants
+from bot.ingest import publish_package
+from bot.jobs import job_queue, Job, JobProgress, PRIORITY_INTERACTIVE, PRIORITY_INDEX, PRIORITY_BULK
+from bot.metastore import metastore
+from bot.rebuild import ProgressMessage, bulk_extract
+from bot.utils import get_file_size
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.tasks")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+
+
+# ==============================
+# /fixmeta и /repo: общие шаги
+# ==============================
+def fixmeta_pending() -> list:
+    return [ipa for ipa in PACKAGES.glob("*.ipa") if not metastore.exists(ipa.stem)]
+
+
+def fixmeta_write(pending: list, metas: dict, server_url: str):
+    """
+    Создаёт недостающие .json по готовым метаданным (выполняется в пуле потоков).
+    """
+    created = 0
+    report = ""
+
+    for ipa in pending:
+        meta = metas[ipa]
+
+        meta_info = {
+            "name": meta.get("name") or ipa.stem,
+            "bundleIdentifier": meta.get("bundleIdentifier") or f"com.projectbw.{ipa.stem.lower()}",
+            "developerName": meta.get("developerName") or "Unknown",
+            "iconURL": "",
+            "icons": absolute_icons(meta.get("icons"), server_url),
+            "localizedDescription": meta.get("localizedDescription") or "Описание недоступно.",
+            "subtitle": "",
+            "tintColor": "3c94fc",
+            "category": "utilities",
+            "versions": [
+                {
+                    "downloadURL": f"{server_url}/repo/packages/{ipa.name}",
+                    "size": get_file_size(ipa),
+                    "version": meta.get("version") or "1.0",
+                    "buildVersion": meta.get("build") or "1",
+                    "date": meta.get("date") or "",
+                    "localizedDescription": meta.get("localizedDescription") or "",
+                    "minOSVersion": meta.get("min_ios") or "16.0"
+                }
+            ]
+        }
+
+        # .json мог появиться параллельно (загрузка, правка) — не затираем
+        if not metastore.create(ipa.stem, meta_info):
+            continue
+        created += 1
+        report += f"✔ Создан meta: {ipa.stem}.json\n"
+
+    return created, report
+
+
+def rebuild_index():
+    catalog.sync()
+    catalog.write_index()
+
+
+# ==============================
+# Задачи очереди
+# ==============================
+def _stamp(path: Path) -> list:
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+async def job_publish(job: Job):
+    target = Path(job.args["path"])
+    sha256 = job.args.get("sha256")
+    if sha256 and await run_io(_stamp, target) != job.args.get("stamp"):
+        sha256 = None       # файл успели заменить — хэш посчитается заново
+
+    async with metastore.lock(target.stem):
+        await run_io(publish_package, target, job.args["server_url"], sha256, False)
+    # несколько загрузок подряд — одна запись index.json;
+    # в MODE=web index.json пересобирает наблюдатель процесса бота
+    if not catalog.follower:
+        await job_queue.submit("write_index", key="write_index")
+    return {"saved": target.name}
+
+
+async def job_write_index(job: Job):
+    await run_io(catalog.write_index)
+
+
+def gc_icon_variants() -> int:
+    # файлы вариантов, на которые ссылаются приложения каталога
+    referenced = {
+        url.rsplit("/", 1)[-1]
+        for app in catalog.apps()
+        for icon in app.get("icons") or []
+        for url in (icon.get("png"), icon.get("webp"))
+        if url
+    }
+    return gc_variants(referenced)
+
+
+def sync_index(images: list) -> dict:
+    """
+    Инкрементальная пересборка по событиям наблюдателя (bot.watcher):
+    index.json пишется, только если каталог действительно изменился.
+    """
+    changed = catalog.sync()
+    for name in images:
+        # <app>.png появилась или пропала — меняется iconURL
+        if (PACKAGES / f"{name}.ipa").exists():
+            catalog.update(name)
+            changed += 1
+    written = catalog.dirty()
+    if written:
+        catalog.write_index()
+    # после публикации: index.json уже не ссылается на старые варианты
+    gc_icon_variants()
+    return {"changed": changed, "written": written}
+
+
+async def job_sync_index(job: Job):
+    return await run_io(sync_index, job.args.get("images", []))
+
+
+def _progress(job: Job, title: str) -> JobProgress:
+    # прогресс в чат — только там, где есть бот (MODE=all / MODE=bot)
+    chat_id = job.args.get("chat_id")
+    message = None
+    if chat_id is not None and job_queue.bot is not None:
+        message = ProgressMessage(job_queue.bot, chat_id, title)
+    return JobProgress(job, message)
+
+
+async def job_fixmeta(job: Job):
+    server_url = job.args["server_url"]
+    pending = await run_io(fixmeta_pending)
+    progress = _progress(job, "🔍 Разбор IPA") if pending else JobProgress(job)
+    metas = await bulk_extract(pending, progress)
+    created, report = await run_io(fixmeta_write, pending, metas, server_url)
+    return {"created": created, "report": report}
+
+
+async def job_repo(job: Job):
+    # IPA без .json разбираются заранее, параллельно
+    pending = await run_io(fixmeta_pending)
+    if pending:
+        await bulk_extract(pending, _progress(job, "🔍 Разбор IPA"))
+
+    # перестраиваются только изменившиеся записи каталога
+    await run_io(rebuild_index)
+    return {"apps": catalog.names()}
+
+
+job_queue.register("publish", job_publish, PRIORITY_INTERACTIVE)
+job_queue.register("write_index", job_write_index, PRIORITY_INDEX)
+job_queue.register("sync_index", job_sync_index, PRIORITY_INDEX)
+job_queue.register("fixmeta", job_fixmeta, PRIORITY_BULK)
+job_queue.register("repo", job_repo, PRIORITY_BULK)
+
+
+async def submit_publish(target: Path, server_url: str, sha256: str = None, chat_id: int = None) -> Job:
+    args = {"path": str(target), "server_url": server_url, "sha256": sha256, "stamp": await run_io(_stamp, target)}
+    if chat_id is not None:
+        args["chat_id"] = chat_id
+    # публикуется то, что лежит на диске: повторная загрузка файла,
+    # пока прежняя ещё в очереди, — одна задача
+    return await job_queue.submit("publish", args, key=f"publish:{target.name}")
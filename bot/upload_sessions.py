@@ -0,0 +1,322 @@
+# bot/upload_sessions.py
+
+import hashlib
+import json
+import logging
+import os
+import fcntl
+import secrets
+import shutil
+import time
+from pathlib import Path
+
+from bot.ingest import INCOMING, PACKAGES, MAX_UPLOAD_SIZE, UploadTooLarge, safe_ipa_name
+from bot.metacache import metacache
+
+logger = logging.getLogger("bot.upload_sessions")
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# лимиты на пользователя: место под .part выделяется сразу целиком
+UPLOAD_SESSIONS_PER_USER = int(os.getenv("UPLOAD_SESSIONS_PER_USER", "4"))
+UPLOAD_RESERVED_PER_USER = int(os.getenv("UPLOAD_RESERVED_PER_USER", str(2 * MAX_UPLOAD_SIZE)))
+# сессия без новых чанков дольше этого считается брошенной
+UPLOAD_SESSION_IDLE = int(os.getenv("UPLOAD_SESSION_IDLE", str(6 * 3600)))
+
+
+class ChunkError(Exception):
+    pass
+
+
+class SessionLimit(Exception):
+    """
+    У пользователя слишком много открытых сессий или зарезервированных байт.
+    """
+
+
+class SessionForbidden(Exception):
+    """
+    Сессию создал другой пользователь.
+    """
+
+
+class UploadSession:
+    """
+    Возобновляемая загрузка: файл заранее выделяется целиком, чанки
+    пишутся параллельно по своим смещениям (pwrite).
+
+    Параметры сессии лежат рядом в .session.json и после создания не
+    меняются; каждый принятый чанк отмечается своим файлом в
+    <id>.chunks/. Так запросы одной сессии могут приходить в разные
+    процессы (MODE=web, WEB_WORKERS > 1) и ничего не теряется: список
+    принятых чанков всегда читается с диска.
+    """
+
+    def __init__(self, state: dict):
+        self.state = state
+
+    # ==============================
+    # Пути и свойства
+    # ==============================
+    @property
+    def id(self) -> str:
+        return self.state["id"]
+
+    @property
+    def part_path(self) -> Path:
+        return INCOMING / f"{self.id}.part"
+
+    @property
+    def state_path(self) -> Path:
+        return INCOMING / f"{self.id}.session.json"
+
+    @property
+    def chunks_dir(self) -> Path:
+        return INCOMING / f"{self.id}.chunks"
+
+    @property
+    def chunks(self) -> int:
+        size, chunk_size = self.state["size"], self.state["chunk_size"]
+        return max(1, -(-size // chunk_size))
+
+    def check_owner(self, user_id: int):
+        if self.state.get("owner") != user_id:
+            raise SessionForbidden(self.id)
+
+    def chunk_length(self, index: int) -> int:
+        start = index * self.state["chunk_size"]
+        return min(self.state["chunk_size"], self.state["size"] - start)
+
+    def _save(self):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    def received(self) -> list:
+        try:
+            names = os.listdir(self.chunks_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(int(n) for n in names if n.isdigit() and int(n) < self.chunks)
+
+    # ==============================
+    # Операции
+    # ==============================
+    def write_chunk(self, index: int, data: bytes, checksum: str):
+        if not 0 <= index < self.chunks:
+            raise ChunkError(f"Chunk index out of range: {index}")
+        if len(data) != self.chunk_length(index):
+            raise ChunkError(f"Chunk {index}: expected {self.chunk_length(index)} bytes, got {len(data)}")
+        if not checksum or hashlib.sha256(data).hexdigest() != checksum.lower():
+            raise ChunkError(f"Chunk {index}: checksum mismatch")
+
+        try:
+            fd = os.open(self.part_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise KeyError(self.id)
+        try:
+            offset = index * self.state["chunk_size"]
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+
+        # отметка чанка — отдельный файл: параллельные запросы
+        # (в том числе из разных процессов) не затирают друг друга
+        try:
+            (self.chunks_dir / str(index)).touch()
+            os.utime(self.state_path)       # для cleanup_incoming: сессия жива
+        except FileNotFoundError:
+            raise KeyError(self.id)         # сессию уже собрали или отменили
+
+    def status(self) -> dict:
+        received = self.received()
+        # непрерывный префикс — откуда можно продолжать последовательно
+        contiguous = 0
+        while contiguous < len(received) and received[contiguous] == contiguous:
+            contiguous += 1
+        return {
+            "id": self.id,
+            "filename": self.state["filename"],
+            "size": self.state["size"],
+            "chunk_size": self.state["chunk_size"],
+            "chunks": self.chunks,
+            "received": received,
+            "offset": min(contiguous * self.state["chunk_size"], self.state["size"]),
+            "complete": len(received) == self.chunks,
+        }
+
+    def assemble(self):
+        """
+        Проверяет полноту и атомарно переносит файл в repo/packages
+        без дополнительного копирования. Возвращает (path, sha256).
+        """
+        INCOMING.mkdir(parents=True, exist_ok=True)
+        with open(INCOMING / f".{self.id}.lock", "a") as lock:
+            # второй finalize той же сессии (другой процесс) ждёт здесь
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self.state_path.exists():
+                raise KeyError(self.id)
+            missing = self.chunks - len(self.received())
+            if missing:
+                raise ChunkError(f"{missing} chunks are missing")
+
+            h = hashlib.sha256()
+            with open(self.part_path, "rb") as f:
+                while block := f.read(1024 * 1024):
+                    h.update(block)
+                os.fsync(f.fileno())
+            sha256 = h.hexdigest()
+
+            expected = self.state.get("sha256")
+            if expected and expected.lower() != sha256:
+                raise ChunkError("File checksum mismatch")
+
+            target = PACKAGES / self.state["filename"]
+            os.replace(self.part_path, target)
+            self.state_path.unlink(missing_ok=True)
+            shutil.rmtree(self.chunks_dir, ignore_errors=True)
+            lock_path = Path(lock.name)
+        lock_path.unlink(missing_ok=True)
+
+        metacache.invalidate(target)
+        logger.info(f"Assembled {target.name}: {self.state['size']} bytes, sha256={sha256}")
+        return target, sha256
+
+    def abort(self):
+        self.state_path.unlink(missing_ok=True)
+        self.part_path.unlink(missing_ok=True)
+        shutil.rmtree(self.chunks_dir, ignore_errors=True)
+
+
+class UploadSessions:
+    """
+    Сессии не кешируются в процессе: каждый запрос читает
+    .session.json, чтобы видеть сборку и отмену из других процессов.
+    """
+
+    def create(self, filename: str, size: int, chunk_size: int = None, sha256: str = None,
+               owner: int = None) -> UploadSession:
+        """
+        Параметры приходят из JSON клиента как есть: всё, что не проходит
+        проверку, — ChunkError (400), а не исключение в арифметике.
+        """
+        if not isinstance(filename, str):
+            raise ChunkError("Bad filename")
+        name = safe_ipa_name(filename)
+        size = _int_param("size", size)
+        if size <= 0:
+            raise ChunkError("Empty file")
+        if size > MAX_UPLOAD_SIZE:
+            raise UploadTooLarge(f"{name}: {size} bytes")
+        chunk_size = DEFAULT_CHUNK_SIZE if chunk_size is None else _int_param("chunk_size", chunk_size)
+        chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        if sha256 is not None and not _is_sha256(sha256):
+            raise ChunkError("Bad sha256")
+
+        INCOMING.mkdir(parents=True, exist_ok=True)
+        # проверка лимитов и выделение места — под одной блокировкой,
+        # иначе параллельные create из разных процессов обойдут лимит
+        with open(INCOMING / "sessions.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.expire()
+            if owner is not None:
+                self._check_quota(owner, size)
+            return self._allocate(name, size, chunk_size, sha256, owner)
+
+    def _allocate(self, name: str, size: int, chunk_size: int, sha256: str, owner: int) -> UploadSession:
+        session = UploadSession({
+            "id": secrets.token_hex(16),
+            "filename": name,
+            "size": size,
+            "chunk_size": chunk_size,
+            "sha256": sha256,
+            "owner": owner,             # user_id из WebApp: чужие запросы — 403
+            "created": time.time(),
+        })
+
+        with open(session.part_path, "wb") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                f.truncate(size)
+        session.chunks_dir.mkdir()
+        session._save()
+        logger.info(f"Upload session {session.id} for {name} ({size} bytes)")
+        return session
+
+    def _sessions(self):
+        for path in INCOMING.glob("*.session.json"):
+            try:
+                state = json.loads(path.read_text(encoding="utf-8"))
+                idle = time.time() - path.stat().st_mtime
+            except (FileNotFoundError, ValueError):
+                continue
+            yield UploadSession(state), idle
+
+    def expire(self, max_idle: float = None):
+        """
+        Удаляет сессии, в которые давно не приходили чанки:
+        их .part держит место на диске и квоту владельца.
+        """
+        max_idle = UPLOAD_SESSION_IDLE if max_idle is None else max_idle
+        for session, idle in self._sessions():
+            if idle <= max_idle:
+                continue
+            with open(INCOMING / f".{session.id}.lock", "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue        # как раз собирается — не брошена
+                logger.info(f"Upload session {session.id} expired after {int(idle)}s idle")
+                session.abort()
+                lock_path = Path(lock.name)
+            lock_path.unlink(missing_ok=True)
+
+    def _check_quota(self, owner: int, size: int):
+        sessions = [s for s, _ in self._sessions() if s.state.get("owner") == owner]
+        if len(sessions) >= UPLOAD_SESSIONS_PER_USER:
+            raise SessionLimit(f"Too many open upload sessions (max {UPLOAD_SESSIONS_PER_USER})")
+        reserved = sum(s.state["size"] for s in sessions)
+        if reserved + size > UPLOAD_RESERVED_PER_USER:
+            raise SessionLimit(f"Upload quota exceeded: {reserved} bytes already reserved")
+
+    def get(self, session_id: str, user_id: int = None) -> UploadSession:
+        """
+        Сессия с диска; с user_id — только сессия этого пользователя
+        (SessionForbidden для чужой).
+        """
+        if not session_id.isalnum():
+            raise KeyError(session_id)
+        try:
+            state = json.loads((INCOMING / f"{session_id}.session.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            raise KeyError(session_id)
+        session = UploadSession(state)
+        if user_id is not None:
+            session.check_owner(user_id)
+        return session
+
+
+def _int_param(name: str, value) -> int:
+    # bool — подкласс int, но true/false в JSON размером не считаем
+    if isinstance(value, bool):
+        raise ChunkError(f"Bad {name}")
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if not isinstance(value, int):
+        raise ChunkError(f"Bad {name}")
+    return value
+
+
+def _is_sha256(value) -> bool:
+    return (isinstance(value, str) and len(value) == 64
+            and all(c in "0123456789abcdefABCDEF" for c in value))
+
+
+upload_sessions = UploadSessions()
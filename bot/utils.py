@@ -3,49 +3,111 @@
 import zipfile
 import plistlib
 from pathlib import Path
-import shutil
 import logging
+import time
+
+from bot.icons import process_icon
 
 logger = logging.getLogger("bot.utils")
 
 IMAGES = Path("repo/images")
 IMAGES.mkdir(parents=True, exist_ok=True)
 
+ICON_SUFFIXES = ("@3x.png", "@2x.png", ".png", "@2x~ipad.png", "~ipad.png", "@3x~ipad.png")
+
+
+def find_app_dir(zf: zipfile.ZipFile):
+    """
+    Payload/<X>.app/ — корень приложения. Обычно это первые записи архива,
+    поэтому перебор заканчивается почти сразу.
+    """
+    for info in zf.infolist():
+        parts = info.filename.split("/")
+        if len(parts) >= 3 and parts[0] == "Payload" and parts[1].endswith(".app"):
+            return f"Payload/{parts[1]}/"
+    return None
+
+
+def _icon_names(plist_data: dict) -> list:
+    names = []
+    for key in ("CFBundleIcons", "CFBundleIcons~ipad"):
+        primary = (plist_data.get(key) or {}).get("CFBundlePrimaryIcon") or {}
+        if isinstance(primary, dict):
+            names += primary.get("CFBundleIconFiles") or []
+            if primary.get("CFBundleIconName"):
+                names.append(primary["CFBundleIconName"])
+    names += plist_data.get("CFBundleIconFiles") or []
+    if plist_data.get("CFBundleIconFile"):
+        names.append(plist_data["CFBundleIconFile"])
+    return [n for n in names if isinstance(n, str) and n]
+
+
+def find_icon(zf: zipfile.ZipFile, app_dir: str, plist_data: dict):
+    """
+    Самая большая иконка из CFBundleIcons / CFBundleIconFiles — прямыми
+    обращениями к центральному каталогу, без обхода всех записей.
+    """
+    best = None
+    for name in _icon_names(plist_data):
+        if name.lower().endswith(".png"):
+            candidates = [name]
+        else:
+            candidates = [name + suffix for suffix in ICON_SUFFIXES]
+        for candidate in candidates:
+            info = zf.NameToInfo.get(app_dir + candidate)
+            if info is not None and (best is None or info.file_size > best.file_size):
+                best = info
+
+    if best is None:
+        # старые сборки без ключей иконок: AppIcon*.png в корне .app
+        for info in zf.infolist():
+            rest = info.filename[len(app_dir):] if info.filename.startswith(app_dir) else None
+            if rest and "/" not in rest and rest.endswith(".png") and "AppIcon" in rest:
+                if best is None or info.file_size > best.file_size:
+                    best = info
+
+    return best
+
+
 def extract_ipa_metadata(ipa_path: Path) -> dict:
     """
     Извлекает метаданные из .ipa файла для Ksign.
     """
     meta = {}
+    started = time.perf_counter()
     try:
         with zipfile.ZipFile(ipa_path, "r") as zf:
-            # Находим Info.plist внутри Payload/*.app/
-            info_plist_path = None
-            icon_path = None
-            for f in zf.namelist():
-                if f.endswith("Info.plist") and f.startswith("Payload/"):
-                    info_plist_path = f
-                if f.endswith(".png") and "AppIcon" in f:
-                    icon_path = f
-
-            if info_plist_path:
-                with zf.open(info_plist_path) as plist_file:
+            # Info.plist самого приложения: Payload/<X>.app/Info.plist
+            app_dir = find_app_dir(zf)
+            plist_data = {}
+            icon_info = None
+
+            if app_dir and (app_dir + "Info.plist") in zf.NameToInfo:
+                with zf.open(app_dir + "Info.plist") as plist_file:
                     plist_data = plistlib.load(plist_file)
                     meta["name"] = plist_data.get("CFBundleDisplayName") or plist_data.get("CFBundleName") or ipa_path.stem
                     meta["bundleIdentifier"] = plist_data.get("CFBundleIdentifier", "")
                     meta["version"] = plist_data.get("CFBundleShortVersionString", "1.0")
+                    meta["build"] = plist_data.get("CFBundleVersion", "")
                     meta["min_ios"] = plist_data.get("MinimumOSVersion", "16.0")
                     meta["localizedDescription"] = plist_data.get("CFBundleGetInfoString", "")
                     meta["subtitle"] = ""
                     meta["tintColor"] = "3c94fc"
                     meta["category"] = "utilities"
 
-            # Извлекаем иконку
-            if icon_path:
-                icon_filename = f"{ipa_path.stem}.png"
-                target_icon = IMAGES / icon_filename
-                with zf.open(icon_path) as icon_file, open(target_icon, "wb") as f_out:
-                    shutil.copyfileobj(icon_file, f_out)
-                meta["iconURL"] = f"/repo/images/{icon_filename}"
+            if app_dir:
+                icon_info = find_icon(zf, app_dir, plist_data)
+
+            # Извлекаем иконку: CgBI → PNG, варианты 60/120/180 PNG + WebP
+            if icon_info is not None:
+                icon_data = zf.read(icon_info)
+                try:
+                    meta.update(process_icon(icon_data, ipa_path.stem))
+                except Exception as e:
+                    logger.warning(f"Icon processing failed for {ipa_path.name}: {e}")
+                    icon_filename = f"{ipa_path.stem}.png"
+                    (IMAGES / icon_filename).write_bytes(icon_data)
+                    meta["iconURL"] = f"/repo/images/{icon_filename}"
             else:
                 meta["iconURL"] = ""
 
@@ -61,7 +123,28 @@ def extract_ipa_metadata(ipa_path: Path) -> dict:
         meta.setdefault("tintColor", "3c94fc")
         meta.setdefault("category", "utilities")
 
+    # время разбора сохраняется вместе с метаданными (metacache) и в логе
+    meta["parse_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Parsed {ipa_path.name} in {meta['parse_ms']} ms")
     return meta
 
 def get_file_size(path: Path) -> int:
-    return path.stat().st_size if path.exists() else 0
\ No newline at end of file
+    return path.stat().st_size if path.exists() else 0
+
+def resolve_icon_url(meta: dict, ipa_name: str, server_url: str) -> str:
+    """
+    Приводит iconURL к абсолютной ссылке на сервер.
+    """
+    icon_url = meta.get("iconURL", "").strip()
+
+    if icon_url.startswith("http://") or icon_url.startswith("https://"):
+        return icon_url
+
+    guessed_png = IMAGES / (Path(ipa_name).stem + ".png")
+    if icon_url == "" and guessed_png.exists():
+        return f"{server_url}/repo/images/{guessed_png.name}"
+
+    if icon_url.startswith("/"):
+        return f"{server_url}{icon_url}"
+
+    return ""
\ No newline at end of file
@@ -0,0 +1,120 @@
+# bot/versions.py
+
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+
+logger = logging.getLogger("bot.versions")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+VERSIONS = PACKAGES / "versions"    # versions/<имя .ipa>/<version>+<build>.ipa
+
+MAX_VERSIONS = int(os.getenv("MAX_VERSIONS", "5"))
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._+-]")
+
+
+def _safe(part: str) -> str:
+    part = _UNSAFE.sub("_", str(part or "")).strip(".")
+    return part or "unknown"
+
+
+def version_path(app: str, version: str, build: str = "") -> Path:
+    """
+    Путь сборки в истории. Ключ — имя файла приложения, а не bundle id:
+    один и тот же IPA, загруженный под двумя именами, — два приложения
+    со своей историей и своим прореживанием.
+    """
+    name = _safe(version) + (f"+{_safe(build)}" if build else "")
+    return VERSIONS / _safe(app) / f"{name}.ipa"
+
+
+def version_url(path: Path, server_url: str) -> str:
+    rel = path.relative_to(PACKAGES).as_posix()
+    return f"{server_url}/repo/packages/{rel}"
+
+
+def _link_or_copy(src: Path, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() and os.path.samefile(src, dst):
+        return      # rename() между ссылками на один inode ничего не делает
+    tmp = dst.with_name(dst.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)           # без копирования данных
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def path_from_url(url: str):
+    marker = "/repo/packages/versions/"
+    if marker not in url:
+        return None
+    return VERSIONS / url.split(marker, 1)[1]
+
+
+def store_version(target: Path, meta: dict, server_url: str) -> dict:
+    """
+    Сохраняет сборку под versions/<имя>/<version>.ipa и возвращает
+    запись для списка versions.
+    """
+    version = meta.get("version") or "1.0"
+    build = meta.get("build") or ""
+    path = version_path(target.stem, version, build)
+    _link_or_copy(target, path)
+
+    return {
+        "downloadURL": version_url(path, server_url),
+        "size": path.stat().st_size,
+        "version": version,
+        "buildVersion": build or "1",
+        "date": time.strftime("%Y-%m-%d"),
+        "localizedDescription": meta.get("localizedDescription") or "",
+        "minOSVersion": meta.get("min_ios") or "16.0"
+    }
+
+
+def add_version(app_meta: dict, entry: dict, keep: int = MAX_VERSIONS, in_use=None) -> list:
+    """
+    Новая сборка — первой в versions, та же версия/сборка заменяется.
+    Сверх лимита старые записи удаляются вместе с файлами.
+    in_use(path) — файл ещё нужен другому приложению (записи старого
+    формата versions/<bundle>/ могут быть общими), такой не удаляется.
+    Возвращает список удалённых путей.
+    """
+    new_path = path_from_url(entry["downloadURL"])
+    key = (entry["version"], entry["buildVersion"])
+
+    versions = [entry]
+    dropped = []
+    for v in app_meta.get("versions") or []:
+        path = path_from_url(v.get("downloadURL", ""))
+        if path is None:
+            # запись старого формата указывает на перезаписываемый файл
+            continue
+        if (v.get("version"), v.get("buildVersion")) == key:
+            dropped.append(path)
+        else:
+            versions.append(v)
+
+    keep = max(keep, 1)
+    dropped += [path_from_url(v["downloadURL"]) for v in versions[keep:]]
+
+    removed = []
+    for path in dropped:
+        if path == new_path or not path.exists():
+            continue
+        if in_use is not None and in_use(path):
+            logger.info(f"Keeping shared build {path}")
+            continue
+        path.unlink()
+        removed.append(path)
+        logger.info(f"Pruned old build {path}")
+
+    app_meta["versions"] = versions[:keep]
+    return removed
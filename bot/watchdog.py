@@ -0,0 +1,229 @@
+# bot/watchdog.py
+
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from bot.metrics import Counter
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.watchdog")
+
+# сколько loop может не отвечать, прежде чем снимать стек (0 — выключено)
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.5"))
+# PROFILE=1 — профилировщик работает с запуска и периодически пишет файл
+PROFILE = os.getenv("PROFILE", "0") == "1"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+PROFILE_DUMP_INTERVAL = float(os.getenv("PROFILE_DUMP_INTERVAL", "60"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "repo/.cache/profiles"))
+
+MAX_STACKS_PER_STALL = 5
+
+LOOP_STALLS = Counter("bw_event_loop_stalls_total", "Event loop stalls longer than the watchdog threshold.")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    # loop ждёт событий в selector.select() — это простой, а не работа
+    code = frame.f_code
+    return code.co_name in ("select", "poll") and code.co_filename.endswith("selectors.py")
+
+
+# ==============================
+# Watchdog
+# ==============================
+class LoopWatchdog:
+    """
+    Сторожевой поток для event loop, общего у uvicorn и aiogram.
+
+    Loop раз в threshold/4 отмечает «жив». Поток проверяет отметку, и если
+    loop молчит дольше threshold, снимает стек потока loop (там и будет
+    блокирующий код), пока блокировка не кончится (не больше
+    MAX_STACKS_PER_STALL раз). По окончании в лог уходит длительность
+    и различающиеся стеки.
+    """
+
+    def __init__(self, threshold: float = LOOP_WATCHDOG_THRESHOLD):
+        self.threshold = threshold
+        self.stalls = collections.deque(maxlen=20)      # последние блокировки
+        self._beat = time.monotonic()
+        self._gaps = collections.deque(maxlen=32)     # (прошлая отметка, пауза)
+        self._loop_thread = None
+        self._thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    async def _heartbeat(self):
+        interval = self.threshold / 4
+        while True:
+            now = time.monotonic()
+            if now - self._beat > self.threshold:
+                self._gaps.append((self._beat, now - self._beat))
+            self._beat = now
+            await asyncio.sleep(interval)
+
+    def _capture(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread)
+        return "".join(traceback.format_stack(frame)) if frame is not None else ""
+
+    def _watch(self):
+        interval = self.threshold / 4
+        while not self._stop.wait(interval):
+            beat = self._beat
+            if time.monotonic() - beat < self.threshold:
+                continue
+
+            # loop заблокирован: снимаем стеки, пока отметка не сдвинется
+            stacks = []
+            while self._beat == beat and not self._stop.is_set():
+                if len(stacks) < MAX_STACKS_PER_STALL:
+                    stack = self._capture()
+                    if stack and stack not in stacks:
+                        stacks.append(stack)
+                self._stop.wait(self.threshold)
+
+            # пауза, которую увидел сам loop; interval сна — не блокировка
+            gap = next((g for prev, g in self._gaps if prev == beat), self._beat - beat)
+            duration = max(0.0, gap - interval)
+            LOOP_STALLS.inc()
+            self.stalls.append({"at": time.time(), "duration": round(duration, 3), "stacks": stacks})
+            logger.warning(
+                f"Event loop blocked for {duration:.2f}s, stack(s) of the loop thread:\n"
+                + "\n---\n".join(stacks)
+            )
+
+    def start(self):
+        """
+        Вызывается из работающего event loop.
+        """
+        if self.threshold <= 0 or self._thread is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold {self.threshold}s)")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+        self._thread = None
+
+
+# ==============================
+# Семплирующий профилировщик
+# ==============================
+class SamplingProfiler:
+    """
+    Раз в interval снимает стек потока event loop и считает одинаковые
+    стеки. Результат — collapsed stacks («a;b;c 42» построчно), формат
+    flamegraph.pl / speedscope / inferno. Обработчики aiogram и маршруты
+    FastAPI видны в стеке как кадры своих функций (cmd_repo, get_package).
+    Простой loop в select() по умолчанию не считается.
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = PROFILE_INTERVAL, include_idle: bool = False):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = collections.Counter()
+        self.total = 0
+        self.started = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.total += 1
+        if not self.include_idle and _is_idle(frame):
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        with self._lock:
+            self.samples[key] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int = None):
+        if self.running:
+            return
+        self.thread_id = thread_id or self.thread_id or threading.get_ident()
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def collapsed(self) -> str:
+        with self._lock:
+            items = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def dump(self, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(self.collapsed(), encoding="utf-8")
+        os.replace(tmp, path)
+        return path
+
+
+async def profile_for(seconds: float, include_idle: bool = False) -> SamplingProfiler:
+    """
+    Профилирует текущий event loop seconds секунд (для /profile).
+    """
+    profiler = SamplingProfiler(threading.get_ident(), include_idle=include_idle)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    return profiler
+
+
+async def profile_forever(dump_interval: float = PROFILE_DUMP_INTERVAL):
+    """
+    PROFILE=1: профиль копится с запуска и раз в dump_interval
+    перезаписывается в PROFILE_DIR/profile.collapsed.
+    """
+    profiler = SamplingProfiler(threading.get_ident())
+    profiler.start()
+    path = PROFILE_DIR / "profile.collapsed"
+    logger.info(f"Sampling profiler enabled, writing {path}")
+    try:
+        while True:
+            await asyncio.sleep(dump_interval)
+            await run_io(profiler.dump, path)
+    finally:
+        profiler.stop()
+        profiler.dump(path)
+
+
+loop_watchdog = LoopWatchdog()
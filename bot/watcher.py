@@ -0,0 +1,210 @@
+# bot/watcher.py
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from bot.generation import GENERATION_FILE, generation
+from bot.jobs import job_queue
+from bot.workers import run_io
+
+logger = logging.getLogger("bot.watcher")
+
+BASE = Path("repo")
+PACKAGES = BASE / "packages"
+IMAGES = BASE / "images"
+
+WATCH_ENABLED = os.getenv("WATCH_ENABLED", "1") == "1"
+WATCH_BACKEND = os.getenv("WATCH_BACKEND", "auto")             # auto | watchfiles | poll
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "2"))        # тишина перед пересборкой, с
+WATCH_MAX_DELAY = float(os.getenv("WATCH_MAX_DELAY", "60"))     # не дольше, чем столько, с
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2"))
+
+TEMP_SUFFIXES = (".tmp", ".part", ".partial", "~")
+
+
+def relevant(path: Path) -> bool:
+    """
+    Файлы, от которых зависит index.json. Временные файлы (rsync, cp,
+    atomic_write) и подкаталоги (.incoming, versions) не считаются.
+    """
+    if path == GENERATION_FILE:
+        return True     # изменения из других процессов (MODE=web)
+    name = path.name
+    if name.startswith(".") or name.endswith(TEMP_SUFFIXES):
+        return False
+    if path.parent == PACKAGES:
+        return name.endswith((".ipa", ".json"))
+    return path.parent == IMAGES
+
+
+def _snapshot(dirs) -> dict:
+    state = {}
+    for d in dirs:
+        try:
+            entries = os.scandir(d)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for e in entries:
+                try:
+                    if e.is_file():
+                        st = e.stat()
+                        state[e.path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+                except FileNotFoundError:
+                    continue
+    return state
+
+
+class IndexWatcher:
+    """
+    Следит за repo/packages и repo/images (inotify через watchfiles,
+    иначе опрос каталогов) и пересобирает index.json.
+
+    Всплеск изменений (rsync, копирование сотен IPA) склеивается в одну
+    задачу: пересборка запускается после WATCH_DEBOUNCE секунд тишины,
+    но не позже WATCH_MAX_DELAY после первого изменения. Сама пересборка
+    инкрементальная (catalog.sync) и идёт через очередь задач с ключом,
+    поэтому повторные срабатывания не плодят задачи.
+
+    Чужие увеличения счётчика repo/.cache/generation (правки метаданных
+    в процессах MODE=web) тоже запускают пересборку.
+    """
+
+    def __init__(self, dirs, debounce: float = WATCH_DEBOUNCE, max_delay: float = WATCH_MAX_DELAY):
+        self.dirs = [Path(d) for d in dirs]
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.backend = None
+        self.events = 0
+        self.rebuilds = 0
+        self._loop = None
+        self._event = None
+        self._first = None
+        self._pending = 0
+        self._images = set()
+        self._quiet = debounce
+        self._tasks = []
+
+    # ==============================
+    # Отметка изменений
+    # ==============================
+    def _mark(self, paths=()):
+        paths = [Path(p) for p in paths]
+        if paths and all(p == GENERATION_FILE for p in paths) and not generation.foreign():
+            return      # счётчик увеличил сам этот процесс
+        for path in paths:
+            if path.parent == IMAGES and path.suffix == ".png":
+                self._images.add(path.stem)     # иконка <app>.png меняет iconURL
+        self._pending += 1
+        self.events += 1
+        if self._first is None:
+            self._first = self._loop.time()
+        self._event.set()
+
+    def touch(self):
+        """
+        Изменение, которого не видно в файлах (SQLite-бэкенд, правки
+        через metastore). Можно вызывать из любого потока.
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._mark)
+
+    # ==============================
+    # Источники событий
+    # ==============================
+    async def _watch_inotify(self):
+        from watchfiles import awatch
+
+        # watchfiles отдаёт абсолютные пути
+        def rel(path: str) -> Path:
+            return Path(os.path.relpath(path))
+
+        async for changes in awatch(
+            *self.dirs,
+            watch_filter=lambda change, path: relevant(rel(path)),
+            recursive=False,
+            debounce=200,
+        ):
+            self._mark([rel(path) for _, path in changes])
+
+    async def _watch_poll(self, interval: float = WATCH_POLL_INTERVAL):
+        before = await run_io(_snapshot, self.dirs)
+        while True:
+            await asyncio.sleep(interval)
+            after = await run_io(_snapshot, self.dirs)
+            changed = [
+                Path(p) for p in set(before) | set(after)
+                if before.get(p) != after.get(p) and relevant(Path(p))
+            ]
+            before = after
+            if changed:
+                self._mark(changed)
+
+    def _pick_backend(self, kind: str):
+        if kind in ("auto", "watchfiles"):
+            try:
+                import watchfiles  # noqa: F401
+                return "watchfiles", self._watch_inotify
+            except ImportError:
+                if kind == "watchfiles":
+                    raise RuntimeError("WATCH_BACKEND=watchfiles, but watchfiles is not installed")
+        elif kind != "poll":
+            raise RuntimeError(f"Unknown WATCH_BACKEND: {kind}")
+        return "poll", self._watch_poll
+
+    # ==============================
+    # Debounce -> задача пересборки
+    # ==============================
+    async def _debounce(self):
+        while True:
+            await self._event.wait()
+            while True:
+                self._event.clear()
+                wait = self._quiet
+                if self.max_delay:
+                    wait = min(wait, self._first + self.max_delay - self._loop.time())
+                if wait <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._event.wait(), wait)
+                except asyncio.TimeoutError:
+                    break
+
+            changes, images = self._pending, self._images
+            self._first, self._pending, self._images = None, 0, set()
+            self._event.clear()
+
+            job = await job_queue.submit("sync_index", {"images": sorted(images)}, key="sync_index")
+            if images:
+                # задача уже стояла в очереди — дописываем ей иконки
+                job.args["images"] = sorted(images | set(job.args.get("images", [])))
+            self.rebuilds += 1
+            logger.info(f"{changes} change batch(es) in repo -> index rebuild #{job.id}")
+
+    async def start(self, kind: str = WATCH_BACKEND):
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        for d in self.dirs:
+            d.mkdir(parents=True, exist_ok=True)
+        self.backend, source = self._pick_backend(kind)
+        # при опросе тишина короче интервала ничего не значит
+        self._quiet = max(self.debounce, WATCH_POLL_INTERVAL * 1.5) if self.backend == "poll" else self.debounce
+        self._tasks = [
+            asyncio.create_task(source()),
+            asyncio.create_task(self._debounce()),
+        ]
+        logger.info(f"Watching {', '.join(map(str, self.dirs))} ({self.backend})")
+        # то, что поменялось, пока процесс не работал
+        self._mark()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+
+index_watcher = IndexWatcher([PACKAGES, IMAGES, GENERATION_FILE.parent])
@@ -0,0 +1,155 @@
+# bot/workers.py
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from bot.metrics import Gauge
+
+logger = logging.getLogger("bot.workers")
+
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or (os.cpu_count() or 1)
+
+
+class WorkerPool:
+    """
+    Обёртка над executor'ом: выносит блокирующую работу (диск, ZIP, JSON)
+    из общего event loop и считает глубину очереди и время ожидания.
+    """
+
+    def __init__(self, name: str, kind: str, max_workers: int):
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.active = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        # не fork: пул стартует лениво, когда потоки уже
+                        # держат flock (metastore, generation), и копии
+                        # дескрипторов в детях не дали бы локам освободиться
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.max_workers,
+                            mp_context=multiprocessing.get_context("forkserver"),
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers,
+                            thread_name_prefix=f"{self.name}-worker"
+                        )
+        return self._executor
+
+    def _record_start(self, submitted_at: float) -> float:
+        started = time.perf_counter()
+        wait = started - submitted_at
+        with self._lock:
+            self.active += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        return started
+
+    def _record_done(self, started: float):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            self.run_total += time.perf_counter() - started
+
+    def _call(self, submitted_at: float, func, args, kwargs):
+        started = self._record_start(submitted_at)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._record_done(started)
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+
+        if self.kind == "process":
+            # в дочерний процесс замыкание не передать — время ожидания
+            # здесь включает и время выполнения
+            started = self._record_start(submitted_at)
+            try:
+                return await loop.run_in_executor(
+                    self.executor(), functools.partial(func, *args, **kwargs)
+                )
+            finally:
+                self._record_done(started)
+
+        return await loop.run_in_executor(
+            self.executor(), self._call, submitted_at, func, args, kwargs
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": self.max_workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "active": self.active,
+                "queued": self.submitted - self.completed - self.active,
+                "wait_avg_ms": round(self.wait_total / done * 1000, 3),
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "run_avg_ms": round(self.run_total / done * 1000, 3),
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+io_pool = WorkerPool("io", "thread", IO_WORKERS)
+cpu_pool = WorkerPool("cpu", "process", CPU_WORKERS)
+
+
+async def run_io(func, *args, **kwargs):
+    """
+    Блокирующий ввод-вывод / парсинг — в пул потоков.
+    """
+    return await io_pool.run(func, *args, **kwargs)
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Тяжёлая CPU-работа — в пул процессов (func и аргументы должны pickle'иться).
+    """
+    return await cpu_pool.run(func, *args, **kwargs)
+
+
+def stats() -> dict:
+    return {"io": io_pool.stats(), "cpu": cpu_pool.stats()}
+
+
+def _pool_metric(field: str):
+    return lambda: {(name,): s[field] for name, s in stats().items()}
+
+
+Gauge("bw_worker_active", "Tasks running in the worker pool.", ("pool",), fn=_pool_metric("active"))
+Gauge("bw_worker_queued", "Tasks waiting for a pool worker.", ("pool",), fn=_pool_metric("queued"))
+Gauge("bw_worker_completed", "Tasks finished by the worker pool.", ("pool",), fn=_pool_metric("completed"))
+
+
+def shutdown():
+    io_pool.shutdown()
+    cpu_pool.shutdown()
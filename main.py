@@ -6,14 +6,40 @@ import asyncio
 import os
 import logging
 import json
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
+# до импорта bot.*: модули читают окружение при импорте
 load_dotenv()
 
+from bot.blobs import blob_store
+from bot.catalog import catalog
+from bot.generation import file_stamp, generation
+from bot.icons import VARIANT_RE
+from bot.ingest import UploadTooLarge, cleanup_incoming
+from bot.jobs import job_queue
+from bot import metrics
+from bot.metastore import metastore, MetadataCorrupt, PreconditionFailed
+from bot.search import search_index
+from bot.tasks import submit_publish
+from bot.versions import VERSIONS
+from bot.watcher import WATCH_ENABLED, index_watcher
+from bot.watchdog import PROFILE, loop_watchdog, profile_forever
+from bot.upload_sessions import upload_sessions, ChunkError, SessionForbidden, SessionLimit
+from bot.workers import run_io
+from web.auth import AuthError, request_user, signer
+from web.files import serve_file
+from web import index_cache
+from web.index_cache import index_response
+from web.metrics import MetricsMiddleware
+from web.multipart import MultipartError, check_length, receive_file
+from web.render import PageRenderer
+
 logging.basicConfig(
     level=logging.INFO,
     format='[%(asctime)s] [%(levelname)s] %(message)s',
@@ -31,65 +57,312 @@ BASE.mkdir(parents=True, exist_ok=True)
 PACKAGES.mkdir(parents=True, exist_ok=True)
 IMAGES.mkdir(parents=True, exist_ok=True)
 
-# ======== FastAPI app ========
-app = FastAPI(title="bw_ipa_repo")
+# ======== Режим запуска ========
+MODE = os.getenv("MODE", "all")                         # all | web | bot
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))        # процессы uvicorn в MODE=web
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+INDEX_JSON = BASE / "index.json"
+
+_index_stamp = None
+
 
-# ======== Функция проверки доступа ========
-def check_access(tgid: int) -> bool:
-    allowed = os.getenv("ALLOWED_IDS", "")
-    if not allowed:
+def reload_index() -> bool:
+    """
+    MODE=web: каталог и сжатые варианты index.json — из файла, который
+    пишет процесс бота. Перечитывается, только если файл сменился.
+    """
+    global _index_stamp
+    stamp = file_stamp(INDEX_JSON)
+    if stamp is None or stamp == _index_stamp:
         return False
-    return str(tgid) in allowed.split(",")
+    repo_data = json.loads(INDEX_JSON.read_text(encoding="utf-8"))
+    catalog.adopt(repo_data)
+    index_cache.publish(repo_data, INDEX_JSON)
+    _index_stamp = stamp
+    return True
+
+
+async def _on_generation():
+    await run_io(reload_index)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Запуск воркера MODE=web (в MODE=all всё поднимает start_services).
+    """
+    tasks = []
+    if MODE == "web":
+        await job_queue.start(per_process=True)
+        loop_watchdog.start()
+        background = [generation.follow(_on_generation), metrics.monitor_loop_lag()]
+        if PROFILE:
+            background.append(profile_forever())
+        tasks = [asyncio.create_task(c) for c in background]
+    yield
+    for task in tasks:
+        task.cancel()
+    if MODE == "web":
+        await job_queue.stop()
+        loop_watchdog.stop()
+
+
+# ======== FastAPI app ========
+app = FastAPI(title="bw_ipa_repo", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+# пусто — /metrics открыт (обычно закрыт на уровне сети/прокси)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# ======== Главная страница: серверный рендер из каталога ========
+page_renderer = PageRenderer(INDEX_HTML)
+
+# ======== index.json: готовые сжатые варианты в памяти ========
+catalog.on_publish(index_cache.publish)
+if MODE == "web":
+    catalog.follow_index()
+    reload_index()
+else:
+    index_cache.load_from_disk(INDEX_JSON)
 
 # ======== Корневой маршрут / ========
-@app.get("/", response_class=FileResponse)
-async def root_index():
-    if INDEX_HTML.exists():
-        return FileResponse(INDEX_HTML)
-    return JSONResponse({"error": "index template not found"}, status_code=404)
+@app.get("/", response_class=HTMLResponse)
+async def root_index(q: str = "", category: str = "", page: int = 1):
+    body = page_renderer.cached(q, category, page)
+    if body is None:
+        if not INDEX_HTML.exists():
+            return JSONResponse({"error": "index template not found"}, status_code=404)
+        body = await run_io(page_renderer.render, q, category, page)
+    return HTMLResponse(body, headers={"Cache-Control": "no-cache"})
 
 # ======== API: получить index.json ========
 @app.get("/repo/index.json")
-async def get_index():
-    p = BASE / "index.json"
-    if p.exists():
-        logger.info("Serving index.json")
-        return FileResponse(p)
+async def get_index(request: Request):
+    resp = index_response(request)
+    if resp is not None:
+        return resp
     logger.warning("index.json not found")
     return JSONResponse({"error": "index.json not found"}, status_code=404)
 
 # ======== API: получение IPA файлов ========
 @app.get("/repo/packages/{file_name}")
-async def get_package(file_name: str):
+async def get_package(file_name: str, request: Request):
     p = PACKAGES / file_name
-    if p.exists():
-        logger.info(f"Serving package {file_name}")
-        return FileResponse(p)
+    if p.is_file():
+        logger.debug(f"Serving package {file_name}")
+        return await serve_file(request, p)
     logger.warning(f"Package not found: {file_name}")
     return JSONResponse({"error": "file not found"}, status_code=404)
 
+# ======== API: сборки из истории версий ========
+@app.get("/repo/packages/versions/{app_dir}/{file_name}")
+async def get_package_version(app_dir: str, file_name: str, request: Request):
+    p = VERSIONS / app_dir / file_name
+    if not app_dir.startswith(".") and not file_name.startswith(".") and p.is_file():
+        logger.debug(f"Serving package {app_dir}/{file_name}")
+        return await serve_file(request, p)
+    logger.warning(f"Package not found: {app_dir}/{file_name}")
+    return JSONResponse({"error": "file not found"}, status_code=404)
+
 # ======== API: получение картинок ========
 @app.get("/repo/images/{file_name}")
-async def get_image(file_name: str):
+async def get_image(file_name: str, request: Request):
     p = IMAGES / file_name
     if p.exists():
-        logger.info(f"Serving image {file_name}")
-        return FileResponse(p)
+        logger.debug(f"Serving image {file_name}")
+        # имена вариантов иконок содержат хэш содержимого
+        cache = "public, max-age=31536000, immutable" if VARIANT_RE.match(file_name) else None
+        return await serve_file(request, p, cache_control=cache)
     logger.warning(f"Image not found: {file_name}")
     return JSONResponse({"error": "file not found"}, status_code=404)
 
-# ======== Загрузка IPA ========
-@app.post("/upload")
-async def upload_ipa(file: UploadFile = File(...)):
-    filename = file.filename
-    target = PACKAGES / filename
+# ======== Авторизация WebApp ========
+def _auth_error(e: AuthError):
+    return JSONResponse({"ok": False, "error": str(e)}, status_code=401)
+
 
-    with open(target, "wb") as f:
-        while chunk := await file.read(1024 * 1024):
-            f.write(chunk)
+@app.post("/api/auth")
+async def api_auth(request: Request):
+    body = await request.json()
+    try:
+        session = signer().issue(body.get("initData", ""))
+    except AuthError as e:
+        logger.warning(f"WebApp auth failed: {e}")
+        return _auth_error(e)
+    return {"ok": True, **session}
 
-    logger.info(f"Uploaded {filename}")
-    return {"status": "ok", "saved": filename}
+# ======== Загрузка IPA ========
+@app.post("/upload")
+async def upload_ipa(request: Request):
+    # авторизация и размер — до чтения тела
+    try:
+        request_user(request)
+    except AuthError as e:
+        return _auth_error(e)
+
+    started = time.perf_counter()
+    try:
+        check_length(request)
+        # тело разбирается потоком прямо в repo/packages/.incoming
+        writer = await receive_file(request, "file")
+    except UploadTooLarge:
+        logger.warning("Upload too large")
+        return JSONResponse({"status": "error", "error": "File too large"}, status_code=413)
+    except MultipartError as e:
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=400)
+    except ValueError:
+        return JSONResponse({"status": "error", "error": "Only .ipa files are allowed"}, status_code=400)
+    try:
+        target = await run_io(writer.commit)
+    except BaseException:
+        await run_io(writer.abort)
+        raise
+    metrics.UPLOAD_SECONDS.observe(time.perf_counter() - started, ("single",))
+    metrics.UPLOAD_BYTES.inc(writer.size, ("single",))
+
+    server_url = os.getenv("SERVER_URL", "").rstrip("/")
+    # разбор и index.json — в фоне, клиент получает id задачи
+    job = await submit_publish(target, server_url, writer.sha256)
+
+    logger.info(f"Uploaded {writer.name}")
+    return {"status": "ok", "saved": writer.name, "size": writer.size, "sha256": writer.sha256, "job": job.id}
+
+# ======== Возобновляемая загрузка по чанкам ========
+def _session_error(e: Exception):
+    if isinstance(e, AuthError):
+        return _auth_error(e)
+    if isinstance(e, KeyError):
+        return JSONResponse({"ok": False, "error": "Upload session not found"}, status_code=404)
+    if isinstance(e, SessionForbidden):
+        return JSONResponse({"ok": False, "error": "Upload session belongs to another user"}, status_code=403)
+    if isinstance(e, UploadTooLarge):
+        return JSONResponse({"ok": False, "error": "File too large"}, status_code=413)
+    if isinstance(e, SessionLimit):
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=429)
+    return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+
+
+@app.post("/upload/sessions")
+async def upload_session_create(request: Request):
+    try:
+        user_id = request_user(request)
+    except AuthError as e:
+        return _auth_error(e)
+
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        return _session_error(ChunkError("Expected a JSON object"))
+    try:
+        session = await run_io(
+            upload_sessions.create,
+            body.get("filename", ""),
+            body.get("size", 0),
+            body.get("chunk_size"),
+            body.get("sha256"),
+            user_id,
+        )
+    except (ValueError, ChunkError, SessionLimit, UploadTooLarge) as e:
+        return _session_error(e)
+    return {"ok": True, **session.status()}
+
+
+@app.get("/upload/sessions/{session_id}")
+async def upload_session_status(session_id: str, request: Request):
+    try:
+        user_id = request_user(request)
+        session = await run_io(upload_sessions.get, session_id, user_id)
+    except (AuthError, KeyError, SessionForbidden) as e:
+        return _session_error(e)
+    return {"ok": True, **session.status()}
+
+
+@app.put("/upload/sessions/{session_id}/chunks/{index}")
+async def upload_session_chunk(session_id: str, index: int, request: Request):
+    try:
+        user_id = request_user(request)
+        session = await run_io(upload_sessions.get, session_id, user_id)
+        data = await request.body()
+        await run_io(session.write_chunk, index, data, request.headers.get("x-chunk-sha256", ""))
+    except (AuthError, KeyError, SessionForbidden, ChunkError) as e:
+        return _session_error(e)
+    return {"ok": True, "index": index}
+
+
+@app.post("/upload/sessions/{session_id}/finalize")
+async def upload_session_finalize(session_id: str, request: Request):
+    try:
+        user_id = request_user(request)
+        session = await run_io(upload_sessions.get, session_id, user_id)
+        target, sha256 = await run_io(session.assemble)
+    except (AuthError, KeyError, SessionForbidden, ChunkError) as e:
+        return _session_error(e)
+    metrics.UPLOAD_SECONDS.observe(time.time() - session.state["created"], ("chunked",))
+    metrics.UPLOAD_BYTES.inc(session.state["size"], ("chunked",))
+
+    server_url = os.getenv("SERVER_URL", "").rstrip("/")
+    job = await submit_publish(target, server_url, sha256)
+
+    logger.info(f"Uploaded {target.name} (chunked)")
+    return {"status": "ok", "saved": target.name, "size": session.state["size"], "sha256": sha256, "job": job.id}
+
+
+@app.delete("/upload/sessions/{session_id}")
+async def upload_session_abort(session_id: str, request: Request):
+    try:
+        user_id = request_user(request)
+        session = await run_io(upload_sessions.get, session_id, user_id)
+    except (AuthError, KeyError, SessionForbidden) as e:
+        return _session_error(e)
+    await run_io(session.abort)
+    return {"ok": True}
+
+# ======== API: состояние фоновой задачи ========
+@app.get("/api/jobs/{job_id}")
+async def api_job_status(job_id: str, request: Request):
+    try:
+        request_user(request)
+    except AuthError as e:
+        return _auth_error(e)
+
+    state = await run_io(job_queue.find, job_id)
+    if state is None:
+        return JSONResponse({"ok": False, "error": "Job not found"}, status_code=404)
+    return {"ok": True, **state}
+
+# ======== Метрики Prometheus ========
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        return JSONResponse({"error": "unauthorized"}, status_code=401)
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# ======== API: поиск по каталогу ========
+@app.get("/api/apps")
+async def api_search_apps(
+    q: str = "",
+    category: str = "",
+    min_os: str = "",
+    ios: str = "",
+    limit: int = 50,
+    cursor: str = "",
+    fields: str = "",
+):
+    if search_index.stale():
+        # пересборка индексов (~200 мс на 10k приложений) — не на loop
+        await run_io(search_index.refresh)
+    try:
+        result = search_index.search(
+            q=q, category=category, min_os=min_os, ios=ios, limit=limit,
+            cursor=cursor or None,
+            fields=[f for f in fields.split(",") if f] or None,
+        )
+    except (ValueError, TypeError):
+        return JSONResponse({"ok": False, "error": "Bad cursor"}, status_code=400)
+    return JSONResponse({"ok": True, **result})
 
 # ==========================================================
 #       API ДЛЯ WEBAPP: /api/app/get и /api/app/update
@@ -97,24 +370,28 @@ async def upload_ipa(file: UploadFile = File(...)):
 
 # ==== GET: получить данные JSON ====
 @app.get("/api/app/get")
-async def api_get_app(app: str, tgid: int):
+async def api_get_app(app: str, request: Request):
 
-    if not check_access(int(tgid)):
-        return JSONResponse({"ok": False, "error": "Access denied"})
+    try:
+        request_user(request)
+    except AuthError as e:
+        return _auth_error(e)
 
-    file = PACKAGES / f"{app}.json"
-    if not file.exists():
+    try:
+        data, etag = await run_io(metastore.read, app)
+    except KeyError:
         return JSONResponse({"ok": False, "error": "JSON not found"})
-
-    data = json.loads(file.read_text("utf-8"))
+    except MetadataCorrupt:
+        return JSONResponse({"ok": False, "error": "JSON is corrupted"}, status_code=500)
 
     return JSONResponse({
         "ok": True,
+        "etag": etag,
         "name": data.get("name", ""),
         "description": data.get("description", ""),
         "bundle": data.get("bundleIdentifier", ""),
         "version": data.get("versions", [{}])[0].get("version", "")
-    })
+    }, headers={"ETag": etag})
 
 # ==== POST: обновление JSON ====
 @app.post("/api/app/update")
@@ -123,56 +400,99 @@ async def api_update_app(request: Request):
     body = await request.json()
 
     app_name = body.get("app")
-    tgid = body.get("tgid")
 
-    if not app_name or not tgid:
-        return JSONResponse({"ok": False, "error": "Missing params"})
+    try:
+        request_user(request)
+    except AuthError as e:
+        return _auth_error(e)
 
-    if not check_access(int(tgid)):
-        return JSONResponse({"ok": False, "error": "Access denied"})
+    if not app_name:
+        return JSONResponse({"ok": False, "error": "Missing params"})
 
-    file = PACKAGES / f"{app_name}.json"
-    if not file.exists():
+    def mutate(data):
+        # Обновляем поля
+        data["name"] = body.get("name", data.get("name"))
+        data["description"] = body.get("description", data.get("description"))
+        data["bundleIdentifier"] = body.get("bundle", data.get("bundleIdentifier"))
+
+        if not data.get("versions"):
+            data["versions"] = [{}]
+
+        data["versions"][0]["version"] = body.get(
+            "version",
+            data["versions"][0].get("version")
+        )
+
+    # If-Match: правка применяется только к той версии, что видел клиент
+    if_match = request.headers.get("if-match") or body.get("etag")
+    try:
+        _, etag = await metastore.update(app_name, mutate, if_match=if_match)
+    except KeyError:
         return JSONResponse({"ok": False, "error": "JSON not found"})
-
-    data = json.loads(file.read_text("utf-8"))
-
-    # Обновляем поля
-    data["name"] = body.get("name", data.get("name"))
-    data["description"] = body.get("description", data.get("description"))
-    data["bundleIdentifier"] = body.get("bundle", data.get("bundleIdentifier"))
-
-    if "versions" not in data:
-        data["versions"] = [{}]
-
-    data["versions"][0]["version"] = body.get(
-        "version",
-        data["versions"][0].get("version")
-    )
-
-    file.write_text(json.dumps(data, indent=4, ensure_ascii=False), "utf-8")
+    except MetadataCorrupt:
+        return JSONResponse({"ok": False, "error": "JSON is corrupted"}, status_code=500)
+    except PreconditionFailed:
+        return JSONResponse(
+            {"ok": False, "error": "Приложение изменено другим пользователем, обновите страницу"},
+            status_code=412,
+        )
 
     logger.info(f"Updated {app_name}.json")
 
-    return JSONResponse({"ok": True})
+    return JSONResponse({"ok": True, "etag": etag}, headers={"ETag": etag})
 
 # ==========================================================
 
 # ======== Статика /webapp ========
 app.mount("/webapp", StaticFiles(directory="webapp", html=True), name="webapp")
 
-# ======== Запуск Telegram бота и FastAPI ========
-from bot.bot import start_bot  # локальный импорт
-
-async def start_services():
+# ======== Запуск: MODE=all | web | bot ========
+async def start_services(mode: str = MODE):
+    """
+    all — FastAPI и бот в одном процессе и одном event loop (как раньше);
+    bot — только бот, очередь задач и наблюдатель за repo (он же пишет
+    index.json); HTTP в этом случае — отдельные процессы MODE=web.
+    """
+    # бот (и BOT_TOKEN) нужен только здесь
+    from bot.bot import start_bot
+
+    await run_io(cleanup_incoming)
+    await run_io(blob_store.adopt)
+    await run_io(blob_store.gc)
+    await run_io(catalog.load)
+    await job_queue.start()
+    if WATCH_ENABLED:
+        await index_watcher.start()
+    loop_watchdog.start()
+
+    services = [start_bot(), metrics.monitor_loop_lag()]
+    if PROFILE:
+        services.append(profile_forever())
+    if mode == "all":
+        import uvicorn
+        cfg = uvicorn.Config(app, host=HOST, port=PORT, log_level="info")
+        services.append(uvicorn.Server(cfg).serve())
+        logger.info("Starting FastAPI + Telegram bot...")
+    else:
+        logger.info("Starting Telegram bot (HTTP runs in MODE=web processes)...")
+    await asyncio.gather(*services)
+
+
+def run_web():
+    """
+    MODE=web: только HTTP, WEB_WORKERS процессов uvicorn. Каталог каждый
+    воркер читает из index.json и перечитывает по счётчику поколений.
+    """
     import uvicorn
-    host = "0.0.0.0"
-    port = int(os.getenv("PORT", 8000))
-    cfg = uvicorn.Config(app, host=host, port=port, log_level="info")
-    server = uvicorn.Server(cfg)
-    logger.info("Starting FastAPI + Telegram bot...")
-    await asyncio.gather(server.serve(), start_bot())
+    logger.info(f"Starting FastAPI with {WEB_WORKERS} worker(s)...")
+    uvicorn.run("main:app", host=HOST, port=PORT, workers=WEB_WORKERS, log_level="info")
+
 
 if __name__ == "__main__":
-    logger.info("Starting main.py")
-    asyncio.run(start_services())
\ No newline at end of file
+    logger.info(f"Starting main.py (MODE={MODE})")
+    if MODE == "web":
+        run_web()
+    elif MODE in ("all", "bot"):
+        asyncio.run(start_services(MODE))
+    else:
+        raise SystemExit(f"Unknown MODE: {MODE}")
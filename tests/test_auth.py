@@ -0,0 +1,95 @@
+# tests/test_auth.py
+
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import pytest
+
+from web import auth
+from web.auth import AuthError, SessionSigner, verify_init_data
+
+TOKEN = "123456:TEST"
+
+
+def _init_data(user_id: int = 1, age: int = 0, token: str = TOKEN) -> str:
+    # подпись как у Telegram.WebApp.initData
+    fields = {
+        "auth_date": str(int(time.time()) - age),
+        "query_id": "q",
+        "user": json.dumps({"id": user_id, "first_name": "A"}),
+    }
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+@pytest.fixture(autouse=True)
+def allowed(monkeypatch):
+    monkeypatch.setattr(auth.access, "check", lambda user_id: user_id == 1)
+
+
+def test_valid_init_data():
+    assert verify_init_data(_init_data(), TOKEN)["id"] == 1
+
+
+def test_tampered_init_data():
+    data = _init_data()
+    with pytest.raises(AuthError, match="signature"):
+        verify_init_data(data.replace("%22id%22%3A+1", "%22id%22%3A+2"), TOKEN)
+    with pytest.raises(AuthError, match="signature"):
+        verify_init_data(_init_data(token="654321:OTHER"), TOKEN)
+    with pytest.raises(AuthError, match="without hash"):
+        verify_init_data(data.split("&hash=")[0], TOKEN)
+
+
+def test_expired_init_data():
+    with pytest.raises(AuthError, match="expired"):
+        verify_init_data(_init_data(age=120), TOKEN, max_age=60)
+    assert verify_init_data(_init_data(age=30), TOKEN, max_age=60)["id"] == 1
+
+
+def test_session_token_roundtrip():
+    signer = SessionSigner(TOKEN)
+    session = signer.issue(_init_data())
+    assert session["user_id"] == 1
+    assert signer.verify(session["token"]) == 1
+    # повтор — из LRU
+    assert signer.verify(session["token"]) == 1
+
+
+def test_issue_rejects_users_without_access():
+    with pytest.raises(AuthError, match="Access denied"):
+        SessionSigner(TOKEN).issue(_init_data(user_id=2))
+
+
+def test_forged_session_token():
+    signer = SessionSigner(TOKEN)
+    token = signer.issue(_init_data())["token"]
+    user_id, expires, signature = token.split(".")
+
+    with pytest.raises(AuthError, match="Bad session token"):
+        signer.verify(f"2.{expires}.{signature}")
+    with pytest.raises(AuthError, match="Bad session token"):
+        signer.verify(f"{user_id}.{int(expires) + 3600}.{signature}")
+    with pytest.raises(AuthError, match="Bad session token"):
+        SessionSigner("654321:OTHER").verify(token)
+    with pytest.raises(AuthError, match="Malformed"):
+        signer.verify("garbage")
+
+
+def test_expired_session_token(monkeypatch):
+    signer = SessionSigner(TOKEN, ttl=60)
+    token = signer.issue(_init_data())["token"]
+    assert signer.verify(token) == 1
+
+    # истечение проверяется и для токена, уже лежащего в LRU
+    later = time.time() + 120
+    monkeypatch.setattr(auth.time, "time", lambda: later)
+    with pytest.raises(AuthError, match="expired"):
+        signer.verify(token)
+    with pytest.raises(AuthError, match="expired"):
+        signer.verify(token)
@@ -0,0 +1,99 @@
+# tests/test_files.py
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from web.files import MAX_RANGES, parse_range, serve_file
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=900-2000", [(900, 999)]),          # конец за файлом обрезается
+    ("bytes=-100", [(900, 999)]),              # суффикс: последние N байт
+    ("bytes=-5000", [(0, 999)]),               # суффикс длиннее файла — весь файл
+    ("bytes=500-", [(500, 999)]),              # открытый конец
+    ("bytes=999-", [(999, 999)]),
+    ("BYTES = 0-0", [(0, 0)]),
+    ("bytes=0-9, 20-29,-10", [(0, 9), (20, 29), (990, 999)]),
+    ("bytes=0-9,5000-6000", [(0, 9)]),        # неудовлетворимые части отбрасываются
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=1000-",
+    "bytes=5000-6000",
+    "bytes=-0",
+    "bytes=50-10",
+    "bytes=1000-1100,2000-",
+    "bytes=abc",
+    "bytes=0-x",
+    "items=0-10",
+    "bytes=",
+])
+def test_unsatisfiable_ranges(header):
+    assert parse_range(header, SIZE) is None
+
+
+def test_empty_file_has_no_satisfiable_ranges():
+    assert parse_range("bytes=0-", 0) is None
+    assert parse_range("bytes=-10", 0) is None
+
+
+def test_number_of_ranges_is_capped():
+    header = "bytes=" + ",".join(f"{i}-{i}" for i in range(MAX_RANGES + 10))
+    assert len(parse_range(header, SIZE)) == MAX_RANGES
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "App.ipa"
+    path.write_bytes(bytes(i % 251 for i in range(SIZE)))
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return await serve_file(request, path)
+
+    return TestClient(app), path.read_bytes()
+
+
+def test_single_range_response(client):
+    c, data = client
+    r = c.get("/file", headers={"Range": "bytes=-100"})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes 900-999/{SIZE}"
+    assert r.content == data[900:]
+
+
+def test_unsatisfiable_range_response(client):
+    c, _ = client
+    r = c.get("/file", headers={"Range": "bytes=5000-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{SIZE}"
+
+
+def test_multi_range_response(client):
+    c, data = client
+    r = c.get("/file", headers={"Range": "bytes=0-9,500-,-10"})
+    assert r.status_code == 206
+    media_type, _, boundary = r.headers["content-type"].partition("; boundary=")
+    assert media_type == "multipart/byteranges"
+    assert int(r.headers["content-length"]) == len(r.content)
+
+    parts = r.content.split(f"--{boundary}".encode())
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    bodies = {}
+    for part in parts[1:-1]:
+        head, _, body = part.strip(b"\r\n").partition(b"\r\n\r\n")
+        content_range = [line for line in head.split(b"\r\n") if line.startswith(b"Content-Range")][0]
+        bodies[content_range.decode()] = body
+    assert bodies == {
+        f"Content-Range: bytes 0-9/{SIZE}": data[0:10],
+        f"Content-Range: bytes 500-999/{SIZE}": data[500:],
+        f"Content-Range: bytes 990-999/{SIZE}": data[990:],
+    }
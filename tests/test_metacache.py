@@ -0,0 +1,58 @@
+# tests/test_metacache.py
+
+import io
+import os
+import plistlib
+import zipfile
+from pathlib import Path
+
+from PIL import Image
+
+from bot.metacache import MetadataCache
+
+
+def _make_ipa(path: Path, color: str):
+    icon = io.BytesIO()
+    Image.new("RGBA", (120, 120), color).save(icon, "PNG")
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("Payload/Foo.app/Info.plist", plistlib.dumps({
+            "CFBundleName": "Foo",
+            "CFBundleIdentifier": "com.foo",
+            "CFBundleShortVersionString": "1.0",
+            "CFBundleIcons": {"CFBundlePrimaryIcon": {"CFBundleIconFiles": ["AppIcon60x60"]}},
+        }))
+        zf.writestr("Payload/Foo.app/AppIcon60x60@2x.png", icon.getvalue())
+
+
+def _files(meta: dict) -> list:
+    urls = [meta["iconURL"]] + [icon[k] for icon in meta["icons"] for k in ("png", "webp")]
+    return [Path("repo/images") / Path(url).name for url in urls]
+
+
+def test_alias_gets_own_icon_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("repo/images").mkdir(parents=True)
+    packages = Path("repo/packages")
+    packages.mkdir()
+    cache = MetadataCache(tmp_path / "metadata.json")
+
+    foo, bar = packages / "Foo.ipa", packages / "Bar.ipa"
+    _make_ipa(foo, "red")
+    foo_meta = cache.extract(foo)
+    os.link(foo, bar)       # тот же блоб под другим именем
+
+    bar_meta = cache.extract(bar)
+    assert cache.misses == 1            # Bar не разбирался заново
+    assert bar_meta["iconURL"] == "/repo/images/Bar.png"
+    assert all(p.name.startswith("Bar") for p in _files(bar_meta))
+    assert bar_meta["name"] == foo_meta["name"]
+
+    red = Path("repo/images/Bar.png").read_bytes()
+
+    # новая иконка у Foo не трогает файлы Bar
+    foo.unlink()
+    _make_ipa(foo, "blue")
+    cache.invalidate(foo)
+    cache.extract(foo)
+    assert all(p.exists() for p in _files(bar_meta))
+    assert Path("repo/images/Bar.png").read_bytes() == red
@@ -0,0 +1,104 @@
+# tests/test_telegram_download.py
+
+import asyncio
+import importlib
+
+import pytest
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.download import http_client
+
+TOKEN = "123456:TEST"
+PAYLOAD = b"PK\x03\x04" + b"ipa" * 10000
+
+
+@pytest.fixture
+def handlers(tmp_path, monkeypatch):
+    # пути в bot.* относительные; при импорте handlers создаёт repo/ и users.json
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("bot.handlers")
+
+
+async def _with_stub_api(file_path: str, served: bytes, test):
+    """
+    Заглушка Bot API: getFile отдаёт file_path (абсолютный, как у
+    telegram-bot-api --local), /file/... — содержимое для HTTP-загрузки.
+    """
+    requests = []
+
+    async def get_file(request):
+        requests.append("getFile")
+        return web.json_response({"ok": True, "result": {
+            "file_id": "doc", "file_unique_id": "u", "file_size": len(served), "file_path": file_path,
+        }})
+
+    async def file(request):
+        requests.append("file")
+        return web.Response(body=served)
+
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/getFile", get_file)
+    app.router.add_get(f"/file/bot{TOKEN}/{{path:.*}}", file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    api = TelegramAPIServer.from_base(f"http://{host}:{port}", is_local=True)
+    bot = Bot(TOKEN, session=AiohttpSession(api=api))
+    try:
+        return await test(bot), requests
+    finally:
+        await bot.session.close()
+        await http_client.close()
+        await runner.cleanup()
+
+
+def test_local_file_is_hardlinked(handlers, tmp_path):
+    src = tmp_path / "botapi" / "documents" / "file_1.ipa"
+    src.parent.mkdir(parents=True)
+    src.write_bytes(PAYLOAD)
+
+    target, requests = asyncio.run(_with_stub_api(
+        str(src), b"", lambda bot: handlers._download_via_telegram_url(bot, "doc", "App.ipa", len(PAYLOAD)),
+    ))
+
+    assert target == handlers.PACKAGES / "App.ipa"
+    assert target.stat().st_ino == src.stat().st_ino
+    assert src.exists()
+    assert requests == ["getFile"]
+
+
+def test_local_file_is_moved(handlers, tmp_path, monkeypatch):
+    monkeypatch.setattr(handlers, "BOT_API_MOVE", True)
+    src = tmp_path / "botapi" / "documents" / "file_2.ipa"
+    src.parent.mkdir(parents=True)
+    src.write_bytes(PAYLOAD)
+    inode = src.stat().st_ino
+
+    target, requests = asyncio.run(_with_stub_api(
+        str(src), b"", lambda bot: handlers._download_via_telegram_url(bot, "doc", "App.ipa", len(PAYLOAD)),
+    ))
+
+    assert target.stat().st_ino == inode
+    assert not src.exists()
+    assert target.read_bytes() == PAYLOAD
+    assert requests == ["getFile"]
+
+
+def test_missing_local_file_falls_back_to_http(handlers, tmp_path):
+    # каталог сервера не смонтирован сюда — файл берётся по /file/...
+    missing = tmp_path / "elsewhere" / "file_3.ipa"
+
+    target, requests = asyncio.run(_with_stub_api(
+        str(missing), PAYLOAD, lambda bot: handlers._download_via_telegram_url(bot, "doc", "App.ipa", len(PAYLOAD)),
+    ))
+
+    assert target == handlers.PACKAGES / "App.ipa"
+    assert target.read_bytes() == PAYLOAD
+    assert "file" in requests
+    assert not list(handlers.PACKAGES.glob(".incoming/*.part"))
@@ -0,0 +1,71 @@
+# tests/test_upload_sessions.py
+
+import os
+import time
+
+import pytest
+
+from bot import upload_sessions as us
+from bot.upload_sessions import ChunkError, SessionLimit, UploadSessions
+
+MB = 1024 * 1024
+
+
+@pytest.mark.parametrize("chunk_size", ["abc", 1.5, [1], {"a": 1}, True])
+def test_bad_chunk_size_is_chunk_error(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ChunkError):
+        UploadSessions().create("App.ipa", MB, chunk_size, owner=1)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"filename": None, "size": MB},
+    {"filename": "App.ipa", "size": "1e6"},
+    {"filename": "App.ipa", "size": None},
+    {"filename": "App.ipa", "size": MB, "sha256": "zz"},
+])
+def test_bad_params_are_chunk_errors(tmp_path, monkeypatch, kwargs):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ChunkError):
+        UploadSessions().create(owner=1, **kwargs)
+    assert not list(us.INCOMING.glob("*.part"))
+
+
+def test_sessions_per_owner_capped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(us, "UPLOAD_SESSIONS_PER_USER", 2)
+    sessions = UploadSessions()
+    sessions.create("A.ipa", MB, owner=1)
+    sessions.create("B.ipa", MB, owner=1)
+    with pytest.raises(SessionLimit):
+        sessions.create("C.ipa", MB, owner=1)
+    # у другого пользователя своя квота
+    sessions.create("C.ipa", MB, owner=2)
+    assert len(list(us.INCOMING.glob("*.part"))) == 3
+
+
+def test_reserved_bytes_per_owner_capped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(us, "UPLOAD_RESERVED_PER_USER", 3 * MB)
+    sessions = UploadSessions()
+    first = sessions.create("A.ipa", 2 * MB, owner=1)
+    with pytest.raises(SessionLimit):
+        sessions.create("B.ipa", 2 * MB, owner=1)
+    first.abort()
+    sessions.create("B.ipa", 2 * MB, owner=1)
+
+
+def test_idle_sessions_expire_before_allocating(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(us, "UPLOAD_SESSIONS_PER_USER", 1)
+    sessions = UploadSessions()
+    stale = sessions.create("A.ipa", MB, owner=1)
+    old = time.time() - us.UPLOAD_SESSION_IDLE - 60
+    os.utime(stale.state_path, (old, old))
+
+    fresh = sessions.create("B.ipa", MB, owner=1)
+    assert not stale.part_path.exists()
+    assert not stale.state_path.exists()
+    with pytest.raises(KeyError):
+        sessions.get(stale.id)
+    assert sessions.get(fresh.id, 1).state["filename"] == "B.ipa"
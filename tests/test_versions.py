@@ -0,0 +1,53 @@
+# tests/test_versions.py
+
+from bot import versions
+from bot.versions import add_version, store_version, version_url
+
+
+def _publish(app_meta: dict, target, version: str, build: str, keep: int):
+    target.write_bytes(f"{target.stem} {version} {build}".encode())
+    entry = store_version(target, {"version": version, "build": build}, "")
+    return add_version(app_meta, entry, keep=keep)
+
+
+def test_apps_with_same_bundle_keep_own_history(tmp_path, monkeypatch):
+    # пути в bot.versions относительные (repo/packages/...)
+    monkeypatch.chdir(tmp_path)
+    versions.PACKAGES.mkdir(parents=True)
+    alpha, beta = versions.PACKAGES / "Alpha.ipa", versions.PACKAGES / "Beta.ipa"
+    alpha_meta = {"bundleIdentifier": "com.alpha"}
+    beta_meta = {"bundleIdentifier": "com.alpha"}
+
+    _publish(beta_meta, beta, "1.0", "7", keep=2)
+    _publish(alpha_meta, alpha, "1.0", "7", keep=2)
+    _publish(alpha_meta, alpha, "1.1", "8", keep=2)
+    _publish(alpha_meta, alpha, "1.2", "9", keep=2)
+
+    beta_build = versions.path_from_url(beta_meta["versions"][0]["downloadURL"])
+    assert beta_build.is_file()
+    assert beta_build.read_bytes() == b"Beta 1.0 7"
+    assert [v["version"] for v in alpha_meta["versions"]] == ["1.2", "1.1"]
+    assert not (versions.VERSIONS / "Alpha" / "1.0+7.ipa").exists()
+
+
+def test_shared_legacy_build_is_not_pruned(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions.PACKAGES.mkdir(parents=True)
+    legacy = versions.VERSIONS / "com.alpha" / "1.0+7.ipa"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"old")
+    entry = {"downloadURL": version_url(legacy, ""), "version": "1.0", "buildVersion": "7"}
+    alpha_meta = {"versions": [entry]}
+
+    _publish(alpha_meta, versions.PACKAGES / "Alpha.ipa", "1.1", "8", keep=1)
+    assert not legacy.exists()
+
+    legacy.write_bytes(b"old")
+    alpha_meta = {"versions": [entry]}
+    removed = add_version(
+        alpha_meta,
+        store_version(versions.PACKAGES / "Alpha.ipa", {"version": "1.2", "build": "9"}, ""),
+        keep=1,
+        in_use=lambda path: path == legacy,
+    )
+    assert legacy.exists() and removed == []
@@ -0,0 +1 @@
+# web package
\ No newline at end of file
@@ -0,0 +1,143 @@
+# web/auth.py
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+from bot.access import access
+
+logger = logging.getLogger("web.auth")
+
+SESSION_TTL = int(os.getenv("WEBAPP_SESSION_TTL", "3600"))
+INIT_DATA_MAX_AGE = int(os.getenv("WEBAPP_INIT_DATA_MAX_AGE", "86400"))
+CACHE_SIZE = 1024
+
+
+class AuthError(Exception):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def verify_init_data(init_data: str, bot_token: str, max_age: int = INIT_DATA_MAX_AGE) -> dict:
+    """
+    Проверка Telegram.WebApp.initData (HMAC-SHA256 от токена бота).
+    Возвращает объект user из initData.
+    """
+    fields = dict(parse_qsl(init_data or "", keep_blank_values=True))
+    received = fields.pop("hash", "")
+    if not received:
+        raise AuthError("initData without hash")
+
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        raise AuthError("initData signature mismatch")
+
+    try:
+        auth_date = int(fields.get("auth_date", "0"))
+        user = json.loads(fields.get("user", "{}"))
+        int(user["id"])
+    except (ValueError, KeyError, TypeError):
+        raise AuthError("initData without user")
+    if time.time() - auth_date > max_age:
+        raise AuthError("initData expired")
+    return user
+
+
+class SessionSigner:
+    """
+    Короткоживущие токены "<user_id>.<expires>.<подпись>" для API
+    веб-приложения. initData проверяется один раз при выдаче токена;
+    дальше — сравнение HMAC за постоянное время и LRU уже проверенных
+    токенов, так что повторный запрос стоит один поиск в словаре.
+    """
+
+    def __init__(self, bot_token: str, ttl: int = SESSION_TTL, cache_size: int = CACHE_SIZE):
+        self.bot_token = bot_token
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._key = hmac.new(b"WebAppSession", bot_token.encode(), hashlib.sha256).digest()
+        self._verified = OrderedDict()      # token -> (user_id, expires)
+        self._lock = threading.Lock()
+
+    def _sign(self, payload: str) -> str:
+        return _b64(hmac.new(self._key, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, init_data: str) -> dict:
+        user = verify_init_data(init_data, self.bot_token)
+        user_id = int(user["id"])
+        if not access.check(user_id):
+            raise AuthError("Access denied")
+
+        expires = int(time.time()) + self.ttl
+        payload = f"{user_id}.{expires}"
+        token = f"{payload}.{self._sign(payload)}"
+        logger.info(f"WebApp session issued for {user_id}")
+        return {"token": token, "expires": expires, "user_id": user_id}
+
+    def verify(self, token: str) -> int:
+        """
+        user_id по токену; AuthError — токен подделан или истёк.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._verified.get(token)
+            if cached is not None:
+                self._verified.move_to_end(token)
+
+        if cached is None:
+            try:
+                user_id, expires, signature = token.split(".")
+                cached = (int(user_id), int(expires))
+            except (ValueError, AttributeError):
+                raise AuthError("Malformed session token")
+            if not hmac.compare_digest(self._sign(f"{user_id}.{expires}"), signature):
+                raise AuthError("Bad session token")
+            with self._lock:
+                self._verified[token] = cached
+                while len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+
+        user_id, expires = cached
+        if expires < now:
+            with self._lock:
+                self._verified.pop(token, None)
+            raise AuthError("Session expired")
+        if not access.check(user_id):
+            raise AuthError("Access denied")
+        return user_id
+
+
+_signer = None
+
+
+def signer() -> SessionSigner:
+    global _signer
+    if _signer is None:
+        token = os.getenv("BOT_TOKEN")
+        if not token:
+            raise RuntimeError("BOT_TOKEN not set in env")
+        _signer = SessionSigner(token)
+    return _signer
+
+
+def request_user(request) -> int:
+    """
+    user_id из заголовка Authorization: Bearer <token>.
+    """
+    header = request.headers.get("authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise AuthError("Not authorized")
+    return signer().verify(token.strip())
@@ -0,0 +1,186 @@
+# web/files.py
+
+import mimetypes
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from bot.workers import run_io
+
+CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16
+
+
+# ==============================
+# ETag / Last-Modified
+# ==============================
+def make_etag(size: int, mtime_ns: int) -> str:
+    """
+    Сильный ETag из размера и mtime файла.
+    """
+    return f'"{size:x}-{mtime_ns:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    tags = [t.strip() for t in header.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """
+    If-None-Match (приоритетнее) / If-Modified-Since → 304.
+    """
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, etag)
+
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_ok(request: Request, etag: str, mtime: float) -> bool:
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range.strip() == etag
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_range).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+# ==============================
+# Range
+# ==============================
+def parse_range(header: str, size: int):
+    """
+    Разбирает Range: bytes=... в список (start, end) включительно.
+    Возвращает None, если ни один диапазон не удовлетворим.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(",")[:MAX_RANGES]:
+        part = part.strip()
+        start_s, sep, end_s = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if start_s == "":
+                length = int(end_s)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(start_s)
+                end = int(end_s) if end_s else size - 1
+        except ValueError:
+            return None
+
+        if start >= size or start > end:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    return ranges or None
+
+
+async def _iter_file(path: Path, ranges):
+    f = await run_io(open, path, "rb")
+    try:
+        for start, end, prefix in ranges:
+            if prefix:
+                yield prefix
+            await run_io(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_io(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    finally:
+        await run_io(f.close)
+
+
+# ==============================
+# Ответ с файлом
+# ==============================
+async def serve_file(request: Request, path: Path, cache_control: str = None) -> Response:
+    """
+    FileResponse c ETag, условными GET (304) и Range (206, в т.ч. multipart).
+    """
+    st = await run_io(os.stat, path)
+    size = st.st_size
+    etag = make_etag(size, st.st_mtime_ns)
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+
+    if is_not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    range_header = request.headers.get("range")
+    if range_header and _if_range_ok(request, etag, st.st_mtime):
+        ranges = parse_range(range_header, size)
+        if ranges is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_file(path, [(start, end, None)]),
+                status_code=206, media_type=media_type, headers=headers
+            )
+
+        boundary = secrets.token_hex(12)
+        parts = []
+        length = 0
+        for start, end in ranges:
+            prefix = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode()
+            if parts:
+                prefix = b"\r\n" + prefix
+            parts.append((start, end, prefix))
+            length += len(prefix) + end - start + 1
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        length += len(tail)
+
+        async def body():
+            async for chunk in _iter_file(path, parts):
+                yield chunk
+            yield tail
+
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(
+            body(), status_code=206,
+            media_type=f"multipart/byteranges; boundary={boundary}", headers=headers
+        )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
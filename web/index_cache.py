@@ -0,0 +1,139 @@
+# web/index_cache.py
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from web.files import is_not_modified
+
+try:
+    import brotli
+except ImportError:  # brotli — опциональная зависимость
+    brotli = None
+
+logger = logging.getLogger("web.index_cache")
+
+WRITE_TO_DISK = os.getenv("INDEX_PRECOMPRESS_DISK", "0") == "1"
+CACHE_CONTROL = "public, max-age=60, must-revalidate"
+
+
+class IndexVariants:
+    """
+    Готовые варианты index.json: минифицированный, gzip и brotli.
+    Собираются один раз при публикации индекса, отдаются из памяти.
+    """
+
+    def __init__(self):
+        # (bodies, etag, mtime) подменяются одним присваиванием,
+        # чтобы читатели не увидели смесь версий
+        self.current = ({}, None, 0.0)
+
+    @property
+    def bodies(self) -> dict:
+        return self.current[0]
+
+    def build(self, repo_data: dict, mtime: float):
+        raw = json.dumps(repo_data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        bodies = {
+            "identity": raw,
+            "gzip": gzip.compress(raw, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            bodies["br"] = brotli.compress(raw, quality=11)
+
+        etag = hashlib.sha256(raw).hexdigest()[:32]
+        self.current = (bodies, etag, mtime)
+
+    def write_to_disk(self, index_file: Path):
+        for encoding, suffix in (("gzip", ".gz"), ("br", ".br")):
+            body = self.bodies.get(encoding)
+            if body is None:
+                continue
+            target = index_file.with_name(index_file.name + suffix)
+            tmp = target.with_name(target.name + ".tmp")
+            tmp.write_bytes(body)
+            os.replace(tmp, target)
+
+    def choose(self, accept_encoding: str) -> str:
+        """
+        Выбор варианта по Accept-Encoding с учётом q-значений.
+        """
+        accepted = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            q = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name.strip().lower()] = q
+
+        for encoding in ("br", "gzip"):
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if encoding in self.bodies and q > 0:
+                return encoding
+        return "identity"
+
+
+index_variants = IndexVariants()
+
+
+def publish(repo_data: dict, index_file: Path):
+    """
+    Колбэк каталога: вызывается после записи index.json.
+    """
+    index_variants.build(repo_data, index_file.stat().st_mtime)
+    if WRITE_TO_DISK:
+        index_variants.write_to_disk(index_file)
+    logger.info(
+        "index.json variants rebuilt: "
+        + ", ".join(f"{k}={len(v)}" for k, v in index_variants.bodies.items())
+    )
+
+
+def load_from_disk(index_file: Path) -> bool:
+    """
+    Первичная загрузка уже опубликованного index.json при старте.
+    """
+    if not index_file.exists():
+        return False
+    try:
+        publish(json.loads(index_file.read_text(encoding="utf-8")), index_file)
+    except Exception:
+        logger.exception("Failed to load index.json")
+        return False
+    return True
+
+
+def index_response(request: Request):
+    """
+    Ответ из памяти без обращения к файловой системе. None — индекса нет.
+    """
+    bodies, etag, mtime = index_variants.current
+    if not bodies:
+        return None
+
+    encoding = index_variants.choose(request.headers.get("accept-encoding", ""))
+    # у каждого представления свой сильный ETag
+    etag = f'"{etag}"' if encoding == "identity" else f'"{etag}-{encoding}"'
+
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": CACHE_CONTROL,
+    }
+    if is_not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=bodies[encoding], media_type="application/json", headers=headers)
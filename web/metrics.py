@@ -0,0 +1,44 @@
+# web/metrics.py
+
+import time
+
+from bot.metrics import HTTP_BYTES, HTTP_LATENCY
+
+
+class MetricsMiddleware:
+    """
+    Чистый ASGI-middleware (без BaseHTTPMiddleware: тот буферизует
+    потоковые ответы). Меряет время до последнего байта тела и размер
+    тела ответа; маршрут — имя обработчика FastAPI (get_index,
+    get_package, ...), чтобы число рядов не зависело от URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            name = getattr(route, "name", None) or (
+                "static" if scope["path"].startswith("/webapp") else "other"
+            )
+            HTTP_LATENCY.observe(time.perf_counter() - started, (name, scope["method"], str(status)))
+            if sent:
+                HTTP_BYTES.inc(sent, (name,))
@@ -0,0 +1,141 @@
+# web/multipart.py
+
+from fastapi import Request
+
+from bot.ingest import MAX_UPLOAD_SIZE, IngestWriter, UploadTooLarge
+from bot.workers import run_io
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:     # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# заголовки частей и граница поверх самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+WRITE_BUFFER = 1024 * 1024
+
+
+class MultipartError(ValueError):
+    pass
+
+
+def check_length(request: Request, max_size: int = MAX_UPLOAD_SIZE):
+    """
+    Content-Length больше лимита — отказ до чтения тела.
+    """
+    length = request.headers.get("content-length")
+    if length is None:
+        return
+    try:
+        length = int(length)
+    except ValueError:
+        raise MultipartError("Bad Content-Length")
+    if length > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLarge(f"Content-Length {length}")
+
+
+async def receive_file(request: Request, field: str = "file") -> IngestWriter:
+    """
+    Разбирает multipart/form-data по мере чтения request.stream() и
+    пишет часть field сразу в IngestWriter — без SpooledTemporaryFile
+    Starlette и второго копирования. Остальные поля пропускаются.
+    Тело сверх лимита обрывает загрузку (UploadTooLarge).
+
+    Возвращает writer с записанным файлом, commit() — за вызывающим.
+    ValueError — плохое имя файла, MultipartError — нет файла/формата.
+    """
+    ctype, params = parse_options_header(request.headers.get("content-type"))
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise MultipartError("Expected multipart/form-data")
+
+    events = []
+    header = {"field": b"", "value": b"", "headers": {}}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        header["headers"][header["field"].lower()] = header["value"]
+        header["field"], header["value"] = b"", b""
+
+    def on_headers_finished():
+        events.append(("part", header["headers"]))
+        header["headers"] = {}
+
+    def on_part_data(data, start, end):
+        events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    writer = None
+    target = None           # writer, пока идёт нужная часть
+    buffer, buffered = [], 0
+    received = 0
+    limit = MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+
+    async def flush():
+        nonlocal buffer, buffered
+        if buffer:
+            await run_io(target.write, b"".join(buffer))
+            buffer, buffered = [], 0
+
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise UploadTooLarge(f"request body: more than {limit} bytes")
+            try:
+                parser.write(chunk)
+            except ValueError as e:     # MultipartParseError
+                raise MultipartError(f"Bad multipart body: {e}")
+
+            for kind, value in events:
+                if kind == "part":
+                    _, disposition = parse_options_header(value.get(b"content-disposition"))
+                    name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    filename = disposition.get(b"filename")
+                    if name == field and filename is not None and writer is None:
+                        writer = IngestWriter(filename.decode("utf-8", "replace"))
+                        await run_io(writer.open)
+                        target = writer
+                elif target is None:
+                    continue
+                elif kind == "data":
+                    buffer.append(value)
+                    buffered += len(value)
+                    # IngestWriter.write сам проверяет лимит размера
+                    if buffered >= WRITE_BUFFER:
+                        await flush()
+                else:
+                    await flush()
+                    target = None
+            events.clear()
+
+        if target is not None:
+            raise MultipartError("Truncated multipart body")
+        try:
+            parser.finalize()
+        except ValueError as e:
+            raise MultipartError(f"Bad multipart body: {e}")
+    except BaseException:
+        if writer is not None:
+            await run_io(writer.abort)
+        raise
+
+    if writer is None:
+        raise MultipartError(f"No {field!r} file in the form")
+    return writer
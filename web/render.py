@@ -0,0 +1,160 @@
+# web/render.py
+
+import html
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlencode, quote
+
+from bot.catalog import catalog
+from bot.search import search_index
+
+logger = logging.getLogger("web.render")
+
+PAGE_SIZE = 24
+CACHE_SIZE = 256
+PLACEHOLDER_ICON = "https://via.placeholder.com/128"
+
+
+def _esc(value) -> str:
+    return html.escape(str(value or ""), quote=True)
+
+
+def _icon_html(app: dict) -> str:
+    name = _esc(app.get("name"))
+    icons = {i.get("size"): i for i in app.get("icons") or []}
+    small, large = icons.get(120), icons.get(180)
+
+    if small and large:
+        return (
+            "<picture>"
+            f'<source type="image/webp" srcset="{_esc(small["webp"])} 1x, {_esc(large["webp"])} 2x">'
+            f'<img src="{_esc(small["png"])}" srcset="{_esc(small["png"])} 1x, {_esc(large["png"])} 2x" '
+            f'alt="{name}" width="128" height="128" loading="lazy">'
+            "</picture>"
+        )
+
+    src = app.get("iconURL") or PLACEHOLDER_ICON
+    return f'<img src="{_esc(src)}" alt="{name}" loading="lazy">'
+
+
+def _card_html(app: dict) -> str:
+    version = (app.get("versions") or [{}])[0]
+    ipa_link = version.get("downloadURL") or "#"
+    return (
+        '<div class="app-card">'
+        f"{_icon_html(app)}"
+        f'<div class="app-name">{_esc(app.get("name") or "Unnamed")}</div>'
+        f'<div class="app-bundle">{_esc(app.get("bundleIdentifier"))}</div>'
+        f'<div class="app-version">{_esc(version.get("version") or "N/A")}</div>'
+        f'<a href="{_esc(ipa_link)}" class="download-btn" target="_blank">Скачать</a>'
+        f'<a href="ksing://add?url={_esc(quote(ipa_link, safe=""))}" class="ksing-btn">Скачать в Ksing</a>'
+        "</div>"
+    )
+
+
+class PageRenderer:
+    """
+    Серверный рендер главной страницы из каталога в памяти.
+    Готовые страницы кэшируются по (generation каталога, q, category, page)
+    и сбрасываются только при изменении каталога.
+    """
+
+    def __init__(self, template: Path):
+        self.template = template
+        self._template_text = None
+        self._template_mtime = None
+        self._cards = {}                # id(app) -> html карточки
+        self._pages = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _load_template(self) -> str:
+        mtime = self.template.stat().st_mtime_ns
+        if mtime != self._template_mtime:
+            self._template_text = self.template.read_text(encoding="utf-8")
+            self._template_mtime = mtime
+            self._pages.clear()
+        return self._template_text
+
+    def _check_generation(self):
+        if catalog.generation != self._generation:
+            self._generation = catalog.generation
+            self._pages.clear()
+            self._cards.clear()
+
+    def _card(self, app: dict) -> str:
+        # фрагменты карточек переживают смену страницы/фильтра
+        key = id(app)
+        card = self._cards.get(key)
+        if card is None:
+            card = self._cards[key] = _card_html(app)
+        return card
+
+    @staticmethod
+    def _pagination(page: int, pages: int, q: str, category: str) -> str:
+        if pages <= 1:
+            return ""
+        parts = []
+        for n in range(1, pages + 1):
+            if n == page:
+                parts.append(f'<span class="current">{n}</span>')
+                continue
+            params = {k: v for k, v in (("q", q), ("category", category), ("page", n)) if v}
+            parts.append(f'<a href="/?{_esc(urlencode(params))}">{n}</a>')
+        return "".join(parts)
+
+    def _render(self, template: str, q: str, category: str, page: int) -> bytes:
+        apps = catalog.apps()
+        search_index.refresh()
+        found = search_index.match(q, category) if q.strip() or category else apps
+
+        pages = max(1, -(-len(found) // PAGE_SIZE))
+        page = min(max(page, 1), pages)
+        chunk = found[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+
+        cards = "".join(self._card(app) for app in chunk) \
+            or '<p class="empty">Ничего не найдено</p>'
+
+        categories = sorted({app.get("category") for app in apps if app.get("category")})
+        options = "".join(
+            f'<option value="{_esc(c)}"{" selected" if c == category else ""}>{_esc(c)}</option>'
+            for c in categories
+        )
+
+        body = (
+            template
+            .replace("<!--QUERY-->", _esc(q))
+            .replace("<!--CATEGORIES-->", options)
+            .replace("<!--APPS-->", cards)
+            .replace("<!--PAGINATION-->", self._pagination(page, pages, q, category))
+        )
+        return body.encode("utf-8")
+
+    def cached(self, q: str, category: str, page: int):
+        """
+        Быстрая проверка кэша (без файловой системы). None — нужен render().
+        """
+        with self._lock:
+            if catalog.generation != self._generation:
+                return None
+            key = (q, category, page)
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+            return body
+
+    def render(self, q: str = "", category: str = "", page: int = 1) -> bytes:
+        with self._lock:
+            catalog.load()
+            template = self._load_template()
+            self._check_generation()
+
+            key = (q, category, page)
+            body = self._pages.get(key)
+            if body is None:
+                body = self._pages[key] = self._render(template, q, category, page)
+                while len(self._pages) > CACHE_SIZE:
+                    self._pages.popitem(last=False)
+            return body
@@ -0,0 +1,27 @@
+// Сессия WebApp: initData проверяется сервером один раз (/api/auth),
+// дальше запросы идут с коротким подписанным токеном.
+const SESSION_KEY = "webapp-session";
+
+async function getSessionToken() {
+    const saved = JSON.parse(sessionStorage.getItem(SESSION_KEY) || "null");
+    if (saved && saved.expires * 1000 > Date.now() + 60000) {
+        return saved.token;
+    }
+
+    const res = await fetch("/api/auth", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ initData: window.Telegram.WebApp.initData })
+    });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok || !data.ok) {
+        throw new Error(data.error || `HTTP ${res.status}`);
+    }
+
+    sessionStorage.setItem(SESSION_KEY, JSON.stringify({ token: data.token, expires: data.expires }));
+    return data.token;
+}
+
+async function authHeaders(headers = {}) {
+    return { ...headers, "Authorization": `Bearer ${await getSessionToken()}` };
+}
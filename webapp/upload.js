@@ -48,6 +48,113 @@ function handleFile(file) {
     }
 }
 
+// === Chunked upload ===
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const PARALLEL_CHUNKS = 4;
+const MAX_RETRIES = 5;
+
+function sessionKey(file) {
+    return `upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest("SHA-256", buffer);
+    return Array.from(new Uint8Array(digest))
+        .map(b => b.toString(16).padStart(2, "0"))
+        .join("");
+}
+
+async function api(method, url, body, headers = {}) {
+    const res = await fetch(url, { method, body, headers: await authHeaders(headers) });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok || data.ok === false) {
+        const err = new Error(data.error || `HTTP ${res.status}`);
+        err.status = res.status;
+        throw err;
+    }
+    return data;
+}
+
+// Продолжаем прошлую сессию для этого файла, если сервер её ещё помнит
+async function openSession(file) {
+    const key = sessionKey(file);
+    const saved = localStorage.getItem(key);
+    if (saved) {
+        try {
+            return await api("GET", `/upload/sessions/${saved}`);
+        } catch (e) {
+            localStorage.removeItem(key);
+        }
+    }
+
+    const session = await api("POST", "/upload/sessions", JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        chunk_size: CHUNK_SIZE
+    }), { "Content-Type": "application/json" });
+
+    localStorage.setItem(key, session.id);
+    return session;
+}
+
+async function uploadChunk(file, session, index) {
+    const start = index * session.chunk_size;
+    const blob = file.slice(start, Math.min(start + session.chunk_size, file.size));
+    const buffer = await blob.arrayBuffer();
+    const checksum = await sha256Hex(buffer);
+
+    for (let attempt = 1; ; attempt++) {
+        try {
+            await api("PUT", `/upload/sessions/${session.id}/chunks/${index}`, buffer, {
+                "Content-Type": "application/octet-stream",
+                "X-Chunk-SHA256": checksum
+            });
+            return buffer.byteLength;
+        } catch (e) {
+            if (attempt >= MAX_RETRIES || e.status === 404) throw e;
+            await new Promise(r => setTimeout(r, 500 * 2 ** attempt));
+        }
+    }
+}
+
+function makeProgress(total, alreadyLoaded) {
+    let loaded = alreadyLoaded;
+    let lastLoaded = loaded;
+    let lastTime = Date.now();
+
+    const render = () => {
+        const percent = Math.round((loaded / total) * 100);
+        progressBar.style.width = percent + "%";
+        statusDiv.innerText = `🔄 Uploading: ${percent}%`;
+
+        // === SPEED CALC ===
+        const now = Date.now();
+        const diffTime = (now - lastTime) / 1000;
+        if (diffTime >= 0.3) {
+            const speed = (loaded - lastLoaded) / diffTime;
+            const speedMB = (speed / (1024 * 1024)).toFixed(2);
+            const eta = speed > 0 ? (total - loaded) / speed : 0;
+            const etaStr = eta > 1 ? `${eta.toFixed(1)}s` : "<1s";
+
+            speedInfo.innerText = `⚡ ${speedMB} MB/s — ETA: ${etaStr}`;
+
+            lastLoaded = loaded;
+            lastTime = now;
+        }
+    };
+
+    render();
+    return (bytes) => { loaded += bytes; render(); };
+}
+
+async function waitJob(jobId) {
+    for (;;) {
+        const job = await api("GET", `/api/jobs/${jobId}`);
+        if (job.status === "done" || job.status === "failed") return job;
+        await new Promise(r => setTimeout(r, 1000));
+    }
+}
+
 // === Upload ===
 uploadBtn.addEventListener("click", async () => {
     if (!selectedFile) {
@@ -55,14 +162,7 @@ uploadBtn.addEventListener("click", async () => {
         return;
     }
 
-    const formData = new FormData();
-    formData.append("file", selectedFile);
-
-    const xhr = new XMLHttpRequest();
-    xhr.open("POST", "/upload", true);
-
-    let lastLoaded = 0;
-    let lastTime = Date.now();
+    const file = selectedFile;
 
     progressContainer.style.display = "block";
     speedInfo.style.display = "block";
@@ -70,49 +170,47 @@ uploadBtn.addEventListener("click", async () => {
     progressBar.style.width = "0%";
     speedInfo.innerText = "";
 
-    xhr.upload.onprogress = (event) => {
-        if (event.lengthComputable) {
-            const percent = Math.round((event.loaded / event.total) * 100);
-            progressBar.style.width = percent + "%";
-            statusDiv.innerText = `🔄 Uploading: ${percent}%`;
-
-            // === SPEED CALC ===
-            const now = Date.now();
-            const diffTime = (now - lastTime) / 1000;
-            const diffLoaded = event.loaded - lastLoaded;
+    try {
+        const session = await openSession(file);
 
-            if (diffTime >= 0.3) {
-                const speed = diffLoaded / diffTime;
-                const speedMB = (speed / (1024 * 1024)).toFixed(2);
-
-                const remaining = event.total - event.loaded;
-                const eta = remaining / speed;
-                const etaStr = eta > 1 ? `${eta.toFixed(1)}s` : "<1s";
+        const received = new Set(session.received);
+        const pending = [];
+        for (let i = 0; i < session.chunks; i++) {
+            if (!received.has(i)) pending.push(i);
+        }
 
-                speedInfo.innerText = `⚡ ${speedMB} MB/s — ETA: ${etaStr}`;
+        const doneBytes = session.received.reduce(
+            (sum, i) => sum + Math.min(session.chunk_size, file.size - i * session.chunk_size), 0
+        );
+        const onProgress = makeProgress(file.size, doneBytes);
 
-                lastLoaded = event.loaded;
-                lastTime = now;
+        // несколько чанков в полёте одновременно
+        const worker = async () => {
+            while (pending.length) {
+                const index = pending.shift();
+                onProgress(await uploadChunk(file, session, index));
             }
+        };
+        await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+        statusDiv.innerText = "🧩 Finalizing…";
+        const resp = await api("POST", `/upload/sessions/${session.id}/finalize`);
+        localStorage.removeItem(sessionKey(file));
+
+        progressBar.style.width = "100%";
+        speedInfo.innerText = "✅ Completed";
+
+        // файл принят, разбор и index.json — фоновая задача на сервере
+        statusDiv.innerText = `⚙️ Processing ${resp.saved}…`;
+        const job = await waitJob(resp.job);
+        if (job.status === "failed") {
+            statusDiv.innerText = `❌ Processing error: ${job.error}`;
+            return;
         }
-    };
 
-    xhr.onload = () => {
-        if (xhr.status === 200) {
-            const resp = JSON.parse(xhr.responseText);
-            progressBar.style.width = "100%";
-            speedInfo.innerText = "✅ Completed";
-
-            statusDiv.innerText = `🎉 Uploaded: ${resp.saved}`;
-            tg.MainButton.setText("Done!");
-        } else {
-            statusDiv.innerText = `❌ Upload error: ${xhr.status}`;
-        }
-    };
-
-    xhr.onerror = () => {
-        statusDiv.innerText = "❌ Network error during upload";
-    };
-
-    xhr.send(formData);
-});
\ No newline at end of file
+        statusDiv.innerText = `🎉 Uploaded: ${resp.saved}`;
+        tg.MainButton.setText("Done!");
+    } catch (e) {
+        statusDiv.innerText = `❌ Upload error: ${e.message}. Tap Upload to resume.`;
+    }
+});